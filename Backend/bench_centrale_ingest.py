@@ -0,0 +1,130 @@
+"""Benchmark di ingest: letture al secondo accettate da centrale per ciascun canale di ingresso.
+
+Confronta:
+  - http: una GET /update per lettura, come fa oggi l'intermediario della stazione
+  - udp:  protocollo a righe, `--batch` letture per datagramma
+  - tcp:  protocollo a righe su una connessione, scritto a blocchi di `--batch` righe
+
+Uso:
+    python bench_centrale_ingest.py [--readings 20000] [--batch 50]
+
+Il server gira in un processo figlio senza archivio su disco; ogni modo usa
+una stazione diversa e il conteggio viene letto da /stations.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+PORTA_HTTP = 18890
+PORTA_UDP = 18891
+PORTA_TCP = 18892
+
+
+def _server():
+    import logging
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    import centrale
+    from werkzeug.serving import make_server
+    centrale.PORTA_UDP = PORTA_UDP
+    centrale.PORTA_TCP = PORTA_TCP
+    centrale.avvia_pipeline()
+    centrale.avvia_ricevitore_linee()
+    server = make_server('127.0.0.1', PORTA_HTTP, centrale.app, threaded=True)
+    sys.stderr.write("pronto\n")
+    sys.stderr.flush()
+    server.serve_forever()
+
+
+def _conteggio(stazione):
+    connessione = http.client.HTTPConnection('127.0.0.1', PORTA_HTTP)
+    connessione.request('GET', '/stations')
+    dati = json.loads(connessione.getresponse().read())
+    connessione.close()
+    for s in dati['stations']:
+        if s['id'] == stazione:
+            return s['total_readings']
+    return 0
+
+
+def _attendi(stazione, attese, timeout=60):
+    """Attende che il conteggio smetta di crescere (o raggiunga `attese`)."""
+    precedente, scadenza = -1, time.perf_counter() + timeout
+    while time.perf_counter() < scadenza:
+        n = _conteggio(stazione)
+        if n >= attese or n == precedente:
+            return n
+        precedente = n
+        time.sleep(0.2)
+    return _conteggio(stazione)
+
+
+def _righe(stazione, inizio, n):
+    return ''.join(f"{stazione} - {20 + i % 10}.5 {50 + i % 7}\n" for i in range(inizio, inizio + n)).encode()
+
+
+def invia_http(n, batch):
+    for i in range(n):
+        connessione = http.client.HTTPConnection('127.0.0.1', PORTA_HTTP)
+        connessione.request('GET', f'/update?station=bench_http&temp={20 + i % 10}.5&hum={50 + i % 7}')
+        connessione.getresponse().read()
+        connessione.close()
+    return 'bench_http'
+
+
+def invia_udp(n, batch):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for i in range(0, n, batch):
+        s.sendto(_righe('bench_udp', i, min(batch, n - i)), ('127.0.0.1', PORTA_UDP))
+    s.close()
+    return 'bench_udp'
+
+
+def invia_tcp(n, batch):
+    s = socket.create_connection(('127.0.0.1', PORTA_TCP))
+    for i in range(0, n, batch):
+        s.sendall(_righe('bench_tcp', i, min(batch, n - i)))
+    s.close()
+    return 'bench_tcp'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readings', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--server', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.server:
+        _server()
+        return
+
+    processo = subprocess.Popen(
+        [sys.executable, __file__, '--server'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    try:
+        processo.stderr.readline()
+        print(f"{'modo':>6} {'inviate':>9} {'ricevute':>9} {'secondi':>8} {'letture/s':>10}")
+        # HTTP è molto più lento: si usa un decimo delle letture per tenere corto il test
+        for modo, invia, n in (
+            ('http', invia_http, max(1, args.readings // 10)),
+            ('udp', invia_udp, args.readings),
+            ('tcp', invia_tcp, args.readings),
+        ):
+            inizio = time.perf_counter()
+            stazione = invia(n, args.batch)
+            ricevute = _attendi(stazione, n)
+            durata = time.perf_counter() - inizio
+            print(f"{modo:>6} {n:>9} {ricevute:>9} {durata:>8.2f} {ricevute / durata:>10.0f}")
+    finally:
+        processo.kill()
+        processo.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,439 @@
+"""Replay di un centrale.dat registrato contro centrale, per provare ingest e streaming sotto carico.
+
+Ogni riga del file viene rispedita da `--stations` stazioni simulate a
+`--speed` volte il tempo reale (la spaziatura originale divisa per la
+velocità), mentre `--clients` client restano collegati a /stream, distribuiti
+tra le stazioni. Alla fine riporta:
+  - letture inviate/accettate e ritmo ottenuto rispetto a quello richiesto
+  - latenza ingest -> consegna (percentili): istante di ricezione sul client
+    meno il timestamp della lettura, che con /update è quello assegnato dal
+    server e con --endpoint batch l'istante di invio
+  - eventi persi: letture accettate per la stazione e mai arrivate a un
+    client, più i client scollegati dal server (es. perché troppo lenti)
+  - RSS del server (iniziale, massimo, finale) letto da /proc (solo Linux)
+  - coda e tempo per fase della pipeline di ingest del server (da /ingest)
+
+Uso:
+    python bench_centrale_replay.py centrale.dat [--speed 60] [--stations 4] [--clients 50]
+        [--endpoint update|batch] [--sse flask|asyncio] [--archive DIR] [--limit 5000]
+    python bench_centrale_replay.py centrale.dat --url http://host:8888 [--pid PID]
+
+Senza --url il server gira in un processo figlio (senza archivio su disco, a
+meno di --archive); la latenza ha senso solo se client e server condividono
+l'orologio, quindi sulla stessa macchina.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+from importa_centrale import parse_riga
+
+PORTA_HTTP = 18893
+PORTA_SSE = 18894
+
+
+def _server(porta, sse, archivio):
+    import logging
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    morbido, rigido = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (rigido, rigido))
+    import centrale
+    from werkzeug.serving import make_server
+    if archivio:
+        os.makedirs(archivio, exist_ok=True)
+        centrale.DATABASE_DIR = archivio
+        centrale.avvia_archivio()
+    centrale.avvia_pipeline()
+    if sse == 'asyncio':
+        centrale.SSE_PORTA = PORTA_SSE
+        centrale.avvia_server_sse()
+    server = make_server('127.0.0.1', porta, centrale.app, threaded=True)
+    server.socket.listen(1024)
+    sys.stderr.write("pronto\n")
+    sys.stderr.flush()
+    server.serve_forever()
+
+
+def leggi_registrazione(path, canali, limite=None):
+    """(offset in secondi dalla prima lettura, [valori]) delle righe valide del file."""
+    righe = []
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for riga in f:
+            if not riga.strip() or riga.lstrip().startswith('#'):
+                continue
+            try:
+                righe.append(parse_riga(riga, len(canali)))
+            except ValueError:
+                continue
+            if limite and len(righe) >= limite:
+                break
+    righe.sort(key=lambda r: r[0])
+    inizio = righe[0][0] if righe else 0
+    return [(ts - inizio, valori) for ts, valori in righe]
+
+
+class Memoria(threading.Thread):
+    """Campiona VmRSS di un processo ogni mezzo secondo."""
+
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.campioni = []
+
+    def rss(self):
+        with open(f'/proc/{self.pid}/status') as f:
+            for riga in f:
+                if riga.startswith('VmRSS:'):
+                    return int(riga.split()[1]) / 1024
+        return math.nan
+
+    def run(self):
+        while True:
+            try:
+                self.campioni.append(self.rss())
+            except OSError:
+                return
+            time.sleep(0.5)
+
+
+class Client:
+    """Un client /stream: conta gli eventi e registra la latenza di ciascuno."""
+
+    def __init__(self, host, porta, stazione):
+        self.host = host
+        self.porta = porta
+        self.stazione = stazione
+        self.ricevuti = 0
+        self.scollegato = False
+        self.errore = None
+        self.latenze = array('d')
+
+    async def _apri(self, host, porta, destinazione):
+        reader, writer = await asyncio.open_connection(host, porta)
+        writer.write(f"GET {destinazione} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+        stato = (await reader.readline()).split()
+        headers = {}
+        while True:
+            riga = await reader.readline()
+            if riga in (b'\r\n', b'\n', b''):
+                break
+            nome, _, valore = riga.decode('latin-1').partition(':')
+            headers[nome.strip().lower()] = valore.strip()
+        return reader, writer, stato[1] if len(stato) > 1 else b'', headers
+
+    async def _righe(self, reader, chunked):
+        """Righe del corpo, togliendo l'eventuale codifica chunked del server Flask."""
+        if not chunked:
+            while True:
+                riga = await reader.readline()
+                if not riga:
+                    return
+                yield riga
+        resto = b''
+        while True:
+            dimensione = int((await reader.readline()).strip() or b'0', 16)
+            if dimensione == 0:
+                return
+            dati = resto + await reader.readexactly(dimensione)
+            await reader.readline()
+            *righe, resto = dati.split(b'\n')
+            for riga in righe:
+                yield riga + b'\n'
+
+    async def esegui(self, pronto):
+        destinazione = '/stream?' + urlencode({'station': self.stazione})
+        try:
+            reader, writer, stato, headers = await self._apri(self.host, self.porta, destinazione)
+            if stato in (b'301', b'302', b'307'):
+                # Server SSE asyncio: /stream rimanda alla sua porta
+                writer.close()
+                url = urlsplit(headers['location'])
+                reader, writer, stato, headers = await self._apri(
+                    url.hostname, url.port, f"{url.path}?{url.query}")
+        except OSError as e:
+            stato, self.errore = b'', str(e)
+        if stato != b'200':
+            self.errore = self.errore or f"/stream ha risposto {stato.decode()}"
+            pronto()
+            return
+        pronto()
+        try:
+            async for riga in self._righe(reader, headers.get('transfer-encoding') == 'chunked'):
+                if not riga.startswith(b'data: '):
+                    continue
+                arrivo = time.time()
+                evento = json.loads(riga[6:])
+                if evento.get('type') != 'reading':
+                    continue
+                self.ricevuti += 1
+                self.latenze.append(arrivo - datetime.fromisoformat(evento['payload']['timestamp']).timestamp())
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        # Chiusura non richiesta: il server ha scollegato il client
+        self.scollegato = True
+        writer.close()
+
+
+class Invio:
+    """Spedisce le letture a /update (una richiesta ciascuna) o a /update/batch."""
+
+    def __init__(self, host, porta, endpoint, canali, thread):
+        self.host = host
+        self.porta = porta
+        self.endpoint = endpoint
+        self.canali = canali
+        self.pool = ThreadPoolExecutor(thread)
+        self.inviate = 0
+        self.accettate = {}
+        self.errori = 0
+        self.lock = threading.Lock()
+
+    def _richiesta(self, metodo, percorso, corpo=None, headers=None):
+        connessione = http.client.HTTPConnection(self.host, self.porta, timeout=30)
+        try:
+            connessione.request(metodo, percorso, corpo, headers or {})
+            risposta = connessione.getresponse()
+            return risposta.status, risposta.read()
+        finally:
+            connessione.close()
+
+    def _update(self, stazione, valori):
+        parametri = {'station': stazione}
+        parametri.update((nome, v) for nome, v in zip(self.canali, valori) if not math.isnan(v))
+        try:
+            stato, _ = self._richiesta('GET', '/update?' + urlencode(parametri))
+        except OSError:
+            stato = 0
+        self._conta(stazione, 1 if stato == 200 else 0, 0 if stato == 200 else 1)
+
+    def _batch(self, stazione, righe):
+        adesso = time.time()
+        corpo = ''.join(
+            json.dumps({
+                # Timestamp distinti anche per letture spedite nello stesso istante
+                'timestamp': adesso + i * 1e-6,
+                **{nome: v for nome, v in zip(self.canali, valori) if not math.isnan(v)},
+            }) + '\n'
+            for i, valori in enumerate(righe)
+        )
+        try:
+            stato, risposta = self._richiesta(
+                'POST', '/update/batch?' + urlencode({'station': stazione}), corpo.encode(),
+                {'Content-Type': 'application/x-ndjson'})
+            accettate = json.loads(risposta).get('accepted', 0) if stato == 200 else 0
+        except (OSError, ValueError):
+            accettate = 0
+        self._conta(stazione, accettate, len(righe) - accettate)
+
+    def _conta(self, stazione, accettate, errori):
+        with self.lock:
+            self.accettate[stazione] = self.accettate.get(stazione, 0) + accettate
+            self.errori += errori
+
+    def invia(self, stazione, righe):
+        self.inviate += len(righe)
+        if self.endpoint == 'batch':
+            self.pool.submit(self._batch, stazione, righe)
+        else:
+            for valori in righe:
+                self.pool.submit(self._update, stazione, valori)
+
+    def attendi(self):
+        self.pool.shutdown(wait=True)
+
+
+def replay(registrazione, stazioni, invio, velocita, intervallo_batch):
+    """Rispedisce la registrazione rispettando i tempi; restituisce la durata."""
+    inizio = time.perf_counter()
+    i = 0
+    while i < len(registrazione):
+        adesso = (time.perf_counter() - inizio) * velocita
+        dovute = []
+        while i < len(registrazione) and registrazione[i][0] <= adesso:
+            dovute.append(registrazione[i][1])
+            i += 1
+        if dovute:
+            if invio.endpoint == 'batch':
+                for stazione in stazioni:
+                    invio.invia(stazione, dovute)
+            else:
+                for valori in dovute:
+                    for stazione in stazioni:
+                        invio.invia(stazione, [valori])
+        if i < len(registrazione):
+            attesa = (registrazione[i][0] - adesso) / velocita
+            # In batch le letture dovute si accumulano per almeno intervallo_batch
+            time.sleep(max(attesa, intervallo_batch) if invio.endpoint == 'batch' else max(attesa, 0))
+    invio.attendi()
+    return time.perf_counter() - inizio
+
+
+async def _esegui(args, host, porta, registrazione, stazioni):
+    client = [Client(host, porta, stazioni[i % len(stazioni)]) for i in range(args.clients)]
+    collegati = 0
+    tutti_collegati = asyncio.Event()
+
+    def pronto():
+        nonlocal collegati
+        collegati += 1
+        if collegati == len(client):
+            tutti_collegati.set()
+
+    if not client:
+        tutti_collegati.set()
+    compiti = [asyncio.ensure_future(c.esegui(pronto)) for c in client]
+    await asyncio.wait_for(tutti_collegati.wait(), 60)
+    falliti = [c for c in client if c.errore]
+    if falliti:
+        print(f"{len(falliti)} client non collegati, es.: {falliti[0].errore}")
+        client = [c for c in client if not c.errore]
+    # Il primo evento di ogni client è l'ultima lettura già presente: non conta
+    await asyncio.sleep(0.5)
+    for c in client:
+        c.ricevuti = 0
+        del c.latenze[:]
+
+    invio = Invio(host, porta, args.endpoint, args.channels, args.senders)
+    durata = await asyncio.get_running_loop().run_in_executor(
+        None, replay, registrazione, stazioni, invio, args.speed, args.batch_interval)
+    await asyncio.sleep(args.drain)
+    scollegati = sum(c.scollegato for c in client)
+    for compito in compiti:
+        compito.cancel()
+    await asyncio.gather(*compiti, return_exceptions=True)
+    return client, invio, durata, scollegati
+
+
+def _stato_ingest(host, porta):
+    connessione = http.client.HTTPConnection(host, porta, timeout=10)
+    try:
+        connessione.request('GET', '/ingest')
+        risposta = connessione.getresponse()
+        return json.loads(risposta.read()) if risposta.status == 200 else None
+    except (OSError, ValueError):
+        return None
+    finally:
+        connessione.close()
+
+
+def _percentili(valori):
+    if not len(valori):
+        return "nessun evento"
+    ms = np.frombuffer(valori, dtype=np.float64) * 1000
+    p50, p90, p99, p999 = np.percentile(ms, [50, 90, 99, 99.9])
+    return f"p50 {p50:.1f} ms, p90 {p90:.1f} ms, p99 {p99:.1f} ms, p99.9 {p999:.1f} ms, max {ms.max():.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('file', nargs='?')
+    parser.add_argument('--speed', type=float, default=60, help="multiplo del tempo reale")
+    parser.add_argument('--stations', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--endpoint', choices=('update', 'batch'), default='update')
+    parser.add_argument('--batch-interval', type=float, default=0.2, help="secondi tra due POST batch per stazione")
+    parser.add_argument('--channels', default='temperature,humidity')
+    parser.add_argument('--limit', type=int, help="numero massimo di righe del file da usare")
+    parser.add_argument('--senders', type=int, default=8, help="thread che inviano le letture")
+    parser.add_argument('--drain', type=float, default=2.0, help="secondi di attesa degli ultimi eventi")
+    parser.add_argument('--sse', choices=('flask', 'asyncio'), default='flask')
+    parser.add_argument('--archive', help="cartella per archivio e storico del server (default: solo memoria)")
+    parser.add_argument('--url', help="server già in esecuzione invece di quello avviato dal tool")
+    parser.add_argument('--pid', type=int, help="pid del server di --url, per l'RSS")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.channels = [c.strip() for c in args.channels.split(',') if c.strip()]
+    if args.serve:
+        _server(PORTA_HTTP, args.sse, args.archive)
+        return 0
+    if not args.file:
+        parser.error("serve il file registrato")
+
+    registrazione = leggi_registrazione(args.file, args.channels, args.limit)
+    if not registrazione:
+        parser.error("nessuna lettura valida nel file")
+    stazioni = [f"replay{i}" for i in range(args.stations)]
+    morbido, rigido = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (rigido, rigido))
+
+    processo = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, porta, pid = url.hostname, url.port or 80, args.pid
+    else:
+        comando = [sys.executable, os.path.abspath(__file__), '--serve', '--sse', args.sse]
+        if args.archive:
+            comando += ['--archive', args.archive]
+        processo = subprocess.Popen(
+            comando, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        processo.stderr.readline()
+        host, porta, pid = '127.0.0.1', PORTA_HTTP, processo.pid
+
+    try:
+        # Le stazioni vengono create prima di collegare i client, che altrimenti riceverebbero 404
+        creazione = Invio(host, porta, 'update', args.channels, 1)
+        for stazione in stazioni:
+            creazione.invia(stazione, [registrazione[0][1]])
+        creazione.attendi()
+        if creazione.errori:
+            print(f"Impossibile creare {creazione.errori} stazioni (limite di stazioni del server?)")
+            return 1
+
+        memoria = Memoria(pid) if pid else None
+        if memoria:
+            memoria.start()
+        totale = len(registrazione) * len(stazioni)
+        durata_reale = registrazione[-1][0] / args.speed
+        print(f"{len(registrazione)} righe x {len(stazioni)} stazioni = {totale} letture in ~{durata_reale:.1f} s "
+              f"({args.speed:g}x, {totale / max(durata_reale, 1e-9):.0f} letture/s), {args.clients} client, "
+              f"endpoint {args.endpoint}")
+
+        client, invio, durata, scollegati = asyncio.run(_esegui(args, host, porta, registrazione, stazioni))
+
+        accettate = sum(invio.accettate.values())
+        attesi = sum(invio.accettate.get(c.stazione, 0) for c in client)
+        ricevuti = sum(c.ricevuti for c in client)
+        latenze = array('d')
+        for c in client:
+            latenze.extend(c.latenze)
+        print(f"Inviate {invio.inviate}, accettate {accettate}, errori {invio.errori} "
+              f"in {durata:.2f} s: {accettate / max(durata, 1e-9):.0f} letture/s")
+        print(f"Eventi ricevuti {ricevuti} su {attesi} attesi, persi {max(attesi - ricevuti, 0)}, "
+              f"client scollegati dal server {scollegati}")
+        print(f"Latenza ingest -> consegna: {_percentili(latenze)}")
+        if memoria and memoria.campioni:
+            print(f"RSS server: iniziale {memoria.campioni[0]:.1f} MB, massimo {max(memoria.campioni):.1f} MB, "
+                  f"finale {memoria.campioni[-1]:.1f} MB")
+        ingest = _stato_ingest(host, porta)
+        if ingest:
+            print(f"Coda di ingest ({ingest['policy']}): massimo {ingest['max_queued']} su {ingest['capacity']}, "
+                  f"scartate {ingest['dropped']}, rifiutate {ingest['rejected']}, attese {ingest['blocked']}")
+            for fase in ingest['stages']:
+                if fase['calls']:
+                    print(f"  {fase['name']:<12} {fase['calls']} chiamate, {fase['readings']} letture, "
+                          f"media {fase['mean_ms']:.3f} ms, massimo {fase['max_ms']:.3f} ms")
+    finally:
+        if processo is not None:
+            processo.kill()
+            processo.wait()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
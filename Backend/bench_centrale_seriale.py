@@ -0,0 +1,99 @@
+"""Prova del lettore seriale di centrale su una pty al posto della stazione.
+
+Misura le letture al secondo dalla porta seriale fino al buffer della
+stazione, poi stacca il dispositivo (chiude la pty) e ne collega uno nuovo:
+il lettore deve accorgersene, riaprire la porta e riprendere a leggere.
+
+Uso:
+    python bench_centrale_seriale.py [--readings 20000] [--batch 50]
+
+Serve una piattaforma con le pty (Linux, macOS). Centrale gira nello stesso
+processo, senza archivio su disco.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import tty
+
+
+def _pty():
+    """Apre una pty: il lato master fa da stazione, il nome dello slave da porta seriale."""
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+
+def _attendi(condizione, timeout=30):
+    scadenza = time.perf_counter() + timeout
+    while time.perf_counter() < scadenza:
+        if condizione():
+            return True
+        time.sleep(0.05)
+    return condizione()
+
+
+def _scrivi(master, n, batch):
+    for i in range(0, n, batch):
+        righe = ''.join(f"temp={20 + j % 10}.5 hum={50 + j % 7}\n" for j in range(i, min(i + batch, n)))
+        os.write(master, righe.encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readings', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=50)
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger().setLevel(logging.ERROR)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import centrale
+
+    master, slave, nome = _pty()
+    centrale.PORTA_SERIALE = nome
+    centrale.avvia_pipeline()
+    centrale.avvia_lettore_seriale()
+    lettore = centrale.lettore_seriale
+    lettore.attesa_massima = 1
+    buffer = centrale.stazioni.get().buffer
+    if not _attendi(lambda: lettore.connesso):
+        sys.exit(f"Il lettore non ha aperto {nome}")
+
+    print(f"{'prova':>13} {'inviate':>9} {'ricevute':>9} {'secondi':>8} {'letture/s':>10}")
+    prima = buffer.totale
+    inizio = time.perf_counter()
+    scrittore = threading.Thread(target=_scrivi, args=(master, args.readings, args.batch))
+    scrittore.start()
+    _attendi(lambda: buffer.totale - prima >= args.readings, timeout=120)
+    scrittore.join()
+    durata = time.perf_counter() - inizio
+    ricevute = buffer.totale - prima
+    print(f"{'continua':>13} {args.readings:>9} {ricevute:>9} {durata:>8.2f} {ricevute / durata:>10.0f}")
+
+    # Dispositivo staccato: il lettore deve chiudere la porta e ritentare
+    os.close(master)
+    os.close(slave)
+    staccato = _attendi(lambda: not lettore.connesso, timeout=10)
+    # Dispositivo di nuovo collegato (una pty nuova ha un altro nome: lo si comunica al lettore)
+    master, slave, lettore.porta = _pty()
+    inizio = time.perf_counter()
+    ricollegato = _attendi(lambda: lettore.connesso, timeout=10)
+    prima = buffer.totale
+    n = args.batch
+    _scrivi(master, n, args.batch)
+    _attendi(lambda: buffer.totale - prima >= n, timeout=10)
+    durata = time.perf_counter() - inizio
+    ricevute = buffer.totale - prima
+    print(f"{'riconnessione':>13} {n:>9} {ricevute:>9} {durata:>8.2f} {'':>10}")
+
+    lettore.ferma()
+    os.close(master)
+    os.close(slave)
+    if not (staccato and ricollegato and ricevute == n):
+        sys.exit(f"Riconnessione non riuscita (staccato={staccato}, ricollegato={ricollegato}, ricevute={ricevute})")
+
+
+if __name__ == '__main__':
+    main()
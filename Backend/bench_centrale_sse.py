@@ -0,0 +1,125 @@
+"""Benchmark delle connessioni SSE idle: memoria (RSS) del server al crescere dei client.
+
+Confronta i due modi di servire /stream:
+  - flask:   un thread del server di sviluppo per ogni client
+  - asyncio: tutti i client su un event loop (centrale_sse.ServerSSE)
+
+Uso:
+    python bench_centrale_sse.py [--mode flask|asyncio|entrambi] [--clients 100,500,1000,2000]
+
+Il server gira in un processo figlio senza archivio su disco; il processo
+padre apre le connessioni, attende che siano tutte servite e legge VmRSS e il
+numero di thread del figlio da /proc (solo Linux).
+"""
+import argparse
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+
+def _alza_limite_file():
+    morbido, rigido = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (rigido, rigido))
+
+
+def _server(modo, porta):
+    _alza_limite_file()
+    import centrale
+    centrale.HEARTBEAT_STREAM = 60
+    centrale.accoda_lettura(None, time.time(), {'temperature': 20.0, 'humidity': 50.0})
+    if modo == 'asyncio':
+        centrale.SSE_PORTA = porta
+        centrale.avvia_server_sse()
+        centrale.server_sse.heartbeat = 60
+        print("pronto", flush=True)
+        while True:
+            time.sleep(3600)
+    else:
+        import logging
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', porta, centrale.app, threaded=True)
+        server.socket.listen(1024)
+        print("pronto", flush=True)
+        server.serve_forever()
+
+
+def _memoria(pid):
+    rss = thread = 0
+    with open(f'/proc/{pid}/status') as f:
+        for riga in f:
+            if riga.startswith('VmRSS:'):
+                rss = int(riga.split()[1])
+            elif riga.startswith('Threads:'):
+                thread = int(riga.split()[1])
+    return rss / 1024, thread
+
+
+def _apri_client(porta, n):
+    client = []
+    for _ in range(n):
+        s = socket.create_connection(('127.0.0.1', porta))
+        s.sendall(b"GET /stream HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n")
+        client.append(s)
+    # Una connessione conta solo quando ha ricevuto header e primo evento
+    for s in client:
+        s.settimeout(30)
+        ricevuto = b''
+        while b'data:' not in ricevuto:
+            parte = s.recv(4096)
+            if not parte:
+                raise RuntimeError("connessione chiusa dal server")
+            ricevuto += parte
+    return client
+
+
+def misura(modo, passi, porta):
+    processo = subprocess.Popen(
+        [sys.executable, __file__, '--server', modo, '--port', str(porta)],
+        stdout=subprocess.PIPE, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    try:
+        processo.stdout.readline()
+        rss, thread = _memoria(processo.pid)
+        print(f"{modo:>8} {0:>8} {rss:>10.1f} {thread:>8} {'-':>10}")
+        client = []
+        for obiettivo in passi:
+            inizio = time.perf_counter()
+            client += _apri_client(porta, obiettivo - len(client))
+            durata = time.perf_counter() - inizio
+            time.sleep(0.5)
+            rss, thread = _memoria(processo.pid)
+            print(f"{modo:>8} {obiettivo:>8} {rss:>10.1f} {thread:>8} {durata:>10.2f}")
+        for s in client:
+            s.close()
+    finally:
+        processo.kill()
+        processo.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('flask', 'asyncio', 'entrambi'), default='entrambi')
+    parser.add_argument('--clients', default='100,500,1000,2000')
+    parser.add_argument('--port', type=int, default=18889)
+    parser.add_argument('--server', choices=('flask', 'asyncio'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.server:
+        _server(args.server, args.port)
+        return
+
+    _alza_limite_file()
+    passi = sorted(int(n) for n in args.clients.split(','))
+    modi = ('flask', 'asyncio') if args.mode == 'entrambi' else (args.mode,)
+    print(f"{'modo':>8} {'client':>8} {'RSS (MB)':>10} {'thread':>8} {'apertura s':>10}")
+    for modo in modi:
+        misura(modo, passi, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,328 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, redirect
 from flask_cors import CORS
 import json
 import time
 import os
 from datetime import datetime, timedelta
 import threading
+import math
+import atexit
+import fcntl
+import logging
+from urllib.parse import urlencode, urlsplit
+import numpy as np
+from centrale_allarmi import MotoreAllarmi
+from centrale_analisi import aggrega_bucket, combina_bucket, lttb
+from centrale_archivio import Scrittore, Storico
+from centrale_blocchi import DURATA_BLOCCO, CacheBlocchi, codifica_blocco
+from centrale_derivati import DERIVATI, calcola
+from centrale_percentili import COMPRESSIONE
+from centrale_pipeline import PipelineIngest, Sovraccarico
+from centrale_rete import RicevitoreLinee
+from centrale_rollup import livello_per_risoluzione
+from centrale_seriale import LettoreSeriale
+from centrale_sse import ServerSSE
+from centrale_statistiche import FINESTRE
+from centrale_stazioni import ALIAS_CANALI, CANALI, RegistroStazioni, canali_da_parametri, canali_richiesti, valida_lettura, valore_json
 
 app = Flask(__name__)
 CORS(app)
 
-sensor_readings = []
-ultima_temperatura = None  
-ultima_umidita = None
+# Capacità del buffer in memoria per stazione (default: 7 giorni di letture a 1 Hz)
+CAPACITA_BUFFER = int(os.environ.get('CENTRALE_CAPACITA', 7 * 24 * 3600))
+DATABASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'database')
+STAZIONE_PREDEFINITA = os.environ.get('CENTRALE_STAZIONE', 'centrale')
+# Giorni di letture conservati nello storico SQLite (0 = per sempre)
+RETENTION_GIORNI = float(os.environ.get('CENTRALE_RETENTION_GIORNI', 730))
+# Dopo quanti giorni un giorno (UTC) di letture viene compresso in un blocco e tolto dallo storico (0 = mai)
+SIGILLO_GIORNI = float(os.environ.get('CENTRALE_SIGILLO_GIORNI', 2))
+# Modalità debug di Flask, con il reloader (solo in sviluppo)
+DEBUG = os.environ.get('CENTRALE_DEBUG', 'False').lower() == 'true'
 
-def aggiorna_file():
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    target_dir = os.path.join(base_dir, '..', '..', 'database')
-    os.makedirs(target_dir, exist_ok=True)
-    file_path = os.path.join(target_dir, 'centrale.dat')
+# Prefisso dei segmenti di memoria condivisa per servire da più processi (vuoto = buffer nel solo processo)
+CONDIVISA = os.environ.get('CENTRALE_CONDIVISA', '')
+# Ogni quanto ogni processo controlla le letture arrivate dagli altri
+INTERVALLO_CONDIVISA = float(os.environ.get('CENTRALE_CONDIVISA_SECONDI', 0.05))
+# Memoria per i giorni sigillati già decodificati, con i canali derivati (0 = nessuna cache)
+CACHE_BLOCCHI_MB = float(os.environ.get('CENTRALE_CACHE_BLOCCHI_MB', 64))
+# Coda di ingest: letture in attesa della pipeline e cosa fare quando è piena
+# (block, drop-oldest o reject); con block si aspetta al massimo ATTESA secondi
+INGEST_CODA = int(os.environ.get('CENTRALE_INGEST_CODA', 10000))
+INGEST_POLITICA = os.environ.get('CENTRALE_INGEST_POLITICA', 'block')
+INGEST_ATTESA = float(os.environ.get('CENTRALE_INGEST_ATTESA', 1.0))
 
-    f = open(file_path, 'w', encoding='utf-8')
-    for reading in sensor_readings:
-        timestamp = reading.get('timestamp', '')
-        temperatura = reading.get('temperature', '')
-        umidita = reading.get('humidity', '')
-        f.write(f"{timestamp} {temperatura} {umidita}\n")
-    f.close()
+stazioni = RegistroStazioni(
+    CAPACITA_BUFFER, STAZIONE_PREDEFINITA,
+    condivisa=CONDIVISA or None,
+    capacita_coda=int(os.environ.get('CENTRALE_CONDIVISA_CODA', 65536)),
+    cache_blocchi=CacheBlocchi(int(CACHE_BLOCCHI_MB * 2**20)) if CACHE_BLOCCHI_MB > 0 else None,
+)
+
+# Tutte le scritture su disco passano dal thread dello scrittore
+scrittore = Scrittore(
+    dimensione_coda=int(os.environ.get('CENTRALE_CODA_SCRITTURE', 10000)),
+    intervallo_flush=float(os.environ.get('CENTRALE_FLUSH_SECONDI', 0.5)),
+    fsync=os.environ.get('CENTRALE_FSYNC', 'interval'),
+    intervallo_fsync=float(os.environ.get('CENTRALE_FSYNC_SECONDI', 60)),
+)
+storico = None
+# Processo che possiede log e storico (con la memoria condivisa gli altri processi non li aprono)
+pid_archivio = None
+_lock_archivio = None
+_pid_inseguitore = None
+_lock_inseguitore = threading.Lock()
+_pid_avvio = None
+_lock_avvio = threading.Lock()
+
+# Svegliata a ogni nuova lettura per spingere gli eventi ai client di /stream
+nuove_letture = threading.Condition()
+HEARTBEAT_STREAM = 15
+REPLAY_MASSIMO = 1000
+MAX_BATCH = 100000
+# Porta del server asyncio per /stream (0 = gli stream restano sui thread di Flask)
+SSE_PORTA = int(os.environ.get('CENTRALE_SSE_PORTA', 0))
+server_sse = None
+# Porta seriale della stazione (es. /dev/ttyUSB0); vuota = letture solo via HTTP
+PORTA_SERIALE = os.environ.get('CENTRALE_SERIALE', '')
+lettore_seriale = None
+# Porte del protocollo a righe per i nodi a microcontrollore (0 = disattivato)
+PORTA_UDP = int(os.environ.get('CENTRALE_UDP_PORTA', 0))
+PORTA_TCP = int(os.environ.get('CENTRALE_TCP_PORTA', 0))
+ricevitore_linee = None
+# Regole di allarme valutate a ogni lettura (file JSON, modificabile da /alerts/rules)
+allarmi = MotoreAllarmi(os.environ.get('CENTRALE_ALLARMI', os.path.join(DATABASE_DIR, 'centrale_allarmi.json')))
+
+def notifica_letture():
+    with nuove_letture:
+        nuove_letture.notify_all()
+    if server_sse is not None:
+        server_sse.notifica()
+
+def accoda_letture(id_stazione, letture):
+    """Percorso comune di ingest: valida l'id della stazione e accoda le letture alla pipeline.
+
+    `letture` è una lista di (ts, {canale: valore}) in qualsiasi ordine.
+    Restituisce l'id della stazione. Solleva ValueError se l'id non è valido,
+    Sovraccarico se la coda è piena. La stazione (e i suoi canali nuovi) la
+    crea la fase del buffer, perché può dover scrivere su disco.
+    """
+    id_stazione = stazioni.verifica_id(id_stazione)
+    pipeline.accoda(id_stazione, letture)
+    return id_stazione
+
+def accoda_lettura(id_stazione, ts, valori):
+    return accoda_letture(id_stazione, [(ts, valori)])
+
+def _fase_buffer(lotto):
+    try:
+        lotto.stazione = stazioni.ottieni_o_crea(lotto.id_stazione, lotto.colonne.keys())
+    except ValueError as e:
+        logging.warning("Letture della stazione %s scartate: %s", lotto.id_stazione, e)
+        return False
+    # Restano solo le letture nuove (un lotto rispedito non va contato di nuovo)
+    # e le correzioni, che vanno solo nello storico
+    lotto.ts, lotto.tutte, lotto.fuori, lotto.correzioni = lotto.stazione.nel_buffer(lotto.ts, lotto.colonne)
+    lotto.colonne = {nome: lotto.tutte[nome] for nome in lotto.colonne}
+    return len(lotto.ts) > 0 or len(lotto.correzioni[0]) > 0
+
+def _fase_rollup(lotto):
+    lotto.stazione.aggrega(lotto.ts, lotto.tutte)
+    return True
+
+def _fase_persistenza(lotto):
+    lotto.stazione.persisti(lotto.ts, lotto.tutte, lotto.correzioni)
+    return True
+
+def _fase_broadcast(lotto):
+    # Il log delle letture sta qui, sul thread della pipeline, non nelle richieste
+    logging.debug("%s | %d letture nuove, %d correzioni", lotto.stazione.id, len(lotto.ts), len(lotto.correzioni[0]))
+    if not lotto.stazione.condivisa and len(lotto.ts) > lotto.fuori:
+        # Con la memoria condivisa gli allarmi li valuta insegui_condivisa, in ogni processo;
+        # le letture rimaste fuori dal buffer sono vecchie e non fanno scattare allarmi
+        colonne = {nome: valori[lotto.fuori:] for nome, valori in lotto.colonne.items()}
+        _segnala_allarmi(allarmi.valuta_blocco(lotto.stazione.id, lotto.ts[lotto.fuori:], colonne))
+    return True
+
+# Le richieste validano e accodano; il thread della pipeline applica le fasi in ordine
+pipeline = PipelineIngest(
+    [('buffer', _fase_buffer), ('rollup', _fase_rollup),
+     ('persistence', _fase_persistenza), ('broadcast', _fase_broadcast)],
+    capacita=INGEST_CODA,
+    politica=INGEST_POLITICA,
+    attesa=INGEST_ATTESA,
+    dopo=notifica_letture,
+)
+
+def avvia_pipeline():
+    pipeline.avvia()
+    # Registrato dopo l'archivio, quindi eseguito prima: la coda finisce nello scrittore
+    atexit.register(pipeline.ferma)
+
+def _segnala_allarmi(eventi):
+    for evento in eventi:
+        stato = "SCATTATO" if evento["state"] == 'firing' else "rientrato"
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] Allarme {evento['rule']} {stato} su {evento['station']}: {evento['message']}")
+
+def insegui_condivisa():
+    """Thread di ogni processo con la memoria condivisa: applica le letture
+    arrivate nei buffer (da questo o da altri processi) a statistiche e
+    allarmi, le passa all'archivio se è aperto qui e sveglia gli stream."""
+    while True:
+        try:
+            primario = os.getpid() == pid_archivio
+            nuove = False
+            for stazione in stazioni:
+                ts, colonne = stazione.segui(persisti=primario)
+                if len(ts):
+                    nuove = True
+                    eventi = allarmi.valuta_blocco(stazione.id, ts, colonne)
+                    if primario:
+                        _segnala_allarmi(eventi)
+            if nuove:
+                notifica_letture()
+        except Exception:
+            logging.exception("Errore nel seguire il buffer condiviso")
+        time.sleep(INTERVALLO_CONDIVISA)
+
+@app.before_request
+def avvia_inseguitore():
+    # I thread non sopravvivono al fork: ogni processo (anche i figli di un
+    # server che fa fork per richiesta) avvia il suo alla prima richiesta
+    global _pid_inseguitore
+    if not CONDIVISA or _pid_inseguitore == os.getpid():
+        return
+    with _lock_inseguitore:
+        if _pid_inseguitore != os.getpid():
+            _pid_inseguitore = os.getpid()
+            threading.Thread(target=insegui_condivisa, name='condivisa-centrale', daemon=True).start()
+
+def avvia_ricevitore_linee():
+    """Accetta letture nel protocollo compatto `station ts v1 v2 ...` su UDP e TCP."""
+    global ricevitore_linee
+    canali = os.environ.get('CENTRALE_LINEE_CANALI', 'temperature,humidity')
+    ricevitore_linee = RicevitoreLinee(
+        accoda_letture,
+        porta_udp=PORTA_UDP,
+        porta_tcp=PORTA_TCP,
+        canali_posizionali=tuple(c.strip() for c in canali.split(',') if c.strip()),
+    )
+    ricevitore_linee.avvia()
+    print(f"Protocollo a righe in ascolto su UDP {ricevitore_linee.porta_udp or '-'}, TCP {ricevitore_linee.porta_tcp or '-'}")
+
+def avvia_lettore_seriale():
+    """Legge le letture direttamente dalla porta seriale, senza passare da /update."""
+    global lettore_seriale
+    canali = os.environ.get('CENTRALE_SERIALE_CANALI', 'temperature,humidity')
+    lettore_seriale = LettoreSeriale(
+        PORTA_SERIALE,
+        accoda_lettura,
+        baudrate=int(os.environ.get('CENTRALE_SERIALE_BAUD', 9600)),
+        canali_posizionali=tuple(c.strip() for c in canali.split(',') if c.strip()),
+    )
+    lettore_seriale.avvia()
+    print(f"Lettore seriale avviato su {PORTA_SERIALE}")
+
+def avvia_server_sse():
+    """Sposta gli stream SSE su un event loop asyncio in ascolto su SSE_PORTA."""
+    global server_sse
+    server_sse = ServerSSE(
+        stazioni,
+        _eventi_sse,
+        porta=SSE_PORTA,
+        allarmi=allarmi,
+        formatta_allarme=_evento_allarme,
+        dimensione_coda=int(os.environ.get('CENTRALE_SSE_CODA', 256)),
+        heartbeat=HEARTBEAT_STREAM,
+        replay_massimo=REPLAY_MASSIMO,
+        max_client=int(os.environ.get('CENTRALE_SSE_MAX_CLIENT', 5000)),
+    )
+    server_sse.avvia()
+    print(f"Server SSE asyncio in ascolto sulla porta {server_sse.porta}")
+
+def avvia_archivio():
+    """Apre i log binari delle stazioni e ricostruisce le finestre in memoria."""
+    global storico, pid_archivio, _lock_archivio
+    # Log e storico li scrive un solo processo: con la memoria condivisa gli altri
+    # servono le richieste e le loro letture arrivano all'archivio attraverso il
+    # buffer condiviso; senza, un secondo processo non avrebbe dove scriverle
+    os.makedirs(DATABASE_DIR, exist_ok=True)
+    _lock_archivio = open(os.path.join(DATABASE_DIR, 'centrale.lock'), 'w')
+    try:
+        fcntl.flock(_lock_archivio, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        _lock_archivio.close()
+        _lock_archivio = None
+        if not CONDIVISA:
+            raise RuntimeError("Archivio già aperto da un altro processo: più processi richiedono CENTRALE_CONDIVISA")
+        print("Archivio già aperto da un altro processo: questo usa solo il buffer condiviso")
+        return False
+    scrittore.avvia()
+    atexit.register(scrittore.ferma)
+    storico = Storico(os.path.join(DATABASE_DIR, 'centrale_storico.db'), CANALI, scrittore)
+    ripristinate = stazioni.apri(DATABASE_DIR, scrittore, storico)
+    # Registrato dopo scrittore.ferma, quindi eseguito prima: i rollup in memoria finiscono in coda
+    atexit.register(svuota_rollup)
+    pid_archivio = os.getpid()
+    print(f"Archivio caricato: {ripristinate} letture ripristinate da {os.path.abspath(DATABASE_DIR)}")
+    return True
+
+def svuota_rollup():
+    for stazione in stazioni:
+        stazione.svuota_rollup()
+
+def _stazione_richiesta():
+    """Stazione indicata dal parametro station (default: quella predefinita)."""
+    return stazioni.get(request.args.get('station'))
+
+def _stazione_sconosciuta():
+    return jsonify({"error": "Stazione sconosciuta"}), 404
+
+def _lettura_dict(ts, canali, valori):
+    lettura = {nome: valore_json(valore) for nome, valore in zip(canali, valori)}
+    lettura["timestamp"] = datetime.fromtimestamp(ts).isoformat()
+    return lettura
+
+def _parse_istante(valore):
+    """Accetta un epoch in secondi oppure una data ISO 8601."""
+    try:
+        return float(valore)
+    except ValueError:
+        return datetime.fromisoformat(valore).timestamp()
+
+def _ultimo_timestamp(stazione):
+    ultimo = stazione.buffer.ultimo()
+    return datetime.fromtimestamp(ultimo[0]).isoformat() if ultimo else None
+
+def _temperatura_umidita(stazione):
+    """Ultima coppia (temperatura, umidità) della stazione, se entrambe misurate."""
+    ultima = stazione.ultima_lettura()
+    if ultima is None:
+        return None, None
+    valori = ultima[1]
+    temperatura = valori.get('temperature', math.nan)
+    umidita = valori.get('humidity', math.nan)
+    if math.isnan(temperatura) or math.isnan(umidita):
+        return None, None
+    return temperatura, umidita
+
+def _path_export(stazione):
+    nome = 'centrale.dat' if stazione.id == STAZIONE_PREDEFINITA else f'centrale_{stazione.id}.dat'
+    return os.path.join(DATABASE_DIR, nome)
+
+def aggiorna_file(stazione=None):
+    """Accoda la riscrittura completa dell'export testuale della stazione."""
+    stazione = stazione or stazioni.get()
+    righe = (
+        f"{datetime.fromtimestamp(ts).isoformat()} {' '.join(str(v) for v in valori)}\n"
+        for blocco_ts, colonne in stazione.buffer.blocchi()
+        for ts, *valori in zip(blocco_ts, *colonne.values())
+    )
+    scrittore.accoda_riscrittura(_path_export(stazione), righe)
 
 def append_to_centrale_file(timestamp: str, temperatura, umidita):
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    target_dir = os.path.join(base_dir, '..', '..', 'database')
-    os.makedirs(target_dir, exist_ok=True)
-    file_path = os.path.join(target_dir, 'centrale.dat')
-    f = open(file_path, 'a', encoding='utf-8')
-    f.write(f"{timestamp} {temperatura} {umidita}\n")
-    f.close()
+    os.makedirs(DATABASE_DIR, exist_ok=True)
+    file_path = os.path.join(DATABASE_DIR, 'centrale.dat')
+    scrittore.accoda_testo(file_path, f"{timestamp} {temperatura} {umidita}\n")
 
 def _next_5min_boundary(now: datetime):
     minute = (now.minute // 5 + 1) * 5
@@ -51,93 +339,436 @@ def periodic_save_loop():
         if sleep_seconds > 0:
             time.sleep(sleep_seconds)
 
-        if ultima_temperatura is not None and ultima_umidita is not None:
+        temperatura, umidita = _temperatura_umidita(stazioni.get())
+        if temperatura is not None:
             ts = next_time.strftime('%Y-%m-%d %H:%M:%S')
-            append_to_centrale_file(ts, f"{ultima_temperatura:.1f}", f"{ultima_umidita:.1f}")
+            append_to_centrale_file(ts, f"{temperatura:.1f}", f"{umidita:.1f}")
+
+        if storico is not None and RETENTION_GIORNI > 0:
+            scrittore.accoda_potatura(storico, time.time() - RETENTION_GIORNI * 86400)
+
+def sigilla_giorni():
+    """Comprime in blocchi i giorni conclusi da almeno SIGILLO_GIORNI ancora nello storico.
+
+    Restituisce il numero di letture sigillate.
+    """
+    limite = (time.time() - SIGILLO_GIORNI * 86400) // DURATA_BLOCCO * DURATA_BLOCCO
+    sigillate = 0
+    for stazione in stazioni:
+        if stazione.blocchi is None:
+            continue
+        while True:
+            primo = storico.prima_lettura(stazione.id, limite)
+            if primo is None:
+                break
+            giorno = primo // DURATA_BLOCCO * DURATA_BLOCCO
+            fine = giorno + DURATA_BLOCCO
+            ts, colonne, id_massimo = storico.da_sigillare(stazione.id, stazione.canali, giorno, fine)
+            if len(ts):
+                blocco = codifica_blocco(ts, colonne)
+                scrittore.accoda_sigillo(
+                    stazione.blocchi, (blocco, float(ts[0]), float(ts[-1]), len(ts)),
+                    storico, (stazione.id, giorno, fine, id_massimo),
+                )
+                sigillate += len(ts)
+            # Il giorno deve sparire dallo storico prima di cercare il successivo
+            scrittore.attendi()
+    return sigillate
+
+def periodic_sigillo_loop():
+    while True:
+        try:
+            sigillate = sigilla_giorni()
+            if sigillate:
+                print(f"Sigillate {sigillate} letture in blocchi compressi")
+        except Exception:
+            logging.exception("Errore nella sigillatura dei blocchi")
+        time.sleep(3600)
 
 @app.route('/sensor', methods=['GET'])
 def get_sensor_data():
-    if ultima_temperatura is None or ultima_umidita is None:
+    stazione = _stazione_richiesta()
+    ultima = stazione.ultima_lettura() if stazione else None
+    if ultima is None:
         return jsonify({
             "error": "Nessun dato disponibile",
             "method": "none"
         }), 404
-    
+
+    ts, valori = ultima
+    reading = _lettura_dict(ts, valori.keys(), valori.values())
+    reading["station"] = stazione.id
     return jsonify({
-        "reading": {
-            "temperature": ultima_temperatura,
-            "humidity": ultima_umidita,
-            "timestamp": datetime.now().isoformat()
-        },
+        "reading": reading,
         "method": "latest"
     })
 
 @app.route('/update', methods=['GET'])
 def update_sensor():
-    global ultima_temperatura, ultima_umidita
+    try:
+        valori = canali_da_parametri(request.args)
+    except ValueError:
+        return "Parametri non validi", 400
 
-    temp = request.args.get('temp')
-    hum = request.args.get('hum')
-
-    if temp is None or hum is None:
+    if not valori:
         return "Parametri mancanti", 400
 
-    ultima_temperatura = float(temp)
-    ultima_umidita = float(hum)
+    ts = time.time()
+    try:
+        valida_lettura(ts, valori)
+        accoda_lettura(request.args.get('station'), ts, valori)
+    except Sovraccarico as e:
+        return str(e), 503
+    except ValueError as e:
+        return str(e), 400
 
-    reading = {
-        "temperature": ultima_temperatura,
-        "humidity": ultima_umidita,
-        "timestamp": datetime.now().isoformat()
-    }
-    sensor_readings.append(reading)
+    return "Dati ricevuti", 200
 
-    if len(sensor_readings) > 1000:
-        sensor_readings.pop(0)
+def _leggi_batch():
+    """Estrae le letture dal corpo di /update/batch (array JSON o NDJSON)."""
+    testo = request.get_data(as_text=True)
+    if request.mimetype not in ('application/x-ndjson', 'application/jsonl'):
+        try:
+            dati = json.loads(testo)
+        except ValueError:
+            dati = None
+        if isinstance(dati, list):
+            return dati
+        if isinstance(dati, dict) and 'readings' in dati:
+            return dati['readings']
+    return [json.loads(riga) for riga in testo.splitlines() if riga.strip()]
 
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] Temperatura: {ultima_temperatura} °C | Umidità: {ultima_umidita} %")
+def _valida_lettura(lettura):
+    """Restituisce (ts, {canale: valore}) oppure solleva ValueError."""
+    if not isinstance(lettura, dict):
+        raise ValueError("la lettura deve essere un oggetto")
+    timestamp = lettura.get('timestamp', lettura.get('ts'))
+    valori = canali_da_parametri(lettura)
+    if timestamp is None or not valori:
+        raise ValueError("servono un timestamp e almeno un canale")
+    ts = _parse_istante(str(timestamp))
+    valida_lettura(ts, valori)
+    return ts, valori
 
-    return "Dati ricevuti", 200
+@app.route('/update/batch', methods=['POST'])
+def update_batch():
+    try:
+        letture = _leggi_batch()
+    except (ValueError, KeyError, TypeError):
+        return jsonify({"error": "Corpo della richiesta non valido"}), 400
+    if not isinstance(letture, list):
+        return jsonify({"error": "Attesa una lista di letture"}), 400
+    if len(letture) > MAX_BATCH:
+        return jsonify({"error": f"Massimo {MAX_BATCH} letture per richiesta"}), 413
+
+    valide = []
+    errori = []
+    for i, lettura in enumerate(letture):
+        try:
+            valide.append(_valida_lettura(lettura))
+        except (ValueError, TypeError) as e:
+            errori.append({"index": i, "error": str(e)})
+
+    if valide:
+        try:
+            accoda_letture(request.args.get('station'), valide)
+        except Sovraccarico as e:
+            return jsonify({"error": str(e)}), 503
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "accepted": len(valide),
+        "rejected": len(errori),
+        "errors": errori[:20]
+    }), 200 if valide or not errori else 400
 
 @app.route('/history', methods=['GET'])
 def get_history():
-    hours = int(request.args.get('hours', 24))
-    cutoff_time = datetime.now() - timedelta(hours=hours)
-    
-    recent_readings = [
-        reading for reading in sensor_readings
-        if datetime.fromisoformat(reading['timestamp']) >= cutoff_time
+    stazione = _stazione_richiesta()
+    if stazione is None:
+        return _stazione_sconosciuta()
+    try:
+        hours = float(request.args.get('hours', 24))
+        da = request.args.get('from')
+        a = request.args.get('to')
+        da = _parse_istante(da) if da else time.time() - hours * 3600
+        a = _parse_istante(a) if a else None
+        limit = request.args.get('limit', type=int)
+        punti = request.args.get('points', type=int)
+        risoluzione = request.args.get('resolution', type=float)
+        selezione = canali_richiesti(request.args.get('channels'))
+    except ValueError:
+        return jsonify({"error": "Parametri non validi"}), 400
+    if selezione and not all(nome in stazione.canali or nome in DERIVATI for nome in selezione):
+        return jsonify({"error": "Canale sconosciuto"}), 400
+    derivati = [nome for nome in selezione or () if nome in DERIVATI]
+    if (punti is not None and punti <= 0) or (risoluzione is not None and risoluzione <= 0):
+        return jsonify({"error": "points e resolution devono essere positivi"}), 400
+    modo = request.args.get('mode', 'buckets')
+    if modo not in ('buckets', 'lttb'):
+        return jsonify({"error": "mode deve essere 'buckets' o 'lttb'"}), 400
+
+    livello = None
+    if storico is not None and modo == 'buckets' and limit is None and (punti or risoluzione) and not derivati:
+        # Intervalli lunghi: si parte dal livello di rollup più grossolano adatto
+        # (i derivati non sono lineari: la loro media va calcolata dalle letture)
+        risoluzione = risoluzione or ((a or time.time()) - da) / punti
+        livello = livello_per_risoluzione(risoluzione)
+    if livello is not None:
+        ts, colonne = _history_rollup(stazione, livello, da, a, risoluzione, selezione)
+    else:
+        ts, colonne = _finestra_storica(stazione, da, a, derivati)
+        if selezione:
+            colonne = {nome: colonne[nome] for nome in selezione}
+        canali = tuple(colonne)
+        if limit is not None and limit >= 0:
+            # Con un limite si restituiscono le letture più recenti dell'intervallo
+            ts = ts[len(ts) - min(limit, len(ts)):]
+            colonne = {nome: valori[len(valori) - len(ts):] for nome, valori in colonne.items()}
+
+        if punti or risoluzione:
+            canale = request.args.get('channel', 'temperature' if 'temperature' in canali else canali[0])
+            if canale not in canali:
+                return jsonify({"error": "Canale sconosciuto"}), 400
+            ts, colonne = _sottocampiona(ts, colonne, modo, punti, risoluzione, canale)
+
+    formato = request.args.get('format', 'objects')
+    if formato == 'binary' or request.accept_mimetypes.best_match(
+            ['application/json', 'application/octet-stream']) == 'application/octet-stream':
+        risposta = _history_binaria(stazione, ts, colonne)
+    elif formato == 'columnar':
+        risposta = jsonify(_history_colonnare(stazione, ts, colonne))
+    else:
+        risposta = jsonify({
+            "station": stazione.id,
+            "readings": _letture_oggetti(ts, colonne),
+            "count": len(ts)
+        })
+    if livello is not None:
+        risposta.headers['X-Rollup-Level'] = str(livello)
+    return risposta
+
+def _lista_json(nome, valori):
+    if nome == 'count':
+        return valori.astype(np.int64).tolist()
+    return [None if math.isnan(v) else v for v in valori.tolist()]
+
+def _letture_oggetti(ts, colonne):
+    """Formato storico di /history: un oggetto per lettura."""
+    nomi = list(colonne)
+    liste = [colonne[n].tolist() for n in nomi]
+    if 'count' in colonne:
+        liste[nomi.index('count')] = [int(c) for c in liste[nomi.index('count')]]
+    return [
+        {**{nome: valore_json(v) for nome, v in zip(nomi, valori)},
+         "timestamp": datetime.fromtimestamp(t).isoformat()}
+        for t, *valori in zip(ts.tolist(), *liste)
     ]
-    
-    return jsonify({
-        "readings": recent_readings,
-        "count": len(recent_readings)
-    })
+
+def _history_colonnare(stazione, ts, colonne):
+    """Formato colonnare: epoch base, delta dei timestamp in millisecondi e array paralleli."""
+    millis = np.round(ts * 1000).astype(np.int64)
+    base = int(millis[0]) if len(millis) else 0
+    return {
+        "station": stazione.id,
+        "format": "columnar",
+        "count": len(ts),
+        "base": base / 1000,
+        "dt": np.diff(millis, prepend=base).tolist(),
+        "channels": {nome: _lista_json(nome, valori) for nome, valori in colonne.items()}
+    }
+
+def _history_binaria(stazione, ts, colonne):
+    """Formato binario: float32 little-endian, prima gli offset dei timestamp
+    in secondi rispetto a X-Base-Epoch, poi un blocco per ogni canale di X-Channels."""
+    base = float(ts[0]) if len(ts) else 0.0
+    blocchi = [(ts - base).astype('<f4')] + [valori.astype('<f4') for valori in colonne.values()]
+    return Response(
+        b''.join(blocco.tobytes() for blocco in blocchi),
+        mimetype="application/octet-stream",
+        headers={
+            "X-Station": stazione.id,
+            "X-Count": str(len(ts)),
+            "X-Base-Epoch": repr(base),
+            "X-Channels": ",".join(colonne),
+            "Access-Control-Expose-Headers": "X-Station, X-Count, X-Base-Epoch, X-Channels, X-Rollup-Level"
+        }
+    )
+
+def _finestra_storica(stazione, da, a, derivati=()):
+    """Letture della stazione tra da e a come array NumPy, più i canali `derivati`.
+
+    La parte coperta dal buffer viene letta dalla memoria; quella più vecchia
+    dello storico SQLite e dei giorni sigillati, i cui derivati vengono dalla
+    cache dei blocchi.
+    """
+    buffer = stazione.buffer
+    primo, ts, colonne = buffer.finestra_tra(da, a)
+    canali = tuple(colonne)
+    ts = np.frombuffer(ts, dtype=np.float64)
+    colonne = {nome: np.frombuffer(valori, dtype=np.float64) for nome, valori in colonne.items()}
+    colonne.update(calcola(derivati, colonne, len(ts)))
+
+    if storico is not None and (primo is None or da < primo):
+        vecchi_ts, vecchie = storico.intervallo(stazione.id, canali, da, a, prima_di=primo)
+        vecchie.update(calcola(derivati, vecchie, len(vecchi_ts)))
+        parti = [(vecchi_ts, vecchie)]
+        for vecchi_ts, vecchie in _blocchi_sigillati(stazione, canali + tuple(derivati), da, a, primo):
+            parti.append((vecchi_ts, vecchie))
+        parti = [(t, c) for t, c in parti if len(t)]
+        if parti:
+            # I giorni sigillati e le letture tardive non ancora sigillate possono intrecciarsi
+            vecchi_ts = np.concatenate([t for t, _ in parti])
+            ordine = np.argsort(vecchi_ts, kind='stable')
+            ts = np.concatenate((vecchi_ts[ordine], ts))
+            colonne = {
+                nome: np.concatenate((
+                    np.concatenate([c.get(nome, np.full(len(t), np.nan)) for t, c in parti])[ordine],
+                    colonne[nome],
+                ))
+                for nome in colonne
+            }
+    return ts, colonne
+
+def _blocchi_sigillati(stazione, canali, da, a, prima_di, usa_cache=True):
+    """Blocchi (ts, colonne) dei giorni sigillati, limitati a ts < prima_di."""
+    if stazione.blocchi is None:
+        return
+    for ts, colonne in stazione.blocchi.blocchi(canali, da, a, usa_cache):
+        if prima_di is not None:
+            dentro = ts < prima_di
+            ts, colonne = ts[dentro], {nome: valori[dentro] for nome, valori in colonne.items()}
+        if len(ts):
+            yield ts, colonne
+
+def _colonne_bucket(inizi, conteggi, aggregati):
+    """Colonne di /history per i bucket: media di ogni canale, <canale>_min, <canale>_max e count."""
+    risultato = {"count": conteggi.astype(np.float64)}
+    for nome, (minimi, massimi, medie) in aggregati.items():
+        risultato[nome] = np.round(medie, 2)
+        risultato[f"{nome}_min"] = minimi
+        risultato[f"{nome}_max"] = massimi
+    return inizi.astype(np.float64), risultato
+
+def _history_rollup(stazione, livello, da, a, risoluzione, canali=None):
+    """Come _sottocampiona in modalità buckets, ma a partire dal livello di rollup
+    indicato: un anno con risoluzione giornaliera legge poche centinaia di righe."""
+    inizi, conteggi, parziali = stazione.rollup_intervallo(livello, da, a)
+    if canali:
+        parziali = {nome: parziali[nome] for nome in canali if nome in parziali}
+    inizi, conteggi, aggregati = combina_bucket(inizi, conteggi, parziali, risoluzione)
+    return _colonne_bucket(inizi, conteggi, aggregati)
+
+def _sottocampiona(ts, colonne, modo, punti, risoluzione, canale):
+    """Riduce le letture a un numero di punti adatto al grafico.
+
+    Restituisce (timestamps, colonne) come array; con mode=buckets le colonne
+    sono la media di ogni canale più <canale>_min, <canale>_max e count.
+    """
+    if len(ts) == 0:
+        return ts, colonne
+    durata = max(ts[-1] - ts[0], 1.0)
+
+    if modo == 'lttb':
+        punti = punti or int(durata / risoluzione) + 1
+        scelti = lttb(ts, colonne[canale], max(punti, 3))
+        return ts[scelti], {nome: valori[scelti] for nome, valori in colonne.items()}
+
+    risoluzione = risoluzione or durata / max(punti, 1)
+    inizi, conteggi, aggregati = aggrega_bucket(ts, colonne, risoluzione)
+    return _colonne_bucket(inizi, conteggi, aggregati)
+
+def _evento_sse(stazione, seq, ts, canali, valori):
+    payload = _lettura_dict(ts, canali, valori)
+    payload["station"] = stazione.id
+    payload["source"] = "sse"
+    data = {
+        "id": seq,
+        "type": "reading",
+        "payload": payload
+    }
+    return f"id: {seq}\ndata: {json.dumps(data)}\n\n"
+
+def _eventi_sse(stazione, id_eventi, canali, righe, selezione=None):
+    """Eventi SSE delle righe restituite da buffer.dopo(), con i loro `id_eventi`.
+
+    Con `selezione` ogni evento ha solo quei canali, anche derivati: questi
+    vengono calcolati una volta sola su tutte le righe.
+    """
+    righe = list(righe)
+    if selezione and righe:
+        dati = np.array(righe, dtype=np.float64)
+        colonne = {nome: dati[:, i + 1] for i, nome in enumerate(canali)}
+        colonne.update(calcola(selezione, colonne, len(righe)))
+        vuota = np.full(len(righe), np.nan)
+        righe = zip(dati[:, 0].tolist(), *(colonne.get(nome, vuota).tolist() for nome in selezione))
+        canali = selezione
+    return [_evento_sse(stazione, seq, ts, canali, valori) for seq, (ts, *valori) in zip(id_eventi, righe)]
+
+def _evento_allarme(evento):
+    # Senza campo id: il Last-Event-ID del browser resta quello dell'ultima lettura
+    return f"data: {json.dumps({'type': 'alert', 'payload': evento})}\n\n"
 
 @app.route('/stream')
 def stream():
-    def event_stream():
-        last_id = 0
+    stazione = _stazione_richiesta()
+    if stazione is None:
+        return _stazione_sconosciuta()
+    try:
+        selezione = canali_richiesti(request.args.get('channels'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if server_sse is not None:
+        # Con il server asyncio attivo i client vengono mandati lì e non occupano un thread
+        parametri = request.args.to_dict()
+        if 'Last-Event-ID' in request.headers:
+            parametri['lastEventId'] = request.headers['Last-Event-ID']
+        host = urlsplit(request.host_url).hostname
+        if ':' in host:
+            host = f"[{host}]"
+        destinazione = f"{request.scheme}://{host}:{server_sse.porta}/stream"
+        if parametri:
+            destinazione += '?' + urlencode(parametri)
+        return redirect(destinazione, code=307)
+    buffer = stazione.buffer
+
+    ultimo_id = request.headers.get('Last-Event-ID', request.args.get('lastEventId'))
+    try:
+        ultimo_id = int(ultimo_id) if ultimo_id else None
+    except ValueError:
+        ultimo_id = None
+    if ultimo_id is None or ultimo_id > buffer.totale:
+        # Nuovo client (o id di un'altra sessione): parte dall'ultima lettura disponibile
+        ultimo_id = max(0, buffer.totale - 1)
+
+    def event_stream(ultimo_id):
+        ultimo_allarme = allarmi.seq
         while True:
-            if ultima_temperatura is not None and ultima_umidita is not None:
-                data = {
-                    "id": last_id,
-                    "type": "reading",
-                    "payload": {
-                        "temperature": ultima_temperatura,
-                        "humidity": ultima_umidita,
-                        "timestamp": datetime.now().isoformat(),
-                        "source": "sse"
-                    }
-                }
-                
-                yield f"data: {json.dumps(data)}\n\n"
-                last_id += 1
-            
-            time.sleep(30)
-    
+            with buffer.lock:
+                canali = buffer.canali
+                totale = buffer.totale
+                id_eventi, righe = buffer.dopo(ultimo_id, REPLAY_MASSIMO)
+            for seq, evento in zip(id_eventi, _eventi_sse(stazione, id_eventi, canali, righe, selezione)):
+                yield evento
+                ultimo_id = seq
+            # I numeri delle letture rimaste fuori dal buffer contano come consegnati,
+            # altrimenti l'attesa qui sotto non si fermerebbe più
+            ultimo_id = max(ultimo_id, totale)
+            ultimo_allarme, eventi = allarmi.dopo(ultimo_allarme, stazione.id)
+            for evento in eventi:
+                yield _evento_allarme(evento)
+
+            with nuove_letture:
+                nuove = nuove_letture.wait_for(
+                    lambda: buffer.totale > ultimo_id or allarmi.seq > ultimo_allarme,
+                    timeout=HEARTBEAT_STREAM,
+                )
+            if not nuove:
+                yield ": keepalive\n\n"
+
     return Response(
-        event_stream(),
+        event_stream(ultimo_id),
         mimetype="text/event-stream",
         headers={
             'Cache-Control': 'no-cache',
@@ -145,72 +776,343 @@ def stream():
         }
     )
 
+@app.route('/stations', methods=['GET'])
+def elenco_stazioni():
+    return jsonify({
+        "default": STAZIONE_PREDEFINITA,
+        "stations": [
+            {
+                "id": stazione.id,
+                "channels": {nome: CANALI[nome]['unita'] for nome in stazione.canali},
+                "derived_channels": {
+                    nome: derivato.unita for nome, derivato in DERIVATI.items()
+                    if all(d in stazione.canali for d in derivato.dipendenze)
+                },
+                "total_readings": len(stazione.buffer),
+                "last_update": _ultimo_timestamp(stazione)
+            }
+            for stazione in stazioni
+        ]
+    })
+
 @app.route('/')
 def index():
+    stazione = stazioni.get()
+    temperatura, umidita = _temperatura_umidita(stazione)
     return jsonify({
         "name": "Centrale Meteorologica API",
         "version": "1.0",
         "endpoints": {
-            "/sensor": "Ultima lettura",
-            "/update": "Ricevi nuovi dati (GET con param temp, hum)",
-            "/history": "Dati storici (param hours)",
-            "/stream": "Streaming dati in tempo reale (SSE)"
+            "/sensor": "Ultima lettura (param station)",
+            "/update": "Ricevi nuovi dati (GET con param station e canali, es. temp, hum, pressure)",
+            "/update/batch": "Ricevi più letture con timestamp (POST, array JSON o NDJSON; param station)",
+            "/history": "Dati storici (param station, hours oppure from/to, limit, channels anche derivati; points/resolution e mode=buckets|lttb per il sottocampionamento; format=objects|columnar|binary)",
+            "/stream": "Streaming dati in tempo reale (SSE, param station, channels anche derivati; eventi type=reading|alert)",
+            "/alerts": "Allarmi attivi ed eventi recenti (param station, since); regole in /alerts/rules (GET, POST, DELETE /alerts/rules/<id>)",
+            "/stations": "Elenco delle stazioni e dei loro canali",
+            "/ingest": "Coda e tempi per fase della pipeline di ingest",
+            "/stats": "Statistiche correnti per canale (param station, window=1h|24h|7d|today|yesterday)",
+            "/percentiles": "Percentili approssimati per giorno, settimana o intervallo (param station, channel, q, from, to, group=day|week|all)",
+            "/export": "Esportazione completa in streaming (param station, format=csv|ndjson, from, to)"
         },
         "status": {
-            "has_data": ultima_temperatura is not None and ultima_umidita is not None,
-            "temperature": ultima_temperatura,
-            "humidity": ultima_umidita,
-            "last_update": sensor_readings[-1]['timestamp'] if sensor_readings else None,
-            "total_readings": len(sensor_readings)
+            "has_data": temperatura is not None,
+            "temperature": temperatura,
+            "humidity": umidita,
+            "last_update": _ultimo_timestamp(stazione),
+            "total_readings": len(stazione.buffer),
+            "serial": {
+                "port": lettore_seriale.porta,
+                "connected": lettore_seriale.connesso,
+                "readings": lettore_seriale.letture,
+                "rejected": lettore_seriale.scartate
+            } if lettore_seriale is not None else None,
+            "line_protocol": {
+                "udp_port": ricevitore_linee.porta_udp or None,
+                "tcp_port": ricevitore_linee.porta_tcp or None,
+                "readings": ricevitore_linee.letture,
+                "rejected": ricevitore_linee.scartate
+            } if ricevitore_linee is not None else None,
+            "database": storico.pool.statistiche() if storico is not None else None
+        },
+        "stations": [s.id for s in stazioni],
+        "derived_channels": {nome: derivato.unita for nome, derivato in DERIVATI.items()}
+    })
+
+@app.route('/ingest', methods=['GET'])
+def stato_ingest():
+    return jsonify(pipeline.statistiche())
+
+@app.route('/stats', methods=['GET'])
+def statistiche():
+    stazione = _stazione_richiesta()
+    if stazione is None:
+        return _stazione_sconosciuta()
+    finestra = request.args.get('window', '24h')
+    if finestra not in FINESTRE and finestra not in ('today', 'yesterday'):
+        return jsonify({"error": f"window deve essere uno tra {', '.join(list(FINESTRE) + ['today', 'yesterday'])}"}), 400
+
+    adesso = time.time()
+    return jsonify({
+        "station": stazione.id,
+        "window": finestra,
+        # Il bordo più vecchio della finestra è arrotondato a questa granularità
+        "bucket_seconds": FINESTRE[finestra][0] if finestra in FINESTRE else None,
+        "generated": datetime.fromtimestamp(adesso).isoformat(),
+        "channels": stazione.statistiche_finestra(finestra, adesso)
+    })
+
+@app.route('/percentiles', methods=['GET'])
+def percentili():
+    """Percentili (t-digest) dei giorni tra from e to, interi e in ora locale.
+
+    L'errore sul rango è al più circa 0,5% per la mediana e 0,3% per p5/p95
+    (vedi centrale_percentili): con q=95 il valore sta tra il p94,7 e il p95,3 reali.
+    """
+    stazione = _stazione_richiesta()
+    if stazione is None:
+        return _stazione_sconosciuta()
+    if stazione.storico is None:
+        return jsonify({"error": "Storico non disponibile in questo processo"}), 503
+    try:
+        qs = [float(q) for q in request.args.get('q', '5,50,95').split(',')]
+        a = request.args.get('to')
+        a = datetime.fromtimestamp(_parse_istante(a)).date() if a else datetime.now().date()
+        da = request.args.get('from')
+        da = datetime.fromtimestamp(_parse_istante(da)).date() if da else a - timedelta(days=6)
+    except ValueError:
+        return jsonify({"error": "Parametri non validi"}), 400
+    if not all(0 <= q <= 100 for q in qs):
+        return jsonify({"error": "q deve essere tra 0 e 100"}), 400
+    if da > a:
+        return jsonify({"error": "from deve precedere to"}), 400
+    gruppo = request.args.get('group', 'all')
+    if gruppo not in ('day', 'week', 'all'):
+        return jsonify({"error": "group deve essere 'day', 'week' o 'all'"}), 400
+    predefinito = 'temperature' if 'temperature' in stazione.canali else stazione.canali[0]
+    canali = [ALIAS_CANALI.get(c) for c in request.args.get('channel', predefinito).split(',')]
+    if not all(c in stazione.canali for c in canali):
+        return jsonify({"error": "Canale sconosciuto"}), 400
+
+    def periodo(giorno):
+        if gruppo == 'day':
+            return giorno, giorno
+        if gruppo == 'week':
+            lunedi = giorno - timedelta(days=giorno.weekday())
+            return max(lunedi, da), min(lunedi + timedelta(days=6), a)
+        return da, a
+
+    periodi = {}
+    for giorno, nome, digest in stazione.percentili_intervallo(canali, da.isoformat(), a.isoformat()):
+        digest_canali = periodi.setdefault(periodo(datetime.fromisoformat(giorno).date()), {})
+        if nome in digest_canali:
+            digest_canali[nome].unisci(digest)
+        else:
+            digest_canali[nome] = digest
+
+    def valori(digest):
+        if digest is None or digest.n == 0:
+            return {"count": 0, "min": None, "max": None, **{f"p{q:g}": None for q in qs}}
+        return {
+            "count": digest.n,
+            "min": digest.minimo,
+            "max": digest.massimo,
+            **{f"p{q:g}": round(x, 3) for q, x in zip(qs, digest.quantili([q / 100 for q in qs]))},
         }
+
+    return jsonify({
+        "station": stazione.id,
+        "from": da.isoformat(),
+        "to": a.isoformat(),
+        "group": gruppo,
+        "compression": COMPRESSIONE,
+        "periods": [
+            {"from": inizio.isoformat(), "to": fine.isoformat(),
+             "channels": {nome: valori(digest_canali.get(nome)) for nome in canali}}
+            for (inizio, fine), digest_canali in sorted(periodi.items())
+        ]
     })
 
+@app.route('/alerts', methods=['GET'])
+def elenco_allarmi():
+    id_stazione = request.args.get('station')
+    try:
+        dal = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({"error": "since deve essere un intero"}), 400
+    ultimo, eventi = allarmi.dopo(dal, id_stazione)
+    return jsonify({
+        "active": allarmi.attivi_per(id_stazione),
+        "events": eventi,
+        "last_id": ultimo
+    })
+
+@app.route('/alerts/rules', methods=['GET'])
+def regole_allarmi():
+    return jsonify({"rules": allarmi.regole()})
+
+@app.route('/alerts/rules', methods=['POST'])
+def aggiungi_regola_allarme():
+    try:
+        regola = allarmi.aggiungi_regola(request.get_json(force=True, silent=True))
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Regola non valida: {e}"}), 400
+    return jsonify({"rule": regola.come_dict()}), 201
+
+@app.route('/alerts/rules/<id>', methods=['DELETE'])
+def rimuovi_regola_allarme(id):
+    if not allarmi.rimuovi_regola(id):
+        return jsonify({"error": "Regola sconosciuta"}), 404
+    return "", 204
+
 @app.route('/status', methods=['GET'])
 def status():
-    if ultima_temperatura is None or ultima_umidita is None:
+    stazione = _stazione_richiesta()
+    ultima = stazione.ultima_lettura() if stazione else None
+    if ultima is None:
         return jsonify({
             "error": "Nessun dato ricevuto ancora"
         }), 404
-    
+
+    valori = {nome: valore_json(valore) for nome, valore in ultima[1].items()}
     return jsonify({
-        "temperatura": ultima_temperatura,
-        "umidita": ultima_umidita
+        "station": stazione.id,
+        "temperatura": valori.get('temperature'),
+        "umidita": valori.get('humidity'),
+        "canali": valori
     })
 
 @app.route('/visualizza', methods=['GET'])
 def visualizza_dati():
-    lines = ["=== DATI CENTRALE METEOROLOGICA ===\n"]
-    lines.append(f"Totale letture: {len(sensor_readings)}")
-    lines.append(f"Ultimo aggiornamento: {sensor_readings[-1]['timestamp'] if sensor_readings else 'Nessun dato'}\n")
-    lines.append("-" * 50)
-    lines.append(f"{'TIMESTAMP':<25} {'TEMPERATURA':<12} {'UMIDITA':<10}")
-    lines.append("-" * 50)
-    
-    for reading in sensor_readings:
-        timestamp = reading['timestamp']
-        temperatura = f"{reading['temperature']} °C"
-        umidita = f"{reading['humidity']} %"
-        lines.append(f"{timestamp:<25} {temperatura:<12} {umidita:<10}")
-    
-    lines.append("-" * 50)
-    lines.append(f"Fine report - {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
-    
-    content = "\n".join(lines)
-    
+    stazione = _stazione_richiesta()
+    if stazione is None:
+        return _stazione_sconosciuta()
+    canali = stazione.buffer.canali
+    larghezza = 25 + 13 * len(canali)
+
+    def report():
+        yield f"=== DATI CENTRALE METEOROLOGICA ({stazione.id}) ===\n\n"
+        yield f"Totale letture: {len(stazione.buffer)}\n"
+        yield f"Ultimo aggiornamento: {_ultimo_timestamp(stazione) or 'Nessun dato'}\n\n"
+        yield "-" * larghezza + "\n"
+        yield f"{'TIMESTAMP':<25} " + " ".join(f"{nome.upper():<12}" for nome in canali) + "\n"
+        yield "-" * larghezza + "\n"
+
+        for blocco_ts, colonne in stazione.buffer.blocchi():
+            lines = []
+            for ts, *valori in zip(blocco_ts, *(colonne[nome] for nome in canali)):
+                timestamp = datetime.fromtimestamp(ts).isoformat()
+                celle = [
+                    f"{valore} {CANALI[nome]['unita']}" if not math.isnan(valore) else "-"
+                    for nome, valore in zip(canali, valori)
+                ]
+                lines.append(f"{timestamp:<25} " + " ".join(f"{cella:<12}" for cella in celle) + "\n")
+            yield "".join(lines)
+
+        yield "-" * larghezza + "\n"
+        yield f"Fine report - {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}"
+
     return Response(
-        content,
+        report(),
         mimetype="text/plain",
         headers={
             "Content-Type": "text/plain; charset=utf-8"
         }
     )
 
+def _blocchi_export(stazione, canali, da, a):
+    """Blocchi (ts, colonne) dai giorni sigillati, dallo storico SQLite e poi dal buffer."""
+    primo = stazione.buffer.primo()
+    if storico is not None and (primo is None or da is None or da < primo):
+        # Un export completo non deve svuotare la cache dei giorni consultati di recente
+        for ts, colonne in _blocchi_sigillati(stazione, canali, da, a, primo, usa_cache=False):
+            yield ts.tolist(), {nome: colonne[nome].tolist() for nome in canali}
+        for ts, colonne in storico.blocchi(stazione.id, canali, da, a, prima_di=primo):
+            yield ts.tolist(), {nome: colonne[nome].tolist() if nome in colonne else [math.nan] * len(ts) for nome in canali}
+    inizio = da if primo is None or da is None else max(da, primo)
+    for ts, colonne in stazione.buffer.blocchi(inizio, a):
+        yield ts, colonne
+
+@app.route('/export', methods=['GET'])
+def esporta_dati():
+    stazione = _stazione_richiesta()
+    if stazione is None:
+        return _stazione_sconosciuta()
+    formato = request.args.get('format', 'csv')
+    if formato not in ('csv', 'ndjson'):
+        return jsonify({"error": "format deve essere 'csv' o 'ndjson'"}), 400
+    try:
+        da = request.args.get('from')
+        a = request.args.get('to')
+        da = _parse_istante(da) if da else None
+        a = _parse_istante(a) if a else None
+    except ValueError:
+        return jsonify({"error": "Parametri non validi"}), 400
+    canali = stazione.buffer.canali
+
+    def csv():
+        yield "timestamp," + ",".join(canali) + "\n"
+        for ts, colonne in _blocchi_export(stazione, canali, da, a):
+            yield "".join(
+                datetime.fromtimestamp(t).isoformat() + ","
+                + ",".join("" if math.isnan(v) else repr(v) for v in valori) + "\n"
+                for t, *valori in zip(ts, *(colonne[nome] for nome in canali))
+            )
+
+    def ndjson():
+        for ts, colonne in _blocchi_export(stazione, canali, da, a):
+            yield "".join(
+                json.dumps(_lettura_dict(t, canali, valori)) + "\n"
+                for t, *valori in zip(ts, *(colonne[nome] for nome in canali))
+            )
+
+    return Response(
+        csv() if formato == 'csv' else ndjson(),
+        mimetype="text/csv" if formato == 'csv' else "application/x-ndjson",
+        headers={
+            "Content-Disposition": f"attachment; filename=centrale_{stazione.id}.{formato}"
+        }
+    )
+
 @app.route('/salva', methods=['GET'])
 def salva_dati():
-    aggiorna_file()
-    return Response("File aggiornato", mimetype="text/plain")
+    stazione = _stazione_richiesta()
+    if stazione is None:
+        return _stazione_sconosciuta()
+    aggiorna_file(stazione)
+    return Response("Salvataggio del file in corso", status=202, mimetype="text/plain")
+
+def avvia():
+    """Avvia archivio, dispositivi e thread di questo processo, una volta sola.
+
+    La chiama `__main__`; sotto un server WSGI va chiamata in ogni worker dopo
+    il fork (per esempio dall'hook post_fork di gunicorn). Archivio, porta
+    seriale, SSE e protocollo a righe partono solo nel processo che prende il
+    lock dell'archivio; pipeline e inseguitore del buffer condiviso in tutti.
+    """
+    global _pid_avvio
+    if _pid_avvio == os.getpid():
+        return
+    with _lock_avvio:
+        if _pid_avvio == os.getpid():
+            return
+        if avvia_archivio():
+            threading.Thread(target=periodic_save_loop, daemon=True).start()
+            if SIGILLO_GIORNI > 0:
+                threading.Thread(target=periodic_sigillo_loop, daemon=True).start()
+            if SSE_PORTA:
+                avvia_server_sse()
+            if PORTA_SERIALE:
+                avvia_lettore_seriale()
+            if PORTA_UDP or PORTA_TCP:
+                avvia_ricevitore_linee()
+        avvia_pipeline()
+        avvia_inseguitore()
+        _pid_avvio = os.getpid()
 
 if __name__ == '__main__':
-    t = threading.Thread(target=periodic_save_loop, daemon=True)
-    t.start()
-    app.run(host='0.0.0.0', port=8888, debug=True)
\ No newline at end of file
+    # Con il reloader di debug il modulo viene eseguito anche dal processo che
+    # sorveglia i file: quello non deve avviare niente, né prendere l'archivio
+    if not DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        avvia()
+    app.run(host='0.0.0.0', port=int(os.environ.get('CENTRALE_PORTA', 8888)), debug=DEBUG)
@@ -0,0 +1,324 @@
+import json
+import logging
+import math
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from itertools import islice
+
+from centrale_stazioni import ALIAS_CANALI
+
+
+class RegolaSoglia:
+    """Canale sopra (o sotto) una soglia per almeno `durata` secondi.
+
+    Lo stato è solo l'istante da cui la condizione è vera: nessuna finestra da
+    riesaminare. L'allarme rientra quando il valore torna oltre la soglia di
+    almeno `isteresi`, così un valore che oscilla attorno alla soglia non lo
+    fa scattare e rientrare a ogni lettura.
+    """
+
+    def __init__(self, id, canale, soglia, sopra=True, durata=0, isteresi=0, stazione=None):
+        self.id = id
+        self.canale = canale
+        self.soglia = soglia
+        self.sopra = sopra
+        self.durata = durata
+        self.isteresi = isteresi
+        self.stazione = stazione
+
+    def nuovo_stato(self):
+        return {"attivo": False, "dal": None}
+
+    def valuta(self, stato, ts, x):
+        """Restituisce 'firing', 'resolved' oppure None."""
+        if stato["attivo"]:
+            rientrato = x <= self.soglia - self.isteresi if self.sopra else x >= self.soglia + self.isteresi
+            if rientrato:
+                stato["attivo"], stato["dal"] = False, None
+                return 'resolved'
+            return None
+        if (x > self.soglia) if self.sopra else (x < self.soglia):
+            if stato["dal"] is None:
+                stato["dal"] = ts
+            if ts - stato["dal"] >= self.durata:
+                stato["attivo"] = True
+                return 'firing'
+        else:
+            stato["dal"] = None
+        return None
+
+    def messaggio(self, x):
+        segno = '>' if self.sopra else '<'
+        return f"{self.canale} {segno} {self.soglia:g} da almeno {self.durata:g} s (ora {x:g})"
+
+    def come_dict(self):
+        regola = {"id": self.id, "channel": self.canale,
+                  "above" if self.sopra else "below": self.soglia,
+                  "for": self.durata, "hysteresis": self.isteresi}
+        if self.stazione is not None:
+            regola["station"] = self.stazione
+        return regola
+
+
+class RegolaVariazione:
+    """Canale salito (o sceso) di almeno `delta` rispetto al minimo (massimo) degli ultimi `finestra` secondi.
+
+    Il minimo scorrevole viene da una deque monotona: ogni lettura entra ed
+    esce al più una volta, quindi il costo per lettura è O(1) ammortizzato e
+    la memoria è limitata alle letture nella finestra. Con `relativa` il delta
+    è in percentuale del valore di riferimento.
+    """
+
+    def __init__(self, id, canale, delta, finestra, salita=True, relativa=False, isteresi=0, stazione=None):
+        self.id = id
+        self.canale = canale
+        self.delta = delta
+        self.finestra = finestra
+        self.salita = salita
+        self.relativa = relativa
+        self.isteresi = isteresi
+        self.stazione = stazione
+
+    def nuovo_stato(self):
+        return {"attivo": False, "finestra": deque()}
+
+    def variazione(self, stato, ts, x):
+        finestra = stato["finestra"]
+        # In testa resta il minimo (salita) o il massimo (discesa) della finestra
+        if self.salita:
+            while finestra and finestra[-1][1] >= x:
+                finestra.pop()
+        else:
+            while finestra and finestra[-1][1] <= x:
+                finestra.pop()
+        finestra.append((ts, x))
+        while finestra[0][0] < ts - self.finestra:
+            finestra.popleft()
+        riferimento = finestra[0][1]
+        variazione = x - riferimento if self.salita else riferimento - x
+        if self.relativa:
+            return variazione / abs(riferimento) * 100 if riferimento else 0.0
+        return variazione
+
+    def valuta(self, stato, ts, x):
+        variazione = self.variazione(stato, ts, x)
+        if not stato["attivo"] and variazione >= self.delta:
+            stato["attivo"] = True
+            return 'firing'
+        if stato["attivo"] and variazione < self.delta - self.isteresi:
+            stato["attivo"] = False
+            return 'resolved'
+        return None
+
+    def messaggio(self, x):
+        segno = '+' if self.salita else '-'
+        unita = '%' if self.relativa else ''
+        return f"{self.canale} {segno}{self.delta:g}{unita} in {self.finestra:g} s (ora {x:g})"
+
+    def come_dict(self):
+        regola = {"id": self.id, "channel": self.canale,
+                  "rise" if self.salita else "fall": self.delta,
+                  "within": self.finestra, "relative": self.relativa, "hysteresis": self.isteresi}
+        if self.stazione is not None:
+            regola["station"] = self.stazione
+        return regola
+
+
+def regola_da_dict(dati):
+    """Costruisce una regola dalla sua forma JSON; solleva ValueError se non è valida.
+
+    Esempi:
+        {"id": "caldo", "channel": "temperature", "above": 35, "for": 600, "hysteresis": 0.5}
+        {"id": "umido", "channel": "hum", "rise": 20, "within": 3600, "station": "serra"}
+    """
+    if not isinstance(dati, dict):
+        raise ValueError("la regola deve essere un oggetto")
+    id = dati.get('id')
+    if not isinstance(id, str) or not id:
+        raise ValueError("serve un id")
+    canale = ALIAS_CANALI.get(dati.get('channel'))
+    if canale is None:
+        raise ValueError("canale sconosciuto")
+    stazione = dati.get('station')
+
+    def numero(chiave, predefinito=None):
+        valore = dati.get(chiave, predefinito)
+        if valore is None:
+            raise ValueError(f"manca {chiave}")
+        valore = float(valore)
+        if not math.isfinite(valore):
+            raise ValueError(f"{chiave} non valido")
+        return valore
+
+    isteresi = numero('hysteresis', 0)
+    if isteresi < 0:
+        raise ValueError("hysteresis non può essere negativa")
+    tipi = [chiave for chiave in ('above', 'below', 'rise', 'fall') if chiave in dati]
+    if len(tipi) != 1:
+        raise ValueError("serve esattamente uno tra above, below, rise, fall")
+    tipo = tipi[0]
+    if tipo in ('above', 'below'):
+        return RegolaSoglia(id, canale, numero(tipo), tipo == 'above', numero('for', 0), isteresi, stazione)
+    finestra = numero('within')
+    if finestra <= 0:
+        raise ValueError("within deve essere positivo")
+    return RegolaVariazione(id, canale, numero(tipo), finestra, tipo == 'rise',
+                            bool(dati.get('relative', False)), isteresi, stazione)
+
+
+class MotoreAllarmi:
+    """Valuta le regole sulle letture man mano che arrivano.
+
+    Le regole sono indicizzate per (stazione, canale): una lettura tocca solo
+    quelle che la riguardano, ognuna con uno stato incrementale per stazione,
+    e il costo non cresce con lo storico. Gli eventi (scattato/rientrato)
+    ricevono un id crescente e restano in una coda limitata da cui li leggono
+    /alerts e gli stream SSE.
+    """
+
+    def __init__(self, path=None, storia=1000):
+        self.path = path
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.eventi = deque(maxlen=storia)
+        self.attivi = {}
+        self._regole = {}
+        self._indice = {}
+        self._stati = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for dati in json.load(f):
+                    try:
+                        self._aggiungi(regola_da_dict(dati))
+                    except (ValueError, TypeError) as e:
+                        logging.warning("Regola di allarme ignorata %r: %s", dati, e)
+
+    def _aggiungi(self, regola):
+        self._rimuovi(regola.id)
+        self._regole[regola.id] = regola
+        self._indice.setdefault((regola.stazione, regola.canale), []).append(regola)
+
+    def _rimuovi(self, id):
+        regola = self._regole.pop(id, None)
+        if regola is None:
+            return False
+        self._indice[(regola.stazione, regola.canale)].remove(regola)
+        for chiave in [k for k in self._stati if k[0] == id]:
+            self._stati.pop(chiave)
+            self.attivi.pop(chiave, None)
+        return True
+
+    def _salva(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.regole(), f, indent=2)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as e:
+            logging.warning("Impossibile salvare le regole di allarme: %s", e)
+
+    def regole(self):
+        return [regola.come_dict() for regola in self._regole.values()]
+
+    def aggiungi_regola(self, dati):
+        """Aggiunge (o sostituisce) una regola dalla sua forma JSON e la salva su file."""
+        regola = regola_da_dict(dati)
+        with self.lock:
+            self._aggiungi(regola)
+            self._salva()
+        return regola
+
+    def rimuovi_regola(self, id):
+        with self.lock:
+            rimossa = self._rimuovi(id)
+            if rimossa:
+                self._salva()
+        return rimossa
+
+    def _evento(self, regola, stazione, stato, ts, x):
+        self.seq += 1
+        evento = {
+            "id": self.seq,
+            "rule": regola.id,
+            "station": stazione,
+            "channel": regola.canale,
+            "state": stato,
+            "value": x,
+            "timestamp": datetime.fromtimestamp(ts).isoformat(),
+            "message": regola.messaggio(x),
+        }
+        self.eventi.append(evento)
+        if stato == 'firing':
+            self.attivi[(regola.id, stazione)] = evento
+        else:
+            self.attivi.pop((regola.id, stazione), None)
+        return evento
+
+    def _applica(self, regola, stazione, ts, x):
+        chiave = (regola.id, stazione)
+        stato = self._stati.get(chiave)
+        if stato is None:
+            stato = self._stati[chiave] = regola.nuovo_stato()
+            stato["ts"] = -math.inf
+        # Letture più vecchie dell'ultima valutata (backfill) non cambiano lo stato
+        if ts < stato["ts"]:
+            return None
+        stato["ts"] = ts
+        esito = regola.valuta(stato, ts, x)
+        return self._evento(regola, stazione, esito, ts, x) if esito else None
+
+    def _regole_per(self, stazione, canale):
+        return self._indice.get((stazione, canale), []) + self._indice.get((None, canale), [])
+
+    def valuta(self, stazione, ts, valori):
+        """Valuta una lettura {canale: valore}; restituisce gli eventi generati."""
+        if not self._regole:
+            return []
+        eventi = []
+        with self.lock:
+            for canale, x in valori.items():
+                if x != x:
+                    continue
+                for regola in self._regole_per(stazione, canale):
+                    evento = self._applica(regola, stazione, ts, x)
+                    if evento is not None:
+                        eventi.append(evento)
+        return eventi
+
+    def valuta_blocco(self, stazione, ts, colonne):
+        """Come valuta, per letture ordinate per tempo in colonne NumPy."""
+        if not self._regole:
+            return []
+        eventi = []
+        with self.lock:
+            regole = [(r, colonne[c].tolist()) for c in colonne for r in self._regole_per(stazione, c)]
+            if not regole:
+                return []
+            for i, t in enumerate(ts.tolist()):
+                for regola, valori in regole:
+                    x = valori[i]
+                    if x != x:
+                        continue
+                    evento = self._applica(regola, stazione, t, x)
+                    if evento is not None:
+                        eventi.append(evento)
+        return eventi
+
+    def dopo(self, seq, stazione=None):
+        """Eventi con id maggiore di `seq` (della sola stazione, se indicata): (ultimo id, eventi)."""
+        with self.lock:
+            if seq >= self.seq:
+                return self.seq, []
+            primo = self.seq - len(self.eventi) + 1
+            nuovi = list(islice(self.eventi, max(0, seq + 1 - primo), None))
+            ultimo = self.seq
+        if stazione is not None:
+            nuovi = [e for e in nuovi if e["station"] == stazione]
+        return ultimo, nuovi
+
+    def attivi_per(self, stazione=None):
+        with self.lock:
+            return [e for e in self.attivi.values() if stazione is None or e["station"] == stazione]
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+def aggrega_bucket(ts, colonne, risoluzione):
+    """Raggruppa le letture in intervalli di `risoluzione` secondi.
+
+    `ts` e i valori di `colonne` devono essere array ordinati per tempo.
+    Gli intervalli sono allineati a multipli di `risoluzione` dall'epoch, così
+    richieste successive producono gli stessi bucket. I NaN (canale non
+    misurato) vengono ignorati; un bucket senza valori dà NaN.
+    Restituisce (inizio_bucket, conteggi, {canale: (min, max, media)}).
+    """
+    ts = np.asarray(ts, dtype=np.float64)
+    if ts.size == 0:
+        vuoto = np.empty(0)
+        return vuoto, vuoto.astype(np.int64), {n: (vuoto, vuoto, vuoto) for n in colonne}
+
+    indici = np.floor(ts / risoluzione).astype(np.int64)
+    inizi = np.concatenate(([0], np.flatnonzero(np.diff(indici)) + 1))
+    conteggi = np.diff(np.append(inizi, ts.size))
+
+    aggregati = {}
+    for nome, valori in colonne.items():
+        valori = np.asarray(valori, dtype=np.float64)
+        validi = ~np.isnan(valori)
+        somme = np.add.reduceat(np.where(validi, valori, 0.0), inizi)
+        presenti = np.add.reduceat(validi.astype(np.int64), inizi)
+        medie = np.divide(somme, presenti, out=np.full(len(inizi), np.nan), where=presenti > 0)
+        aggregati[nome] = (
+            np.fmin.reduceat(valori, inizi),
+            np.fmax.reduceat(valori, inizi),
+            medie,
+        )
+    return indici[inizi] * risoluzione, conteggi, aggregati
+
+
+def combina_bucket(ts, conteggi, parziali, risoluzione):
+    """Come aggrega_bucket, ma parte da bucket già aggregati (es. i rollup).
+
+    `parziali` è {canale: (n, somma, min, max)} con un elemento per bucket di
+    partenza; l'ordine dei bucket non conta e lo stesso inizio può ripetersi.
+    """
+    ts = np.asarray(ts, dtype=np.float64)
+    if ts.size == 0:
+        return aggrega_bucket(ts, {n: ts for n in parziali}, risoluzione)
+    ordine = np.argsort(ts, kind='stable')
+    indici = np.floor(ts[ordine] / risoluzione).astype(np.int64)
+    inizi = np.concatenate(([0], np.flatnonzero(np.diff(indici)) + 1))
+
+    aggregati = {}
+    for nome, (n, somme, minimi, massimi) in parziali.items():
+        n = np.add.reduceat(np.asarray(n)[ordine], inizi)
+        somme = np.add.reduceat(np.asarray(somme)[ordine], inizi)
+        medie = np.divide(somme, n, out=np.full(len(inizi), np.nan), where=n > 0)
+        aggregati[nome] = (
+            np.fmin.reduceat(np.asarray(minimi)[ordine], inizi),
+            np.fmax.reduceat(np.asarray(massimi)[ordine], inizi),
+            medie,
+        )
+    conteggi = np.add.reduceat(np.asarray(conteggi)[ordine], inizi).astype(np.int64)
+    return indici[inizi] * risoluzione, conteggi, aggregati
+
+
+def lttb(ts, valori, punti):
+    """Largest-Triangle-Three-Buckets: indici dei `punti` campioni che
+    preservano meglio la forma della serie `valori`."""
+    ts = np.asarray(ts, dtype=np.float64)
+    valori = np.asarray(valori, dtype=np.float64)
+    n = ts.size
+    if punti >= n or punti < 3:
+        return np.arange(n)
+    if np.isnan(valori).any():
+        # I buchi non devono dominare la scelta: si sostituiscono con la media
+        media = np.nanmean(valori) if (~np.isnan(valori)).any() else 0.0
+        valori = np.where(np.isnan(valori), media, valori)
+
+    # Confini dei bucket interni (primo e ultimo punto sono sempre tenuti)
+    confini = np.linspace(1, n - 1, punti - 1).astype(np.int64)
+    scelti = np.empty(punti, dtype=np.int64)
+    scelti[0] = 0
+    scelti[-1] = n - 1
+
+    a = 0
+    for i in range(punti - 2):
+        lo, hi = confini[i], confini[i + 1]
+        # Media del bucket successivo, terzo vertice del triangolo
+        prossimo_lo = hi
+        prossimo_hi = confini[i + 2] if i + 2 < len(confini) else n
+        cx = ts[prossimo_lo:prossimo_hi].mean()
+        cy = valori[prossimo_lo:prossimo_hi].mean()
+
+        aree = np.abs(
+            (ts[a] - cx) * (valori[lo:hi] - valori[a])
+            - (ts[a] - ts[lo:hi]) * (cy - valori[a])
+        )
+        a = lo + int(np.argmax(aree))
+        scelti[i + 1] = a
+    return scelti
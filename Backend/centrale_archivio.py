@@ -0,0 +1,817 @@
+import itertools
+import logging
+import mmap
+import os
+import math
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from centrale_percentili import Percentili, TDigest
+from centrale_rollup import LIVELLI
+from db import PoolConnessioni
+
+# Intestazione: magic, versione, dimensione record, numero di canali
+MAGIC = b'DFFC'
+VERSIONE = 1
+HEADER = struct.Struct('<4sHHH6x')
+
+
+class LogBinario:
+    """Log binario a record di lunghezza fissa per le letture della centrale.
+
+    Ogni record è un timestamp epoch (float64) seguito da un float64 per canale,
+    little-endian. La lunghezza fissa permette di leggere la coda del file
+    con un seek, senza analizzare il testo.
+    """
+
+    def __init__(self, path, canali=('temperature', 'humidity'), scrittore=None):
+        self.path = path
+        self.lock = threading.Lock()
+        # Con uno Scrittore i record vengono accodati e scritti dal suo thread
+        self.scrittore = scrittore
+        self._imposta_canali(canali)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        nuovo = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a+b')
+        if nuovo:
+            self.file.write(HEADER.pack(MAGIC, VERSIONE, self.record.size, len(self.canali)))
+            self.file.flush()
+        else:
+            self._verifica_header()
+            self._tronca_record_incompleto()
+
+    def _imposta_canali(self, canali):
+        self.canali = tuple(canali)
+        self.record = struct.Struct('<d' + 'd' * len(self.canali))
+        self.dtype = np.dtype([('ts', '<f8')] + [(n, '<f8') for n in self.canali])
+
+    def _verifica_header(self):
+        self.file.seek(0)
+        magic, versione, dimensione, canali = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC or versione != VERSIONE:
+            raise ValueError(f"{self.path} non è un log binario della centrale")
+        if dimensione != self.record.size or canali != len(self.canali):
+            raise ValueError(f"{self.path}: formato dei record incompatibile")
+
+    def _tronca_record_incompleto(self):
+        # Un crash durante la scrittura può lasciare un record a metà in coda
+        dimensione = os.path.getsize(self.path)
+        eccesso = (dimensione - HEADER.size) % self.record.size
+        if eccesso:
+            self.file.truncate(dimensione - eccesso)
+
+    def __len__(self):
+        return (os.path.getsize(self.path) - HEADER.size) // self.record.size
+
+    def _invia(self, dati):
+        if self.scrittore is not None:
+            self.scrittore.accoda_log(self, dati)
+        else:
+            self.scrivi(dati)
+
+    def scrivi(self, dati):
+        with self.lock:
+            self.file.write(dati)
+            self.file.flush()
+
+    def append(self, ts, *valori):
+        self._invia(self.record.pack(ts, *valori))
+
+    def append_blocco(self, ts, colonne):
+        """Scrive più record con una sola write."""
+        blocco = np.empty(len(ts), dtype=self.dtype)
+        blocco['ts'] = ts
+        for nome in self.canali:
+            blocco[nome] = colonne[nome] if nome in colonne else np.nan
+        self._invia(blocco.tobytes())
+
+    def sync(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def coda(self, n):
+        """Ultimi `n` record come array strutturato NumPy (letto via mmap)."""
+        with self.lock:
+            self.file.flush()
+            totale = len(self)
+            n = min(n, totale)
+            if n == 0:
+                return np.empty(0, dtype=self.dtype)
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = HEADER.size + (totale - n) * self.record.size
+                return np.frombuffer(mm, dtype=self.dtype, count=n, offset=offset).copy()
+
+    def migra(self, canali):
+        """Riscrive il log con un nuovo insieme di canali (quelli nuovi valgono NaN).
+
+        La copia viene scritta su un file temporaneo e poi rinominata, così un
+        crash a metà lascia intatto il log originale.
+        """
+        if self.scrittore is not None:
+            # I record già accodati hanno il vecchio formato: vanno scritti prima
+            self.scrittore.attendi()
+        with self.lock:
+            self.file.flush()
+            vecchi = np.fromfile(self.path, dtype=self.dtype, offset=HEADER.size)
+            vecchio_dtype = self.dtype
+            self._imposta_canali(canali)
+            nuovi = np.empty(len(vecchi), dtype=self.dtype)
+            for nome in self.dtype.names:
+                nuovi[nome] = vecchi[nome] if nome in vecchio_dtype.names else np.nan
+
+            temporaneo = self.path + '.tmp'
+            with open(temporaneo, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSIONE, self.record.size, len(self.canali)))
+                f.write(nuovi.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.file.close()
+            os.replace(temporaneo, self.path)
+            self.file = open(self.path, 'a+b')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def riscrivi_atomico(path, righe):
+    """Riscrive un file di testo passando da un temporaneo e da un rename atomico."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporaneo = path + '.tmp'
+    with open(temporaneo, 'w', encoding='utf-8') as f:
+        f.writelines(righe)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporaneo, path)
+
+
+def _aggiungi_testo(path, testo):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(testo)
+
+
+class Scrittore:
+    """Thread unico per tutte le scritture su disco della centrale.
+
+    Le richieste HTTP accodano i dati in una coda limitata e tornano subito.
+    Il thread raccoglie quello che arriva entro `intervallo_flush` secondi e lo
+    scrive con una write per file (group commit). Le scritture passano tutte da
+    qui, quindi non possono sovrapporsi sullo stesso file.
+
+    Politiche di fsync: 'always' dopo ogni gruppo, 'interval' al massimo ogni
+    `intervallo_fsync` secondi, 'never' lascia decidere al sistema operativo.
+
+    Ogni scrittura del gruppo è indipendente: se una fallisce (disco pieno,
+    database bloccato) gli elementi che la compongono vengono ritentati dopo
+    `attesa_ritentativo` secondi, fino a `tentativi` volte, mentre le altre
+    vanno a buon fine. attendi() aspetta anche gli elementi da ritentare.
+    """
+
+    POLITICHE_FSYNC = ('always', 'interval', 'never')
+
+    def __init__(self, dimensione_coda=10000, intervallo_flush=0.5, fsync='interval', intervallo_fsync=60):
+        if fsync not in self.POLITICHE_FSYNC:
+            raise ValueError(f"Politica di fsync non valida: {fsync}")
+        self.coda = queue.Queue(dimensione_coda)
+        self.intervallo_flush = intervallo_flush
+        self.fsync = fsync
+        self.intervallo_fsync = intervallo_fsync
+        self.massimo_gruppo = 1000
+        self.tentativi = 5
+        self.attesa_ritentativo = 1.0
+        # Elementi di scritture fallite, come [tentativi fatti, elemento]
+        self._da_ritentare = []
+        self._da_sincronizzare = set()
+        self._ultimo_fsync = time.monotonic()
+        self._thread = None
+
+    def avvia(self):
+        self._thread = threading.Thread(target=self._ciclo, name='scrittore-centrale', daemon=True)
+        self._thread.start()
+
+    def ferma(self):
+        """Scrive tutto ciò che è in coda e termina il thread."""
+        if self._thread is None:
+            return
+        self.coda.put(None)
+        self._thread.join()
+        self._thread = None
+        self._sincronizza(forza=True)
+
+    def accoda_log(self, archivio, dati):
+        self.coda.put(('log', archivio, dati))
+
+    def accoda_testo(self, path, testo):
+        """Aggiunge `testo` in fondo al file `path`."""
+        self.coda.put(('testo', path, testo))
+
+    def accoda_riscrittura(self, path, righe):
+        """Sostituisce atomicamente `path` con le righe date."""
+        self.coda.put(('riscrivi', path, righe))
+
+    def accoda_storico(self, storico, righe):
+        self.coda.put(('storico', storico, righe))
+
+    def accoda_rollup(self, storico, numero, righe):
+        self.coda.put(('rollup', storico, (numero, righe)))
+
+    def accoda_percentili(self, storico, numero, righe):
+        self.coda.put(('percentili', storico, (numero, righe)))
+
+    def accoda_sigillo(self, blocchi, blocco, storico, letture):
+        """Scrive un blocco compresso e poi elimina dallo storico le letture che contiene.
+
+        `blocco` sono gli argomenti di ArchivioBlocchi.scrivi_blocco, `letture`
+        quelli di Storico.elimina_sigillate.
+        """
+        self.coda.put(('sigilla', blocchi, (blocco, storico, letture)))
+
+    def accoda_potatura(self, storico, prima_di):
+        """Elimina dallo storico le letture più vecchie di `prima_di`, a blocchi."""
+        try:
+            self.coda.put_nowait(('pota', storico, prima_di))
+        except queue.Full:
+            # Coda piena: la potatura verrà ritentata al giro successivo
+            pass
+
+    def attendi(self):
+        """Blocca finché tutto ciò che è stato accodato è stato scritto."""
+        if self._thread is None:
+            return
+        self.coda.join()
+
+    def _ciclo(self):
+        while True:
+            attesa = self.intervallo_fsync if self.fsync == 'interval' else None
+            if self._da_ritentare:
+                attesa = self.attesa_ritentativo
+            try:
+                primo = self.coda.get(timeout=attesa)
+            except queue.Empty:
+                if self._da_ritentare:
+                    self._scrivi([])
+                self._sincronizza()
+                continue
+
+            gruppo = [primo]
+            scadenza = time.monotonic() + self.intervallo_flush
+            while primo is not None and len(gruppo) < self.massimo_gruppo:
+                attesa = scadenza - time.monotonic()
+                try:
+                    elemento = self.coda.get(timeout=attesa) if attesa > 0 else self.coda.get_nowait()
+                except queue.Empty:
+                    break
+                gruppo.append(elemento)
+                if elemento is None:
+                    break
+
+            self._scrivi([e for e in gruppo if e is not None])
+            if None in gruppo:
+                # Alla chiusura non si aspetta: un ultimo tentativo per ciò che è rimasto
+                while self._da_ritentare:
+                    for voce in self._da_ritentare:
+                        voce[0] = self.tentativi - 1
+                    self._scrivi([])
+                self.coda.task_done()
+                return
+
+    def _scrivi(self, nuovi):
+        """Scrive gli elementi da ritentare (per primi: sono i più vecchi) e quelli nuovi."""
+        voci = self._da_ritentare + [[0, elemento] for elemento in nuovi]
+        self._da_ritentare = []
+        try:
+            self._scrivi_gruppo(voci)
+        except Exception:
+            logging.exception("Errore nella scrittura su disco della centrale")
+        ritentate = {id(voce) for voce in self._da_ritentare}
+        for voce in voci:
+            if id(voce) not in ritentate:
+                self.coda.task_done()
+
+    def _prova(self, voci, scrittura, *argomenti):
+        """Esegue una scrittura; se fallisce, le voci che la compongono vengono ritentate."""
+        try:
+            scrittura(*argomenti)
+            return True
+        except Exception:
+            logging.exception("Scrittura %s della centrale non riuscita", voci[0][1][0])
+        for voce in voci:
+            voce[0] += 1
+            if voce[0] < self.tentativi:
+                self._da_ritentare.append(voce)
+                continue
+            tipo, destinazione, dati = voce[1]
+            logging.error("Scrittura %s della centrale abbandonata dopo %d tentativi", tipo, voce[0])
+            if tipo in ('rollup', 'percentili'):
+                destinazione.scarta_in_volo(tipo, [dati[0]])
+        return False
+
+    def _scrivi_gruppo(self, voci):
+        blocchi = {}
+        inserimenti = {}
+        rollup = {}
+        percentili = {}
+        for voce in voci:
+            tipo, destinazione, dati = voce[1]
+            if tipo == 'log':
+                blocchi.setdefault(destinazione, []).append(voce)
+            elif tipo == 'storico':
+                inserimenti.setdefault(destinazione, []).append(voce)
+            elif tipo == 'rollup':
+                rollup.setdefault(destinazione, []).append(voce)
+            elif tipo == 'percentili':
+                percentili.setdefault(destinazione, []).append(voce)
+            elif tipo == 'pota':
+                try:
+                    completo = destinazione.pota(dati) == destinazione.blocco_potatura
+                except Exception:
+                    # Non si ritenta: la prossima potatura programmata riparte da qui
+                    logging.exception("Potatura dello storico non riuscita")
+                    continue
+                # Un blocco per giro, così le altre scritture non restano ferme
+                if completo:
+                    self.accoda_potatura(destinazione, dati)
+            elif tipo == 'testo':
+                if self._prova([voce], _aggiungi_testo, destinazione, dati):
+                    self._da_sincronizzare.add(destinazione)
+            elif tipo == 'riscrivi':
+                self._prova([voce], riscrivi_atomico, destinazione, dati)
+            elif tipo == 'sigilla':
+                blocco, storico, letture = dati
+                if blocco is not None:
+                    # Il blocco è su disco (con fsync) prima che le letture spariscano dallo storico
+                    if not self._prova([voce], destinazione.scrivi_blocco, *blocco):
+                        continue
+                    # Se poi fallisce l'eliminazione si ritenta solo quella
+                    voce[1] = (tipo, destinazione, (None, storico, letture))
+                self._prova([voce], storico.elimina_sigillate, *letture)
+
+        for archivio, voci_log in blocchi.items():
+            if self._prova(voci_log, archivio.scrivi, b''.join(voce[1][2] for voce in voci_log)):
+                self._da_sincronizzare.add(archivio)
+        for storico, voci_storico in inserimenti.items():
+            self._prova(voci_storico, storico.inserisci, [riga for voce in voci_storico for riga in voce[1][2]])
+        for storico, voci_rollup in rollup.items():
+            self._prova(voci_rollup, storico.inserisci_rollup,
+                        [riga for voce in voci_rollup for riga in voce[1][2][1]],
+                        [voce[1][2][0] for voce in voci_rollup])
+        for storico, voci_percentili in percentili.items():
+            self._prova(voci_percentili, storico.inserisci_percentili,
+                        [riga for voce in voci_percentili for riga in voce[1][2][1]],
+                        [voce[1][2][0] for voce in voci_percentili])
+        self._sincronizza(forza=self.fsync == 'always')
+
+    def _sincronizza(self, forza=False):
+        if self.fsync == 'never' and not forza:
+            return
+        if not forza and time.monotonic() - self._ultimo_fsync < self.intervallo_fsync:
+            return
+        for destinazione in self._da_sincronizzare:
+            try:
+                if isinstance(destinazione, LogBinario):
+                    destinazione.sync()
+                else:
+                    with open(destinazione, 'a', encoding='utf-8') as f:
+                        os.fsync(f.fileno())
+            except (OSError, ValueError):
+                logging.exception("fsync non riuscito")
+        self._da_sincronizzare.clear()
+        self._ultimo_fsync = time.monotonic()
+
+
+class Storico:
+    """Archivio di lungo periodo delle letture in un database SQLite dedicato.
+
+    Una riga per lettura con una colonna per canale; l'indice univoco su
+    (station, ts) serve le interrogazioni per intervallo e scarta i duplicati.
+    La tabella rollup tiene gli aggregati per bucket dei livelli di
+    centrale_rollup (conteggio e, per canale, n/somma/min/max) e non viene
+    potata: serve i grafici di mesi e anni anche dopo la retention. Allo
+    stesso modo la tabella percentili tiene un t-digest per canale e giorno.
+    """
+
+    def __init__(self, path, canali, scrittore=None, blocco_potatura=5000):
+        self.path = path
+        self.canali = tuple(canali)
+        self.scrittore = scrittore
+        self.blocco_potatura = blocco_potatura
+        self._db = None
+        # Contributi a rollup e percentili accodati allo scrittore e non ancora
+        # salvati: rollup() e percentili() li aggiungono a quelli nel database,
+        # così tra un flush e l'altro i dati più recenti non spariscono
+        self._lock_in_volo = threading.Lock()
+        self._in_volo = {'rollup': {}, 'percentili': {}}
+        self._numeri = itertools.count()
+        # Le interrogazioni riusano le connessioni (close() le rimette nel pool)
+        self.pool = PoolConnessioni(path, busy_ms=10000)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._init_db()
+
+    def _connessione(self):
+        # Connessione del thread di scrittura: resta aperta, fuori dal pool delle letture
+        return self.pool.apri()
+
+    def _init_db(self):
+        with self.pool.connessione() as conn:
+            colonne = ", ".join(f"{nome} REAL" for nome in self.canali)
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS letture (
+                    id INTEGER PRIMARY KEY,
+                    station TEXT NOT NULL,
+                    ts REAL NOT NULL,
+                    {colonne}
+                )
+            ''')
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_letture_station_ts ON letture (station, ts)")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rollup (
+                    station TEXT NOT NULL,
+                    livello INTEGER NOT NULL,
+                    ts REAL NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (station, livello, ts)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS percentili (
+                    station TEXT NOT NULL,
+                    canale TEXT NOT NULL,
+                    giorno TEXT NOT NULL,
+                    digest BLOB NOT NULL,
+                    PRIMARY KEY (station, canale, giorno)
+                ) WITHOUT ROWID
+            ''')
+            # Migrazione: aggiungi le colonne dei canali introdotti dopo la creazione
+            presenti = {riga[1] for riga in conn.execute("PRAGMA table_info(letture)")}
+            for nome in self.canali:
+                if nome not in presenti:
+                    conn.execute(f"ALTER TABLE letture ADD COLUMN {nome} REAL")
+            presenti = {riga[1] for riga in conn.execute("PRAGMA table_info(rollup)")}
+            for nome in self.canali:
+                for colonna, tipo in self._colonne_rollup(nome):
+                    if colonna not in presenti:
+                        conn.execute(f"ALTER TABLE rollup ADD COLUMN {colonna} {tipo}")
+            conn.commit()
+            # Database creato prima dei rollup: si calcolano una volta dalle letture
+            if conn.execute("SELECT 1 FROM rollup LIMIT 1").fetchone() is None:
+                self.ricostruisci_rollup(conn)
+            if conn.execute("SELECT 1 FROM percentili LIMIT 1").fetchone() is None:
+                self.ricostruisci_percentili(conn)
+
+    @staticmethod
+    def _colonne_rollup(nome):
+        return ((f"{nome}_n", "INTEGER NOT NULL DEFAULT 0"), (f"{nome}_sum", "REAL NOT NULL DEFAULT 0"),
+                (f"{nome}_min", "REAL"), (f"{nome}_max", "REAL"))
+
+    def ricostruisci_rollup(self, conn):
+        """Ricalcola tutti i livelli dalle letture presenti (sostituisce quelli esistenti)."""
+        colonne = [c for nome in self.canali for c, _ in self._colonne_rollup(nome)]
+        aggregati = [
+            f"COUNT({nome}), TOTAL({nome}), MIN({nome}), MAX({nome})" for nome in self.canali
+        ]
+        with conn:
+            conn.execute("DELETE FROM rollup")
+            for livello in LIVELLI:
+                conn.execute(
+                    f"INSERT INTO rollup (station, livello, ts, count, {', '.join(colonne)}) "
+                    f"SELECT station, {livello}, CAST(ts / {livello} AS INTEGER) * {livello}, COUNT(*), "
+                    f"{', '.join(aggregati)} FROM letture GROUP BY station, CAST(ts / {livello} AS INTEGER)"
+                )
+
+    def ricostruisci_percentili(self, conn):
+        """Calcola i digest giornalieri dalle letture presenti (i giorni già sigillati restano senza)."""
+        stazioni = [riga[0] for riga in conn.execute("SELECT DISTINCT station FROM letture")]
+        for stazione in stazioni:
+            percentili = Percentili(self.canali)
+            digest = {}
+            cur = conn.execute(
+                f"SELECT ts, {', '.join(self.canali)} FROM letture WHERE station = ? ORDER BY ts", (stazione,))
+            while True:
+                righe = cur.fetchmany(50000)
+                if not righe:
+                    break
+                ts, colonne = self._colonne(righe, self.canali)
+                for giorno, nome, parziale in percentili.aggiungi_blocco(ts, colonne):
+                    if (giorno, nome) in digest:
+                        digest[giorno, nome].unisci(parziale)
+                    else:
+                        digest[giorno, nome] = parziale
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO percentili (station, canale, giorno, digest) VALUES (?, ?, ?, ?)",
+                    [(stazione, nome, giorno, d.in_bytes()) for (giorno, nome), d in digest.items()],
+                )
+
+    def _riga(self, stazione, ts, valori):
+        return (stazione, ts) + tuple(
+            None if v is None or math.isnan(v) else v
+            for v in (valori.get(nome) for nome in self.canali)
+        )
+
+    def accoda(self, stazione, ts, valori):
+        righe = [self._riga(stazione, ts, valori)]
+        if self.scrittore is not None:
+            self.scrittore.accoda_storico(self, righe)
+        else:
+            self.inserisci(righe)
+
+    def accoda_blocco(self, stazione, ts, colonne):
+        # Righe costruite per colonna: molto più rapido di un dizionario per lettura
+        n = len(ts)
+        valori = [
+            [None if v != v else v for v in np.asarray(colonne[nome], dtype=np.float64).tolist()]
+            if nome in colonne else [None] * n
+            for nome in self.canali
+        ]
+        righe = list(zip([stazione] * n, np.asarray(ts, dtype=np.float64).tolist(), *valori))
+        if self.scrittore is not None:
+            self.scrittore.accoda_storico(self, righe)
+        else:
+            self.inserisci(righe)
+
+    def inserisci(self, righe):
+        """Inserisce le righe in un'unica transazione (usato dal thread di scrittura)."""
+        if self._db is None:
+            self._db = self._connessione()
+        segnaposti = ", ".join("?" * (2 + len(self.canali)))
+        with self._db:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO letture (station, ts, {', '.join(self.canali)}) VALUES ({segnaposti})",
+                righe,
+            )
+
+    def accoda_rollup(self, stazione, righe):
+        """Accoda i contributi restituiti da Rollup.svuota() per la stazione."""
+        righe = [
+            (stazione, livello, inizio, conteggio) + tuple(
+                v for nome in self.canali
+                for v in self._parziale(parziali.get(nome))
+            )
+            for livello, inizio, conteggio, parziali in righe
+        ]
+        if not righe:
+            return
+        numero = self._in_volo_aggiungi('rollup', righe)
+        if self.scrittore is not None:
+            self.scrittore.accoda_rollup(self, numero, righe)
+        else:
+            self.inserisci_rollup(righe, (numero,))
+
+    def _in_volo_aggiungi(self, tipo, righe):
+        numero = next(self._numeri)
+        with self._lock_in_volo:
+            self._in_volo[tipo][numero] = righe
+        return numero
+
+    def scarta_in_volo(self, tipo, numeri):
+        """Dimentica contributi accodati che lo scrittore non è riuscito a salvare."""
+        with self._lock_in_volo:
+            for numero in numeri:
+                self._in_volo[tipo].pop(numero, None)
+
+    @staticmethod
+    def _parziale(parziale):
+        if parziale is None or parziale[0] == 0:
+            return (0, 0.0, None, None)
+        return parziale
+
+    def inserisci_rollup(self, righe, in_volo=()):
+        """Somma i contributi ai bucket già salvati (usato dal thread di scrittura).
+
+        `in_volo` sono i numeri restituiti da accoda_rollup per queste righe:
+        smettono di essere contati in memoria nello stesso momento in cui la
+        transazione li rende visibili.
+        """
+        if self._db is None:
+            self._db = self._connessione()
+        colonne = [c for nome in self.canali for c, _ in self._colonne_rollup(nome)]
+        aggiornamenti = ["count = count + excluded.count"]
+        for nome in self.canali:
+            aggiornamenti += [
+                f"{nome}_n = {nome}_n + excluded.{nome}_n",
+                f"{nome}_sum = {nome}_sum + excluded.{nome}_sum",
+                f"{nome}_min = min(coalesce({nome}_min, excluded.{nome}_min), coalesce(excluded.{nome}_min, {nome}_min))",
+                f"{nome}_max = max(coalesce({nome}_max, excluded.{nome}_max), coalesce(excluded.{nome}_max, {nome}_max))",
+            ]
+        segnaposti = ", ".join("?" * (4 + len(colonne)))
+        with self._lock_in_volo:
+            with self._db:
+                self._db.executemany(
+                    f"INSERT INTO rollup (station, livello, ts, count, {', '.join(colonne)}) VALUES ({segnaposti}) "
+                    f"ON CONFLICT (station, livello, ts) DO UPDATE SET {', '.join(aggiornamenti)}",
+                    righe,
+                )
+            for numero in in_volo:
+                self._in_volo['rollup'].pop(numero, None)
+
+    def accoda_percentili(self, stazione, righe):
+        """Accoda i digest restituiti da Percentili.svuota() per la stazione."""
+        righe = [(stazione, nome, giorno, digest.in_bytes()) for giorno, nome, digest in righe]
+        if not righe:
+            return
+        numero = self._in_volo_aggiungi('percentili', righe)
+        if self.scrittore is not None:
+            self.scrittore.accoda_percentili(self, numero, righe)
+        else:
+            self.inserisci_percentili(righe, (numero,))
+
+    def inserisci_percentili(self, righe, in_volo=()):
+        """Unisce i digest a quelli già salvati per lo stesso giorno (usato dal thread di scrittura)."""
+        if self._db is None:
+            self._db = self._connessione()
+        with self._lock_in_volo:
+            with self._db:
+                for stazione, nome, giorno, dati in righe:
+                    salvato = self._db.execute(
+                        "SELECT digest FROM percentili WHERE station = ? AND canale = ? AND giorno = ?",
+                        (stazione, nome, giorno),
+                    ).fetchone()
+                    if salvato is not None:
+                        digest = TDigest.da_bytes(salvato[0])
+                        digest.unisci(TDigest.da_bytes(dati))
+                        dati = digest.in_bytes()
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO percentili (station, canale, giorno, digest) VALUES (?, ?, ?, ?)",
+                        (stazione, nome, giorno, dati),
+                    )
+            for numero in in_volo:
+                self._in_volo['percentili'].pop(numero, None)
+
+    def percentili(self, stazione, canali, da, a):
+        """Digest dei giorni tra `da` e `a` ('AAAA-MM-GG', compresi): [(giorno, canale, TDigest)].
+
+        Comprende quelli accodati e non ancora scritti: lo stesso giorno può
+        comparire più volte.
+        """
+        canali = [c for c in canali if c in self.canali]
+        if not canali:
+            return []
+        with self.pool.connessione() as conn:
+            with self._lock_in_volo:
+                righe = conn.execute(
+                    f"SELECT giorno, canale, digest FROM percentili WHERE station = ? AND giorno >= ? AND giorno <= ? "
+                    f"AND canale IN ({', '.join('?' * len(canali))}) ORDER BY giorno",
+                    [stazione, da, a] + canali,
+                ).fetchall()
+                righe += [
+                    (giorno, nome, dati)
+                    for lotto in self._in_volo['percentili'].values()
+                    for s, nome, giorno, dati in lotto
+                    if s == stazione and nome in canali and da <= giorno <= a
+                ]
+        return [(giorno, nome, TDigest.da_bytes(dati)) for giorno, nome, dati in righe]
+
+    def rollup(self, stazione, livello, canali, da=None, a=None):
+        """Bucket di un livello che si sovrappongono a [da, a], ordinati per tempo.
+
+        Restituisce (inizi, conteggi, {canale: (n, somma, min, max)}) come array
+        NumPy. Comprende i contributi accodati e non ancora scritti: lo stesso
+        inizio può comparire più volte.
+        """
+        canali = [c for c in canali if c in self.canali]
+        condizioni = ["station = ?", "livello = ?"]
+        parametri = [stazione, livello]
+        if da is not None:
+            condizioni.append("ts > ?")
+            parametri.append(da - livello)
+        if a is not None:
+            condizioni.append("ts <= ?")
+            parametri.append(a)
+        colonne = [c for nome in canali for c, _ in self._colonne_rollup(nome)]
+        with self.pool.connessione() as conn:
+            with self._lock_in_volo:
+                righe = conn.execute(
+                    f"SELECT ts, count{''.join(', ' + c for c in colonne)} FROM rollup "
+                    f"WHERE {' AND '.join(condizioni)} ORDER BY ts",
+                    parametri,
+                ).fetchall()
+                in_volo = [
+                    riga for lotto in self._in_volo['rollup'].values() for riga in lotto
+                    if riga[0] == stazione and riga[1] == livello
+                    and (da is None or riga[2] > da - livello) and (a is None or riga[2] <= a)
+                ]
+        if in_volo:
+            indici = [self.canali.index(nome) for nome in canali]
+            # Le righe accodate prima di un canale nuovo non hanno le sue colonne
+            righe += [
+                (riga[2], riga[3]) + tuple(
+                    v for i in indici
+                    for v in (riga[4 + 4 * i:8 + 4 * i] if 8 + 4 * i <= len(riga) else self._parziale(None))
+                )
+                for riga in in_volo
+            ]
+            righe.sort(key=lambda riga: riga[0])
+        dati = np.array(righe, dtype=np.float64).reshape(len(righe), 2 + 4 * len(canali))
+        return dati[:, 0], dati[:, 1], {
+            nome: tuple(dati[:, 2 + 4 * i + j] for j in range(4)) for i, nome in enumerate(canali)
+        }
+
+    def prima_lettura(self, stazione, prima_di):
+        """Timestamp della lettura più vecchia della stazione prima di `prima_di`, oppure None."""
+        with self.pool.connessione() as conn:
+            return conn.execute(
+                "SELECT MIN(ts) FROM letture WHERE station = ? AND ts < ?", (stazione, prima_di)
+            ).fetchone()[0]
+
+    def da_sigillare(self, stazione, canali, da, prima_di):
+        """Letture con da <= ts < prima_di da comprimere in un blocco.
+
+        Restituisce (timestamps, {canale: valori}, id_massimo): elimina_sigillate
+        toglierà solo le righe lette qui, non quelle arrivate nel frattempo.
+        """
+        canali = [c for c in canali if c in self.canali]
+        with self.pool.connessione() as conn:
+            id_massimo = conn.execute("SELECT MAX(id) FROM letture").fetchone()[0] or 0
+            righe = conn.execute(
+                f"SELECT ts{''.join(', ' + c for c in canali)} FROM letture "
+                "WHERE station = ? AND ts >= ? AND ts < ? AND id <= ? ORDER BY ts",
+                (stazione, da, prima_di, id_massimo),
+            ).fetchall()
+        ts, colonne = self._colonne(righe, canali)
+        return ts, colonne, id_massimo
+
+    def elimina_sigillate(self, stazione, da, prima_di, id_massimo):
+        if self._db is None:
+            self._db = self._connessione()
+        with self._db:
+            self._db.execute(
+                "DELETE FROM letture WHERE station = ? AND ts >= ? AND ts < ? AND id <= ?",
+                (stazione, da, prima_di, id_massimo),
+            )
+
+    @staticmethod
+    def _stazioni(conn):
+        """Stazioni con letture nello storico: una ricerca sull'indice (station, ts) per ognuna."""
+        stazioni = []
+        stazione = conn.execute("SELECT MIN(station) FROM letture").fetchone()[0]
+        while stazione is not None:
+            stazioni.append(stazione)
+            stazione = conn.execute("SELECT MIN(station) FROM letture WHERE station > ?", (stazione,)).fetchone()[0]
+        return stazioni
+
+    def pota(self, prima_di):
+        """Elimina al massimo `blocco_potatura` letture più vecchie di `prima_di`.
+
+        Si procede stazione per stazione, così la ricerca usa l'indice
+        (station, ts) invece di scorrere tutta la tabella.
+        """
+        if self._db is None:
+            self._db = self._connessione()
+        rimaste = self.blocco_potatura
+        with self._db:
+            for stazione in self._stazioni(self._db):
+                cur = self._db.execute(
+                    "DELETE FROM letture WHERE id IN "
+                    "(SELECT id FROM letture WHERE station = ? AND ts < ? LIMIT ?)",
+                    (stazione, prima_di, rimaste),
+                )
+                rimaste -= cur.rowcount
+                if not rimaste:
+                    break
+        return self.blocco_potatura - rimaste
+
+    def _query_intervallo(self, stazione, canali, da, a, prima_di):
+        condizioni = ["station = ?"]
+        parametri = [stazione]
+        for condizione, valore in (("ts >= ?", da), ("ts <= ?", a), ("ts < ?", prima_di)):
+            if valore is not None:
+                condizioni.append(condizione)
+                parametri.append(valore)
+        query = (
+            f"SELECT ts{''.join(', ' + c for c in canali)} FROM letture "
+            f"WHERE {' AND '.join(condizioni)} ORDER BY ts"
+        )
+        return query, parametri
+
+    def _colonne(self, righe, canali):
+        dati = np.array(righe, dtype=np.float64).reshape(len(righe), 1 + len(canali))
+        return dati[:, 0], {nome: dati[:, i + 1] for i, nome in enumerate(canali)}
+
+    def intervallo(self, stazione, canali, da=None, a=None, prima_di=None):
+        """Letture della stazione con da <= ts <= a (e ts < prima_di), ordinate per tempo.
+
+        Restituisce (timestamps, {canale: valori}) come array NumPy.
+        """
+        canali = [c for c in canali if c in self.canali]
+        query, parametri = self._query_intervallo(stazione, canali, da, a, prima_di)
+        with self.pool.connessione() as conn:
+            righe = conn.execute(query, parametri).fetchall()
+        return self._colonne(righe, canali)
+
+    def blocchi(self, stazione, canali, da=None, a=None, prima_di=None, dimensione=5000):
+        """Come intervallo(), ma genera blocchi di `dimensione` righe alla volta."""
+        canali = [c for c in canali if c in self.canali]
+        query, parametri = self._query_intervallo(stazione, canali, da, a, prima_di)
+        with self.pool.connessione() as conn:
+            cur = conn.execute(query, parametri)
+            while True:
+                righe = cur.fetchmany(dimensione)
+                if not righe:
+                    return
+                yield self._colonne(righe, canali)
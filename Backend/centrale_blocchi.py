@@ -0,0 +1,410 @@
+import bisect
+import heapq
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from centrale_derivati import DERIVATI, calcola, dipendenze
+
+# Blocco: magic, versione, numero di canali, numero di punti, primo timestamp in ms
+HEADER_BLOCCO = struct.Struct('<4sBBIq')
+MAGIC_BLOCCO = b'DFFG'
+VERSIONE_BLOCCO = 1
+# Voce dell'indice: primo e ultimo timestamp, offset e lunghezza nel file dati, punti
+VOCE_INDICE = struct.Struct('<ddQII')
+# Un blocco copre al massimo un giorno: serve a limitare la ricerca nell'indice
+DURATA_BLOCCO = 86400
+
+_DOUBLE = struct.Struct('<d')
+_UINT64 = struct.Struct('<Q')
+
+
+class _ScrittoreBit:
+    def __init__(self):
+        self.dati = bytearray()
+        self._acc = 0
+        self._n = 0
+
+    def scrivi(self, valore, bit):
+        self._acc = (self._acc << bit) | valore
+        self._n += bit
+        if self._n >= 64:
+            self._n -= 64
+            self.dati += (self._acc >> self._n).to_bytes(8, 'big')
+            self._acc &= (1 << self._n) - 1
+
+    def chiudi(self):
+        if self._n:
+            resto = (self._n + 7) // 8
+            self.dati += (self._acc << (resto * 8 - self._n)).to_bytes(resto, 'big')
+            self._acc = self._n = 0
+        return bytes(self.dati)
+
+
+class _LettoreBit:
+    def __init__(self, dati):
+        self.dati = dati
+        self.pos = 0
+
+    def leggi(self, bit):
+        inizio = self.pos >> 3
+        fine = (self.pos + bit + 7) >> 3
+        valore = int.from_bytes(self.dati[inizio:fine], 'big')
+        self.pos += bit
+        return (valore >> (fine * 8 - self.pos)) & ((1 << bit) - 1)
+
+    def bit(self):
+        b = (self.dati[self.pos >> 3] >> (7 - (self.pos & 7))) & 1
+        self.pos += 1
+        return b
+
+
+# Delta-of-delta dei timestamp: (prefisso, bit del prefisso, bit del valore)
+_CLASSI_DOD = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+
+
+def _codifica_tempi(millis):
+    out = _ScrittoreBit()
+    precedente, delta_precedente = millis[0], 0
+    for t in millis[1:]:
+        delta = t - precedente
+        dod = delta - delta_precedente
+        if dod == 0:
+            out.scrivi(0, 1)
+        else:
+            for prefisso, bit_prefisso, bit in _CLASSI_DOD:
+                if -(1 << (bit - 1)) <= dod < (1 << (bit - 1)):
+                    out.scrivi(prefisso, bit_prefisso)
+                    out.scrivi(dod & ((1 << bit) - 1), bit)
+                    break
+            else:
+                out.scrivi(0b1111, 4)
+                out.scrivi(dod & 0xFFFFFFFFFFFFFFFF, 64)
+        precedente, delta_precedente = t, delta
+    return out.chiudi()
+
+
+def _decodifica_tempi(dati, inizio, n):
+    """Generatore dei timestamp in ms."""
+    if n == 0:
+        return
+    ingresso = _LettoreBit(dati)
+    t, delta = inizio, 0
+    yield t
+    for _ in range(n - 1):
+        if ingresso.bit():
+            for bit in (7, 9, 12):
+                if not ingresso.bit():
+                    break
+            else:
+                bit = 64
+            dod = ingresso.leggi(bit)
+            if dod >= 1 << (bit - 1):
+                dod -= 1 << bit
+            delta += dod
+        t += delta
+        yield t
+
+
+def _codifica_valori(bit_valori):
+    """XOR di ogni valore con il precedente; si scrivono solo i bit significativi."""
+    out = _ScrittoreBit()
+    precedente = bit_valori[0]
+    out.scrivi(precedente, 64)
+    zeri_testa, lunghezza = 65, 0
+    for v in bit_valori[1:]:
+        xor = v ^ precedente
+        precedente = v
+        if xor == 0:
+            out.scrivi(0, 1)
+            continue
+        testa = min(64 - xor.bit_length(), 31)
+        coda = (xor & -xor).bit_length() - 1
+        if testa >= zeri_testa and coda >= 64 - zeri_testa - lunghezza:
+            # I bit cambiati stanno nella finestra del valore precedente
+            out.scrivi(0b10, 2)
+            out.scrivi(xor >> (64 - zeri_testa - lunghezza), lunghezza)
+        else:
+            zeri_testa, lunghezza = testa, 64 - testa - coda
+            out.scrivi(0b11, 2)
+            out.scrivi(zeri_testa, 5)
+            out.scrivi(lunghezza - 1, 6)
+            out.scrivi(xor >> coda, lunghezza)
+    return out.chiudi()
+
+
+def _decodifica_valori(dati, n):
+    """Generatore dei valori come interi a 64 bit (bit del double)."""
+    if n == 0:
+        return
+    ingresso = _LettoreBit(dati)
+    v = ingresso.leggi(64)
+    yield v
+    zeri_testa, lunghezza = 0, 64
+    for _ in range(n - 1):
+        if ingresso.bit():
+            if ingresso.bit():
+                zeri_testa = ingresso.leggi(5)
+                lunghezza = ingresso.leggi(6) + 1
+            v ^= ingresso.leggi(lunghezza) << (64 - zeri_testa - lunghezza)
+        yield v
+
+
+def codifica_blocco(ts, colonne):
+    """Comprime letture ordinate per tempo in un blocco.
+
+    I timestamp sono arrotondati al millisecondo e codificati come
+    delta-of-delta, ogni canale come XOR col valore precedente (Gorilla).
+    Ogni canale ha un flusso separato, così la lettura può decodificare solo
+    i canali richiesti.
+    """
+    millis = np.round(np.asarray(ts, dtype=np.float64) * 1000).astype(np.int64).tolist()
+    nomi = list(colonne)
+    flussi = [_codifica_tempi(millis) if millis else b'']
+    for nome in nomi:
+        bit = np.ascontiguousarray(colonne[nome], dtype='<f8').view('<u8').tolist()
+        flussi.append(_codifica_valori(bit) if bit else b'')
+    testa = HEADER_BLOCCO.pack(MAGIC_BLOCCO, VERSIONE_BLOCCO, len(nomi), len(millis), millis[0] if millis else 0)
+    testa += b''.join(struct.pack('<B', len(n.encode())) + n.encode() for n in nomi)
+    testa += struct.pack(f'<{len(flussi)}I', *(len(f) for f in flussi))
+    return testa + b''.join(flussi)
+
+
+def _apri_blocco(dati):
+    """Restituisce (punti, primo ms, {nome: flusso}) con i flussi come memoryview."""
+    magic, versione, n_canali, punti, inizio = HEADER_BLOCCO.unpack_from(dati)
+    if magic != MAGIC_BLOCCO or versione != VERSIONE_BLOCCO:
+        raise ValueError("Blocco compresso non riconosciuto")
+    pos = HEADER_BLOCCO.size
+    nomi = []
+    for _ in range(n_canali):
+        lunghezza = dati[pos]
+        nomi.append(bytes(dati[pos + 1:pos + 1 + lunghezza]).decode())
+        pos += 1 + lunghezza
+    lunghezze = struct.unpack_from(f'<{n_canali + 1}I', dati, pos)
+    pos += 4 * (n_canali + 1)
+    flussi = {}
+    for nome, lunghezza in zip([None] + nomi, lunghezze):
+        flussi[nome] = memoryview(dati)[pos:pos + lunghezza]
+        pos += lunghezza
+    return punti, inizio, flussi
+
+
+def itera_blocco(dati, canali):
+    """Generatore pigro di (ts, valore_canale1, ...) per i `canali` richiesti;
+    un canale assente dal blocco vale NaN."""
+    punti, inizio, flussi = _apri_blocco(dati)
+    sorgenti = [_decodifica_tempi(flussi[None], inizio, punti)]
+    for nome in canali:
+        if nome in flussi:
+            sorgenti.append(_decodifica_valori(flussi[nome], punti))
+        else:
+            sorgenti.append(iter([_UINT64.unpack(_DOUBLE.pack(float('nan')))[0]] * punti))
+    for millis, *bit in zip(*sorgenti):
+        yield (millis / 1000,) + tuple(_DOUBLE.unpack(_UINT64.pack(b))[0] for b in bit)
+
+
+def decodifica_blocco(dati, canali):
+    """Decodifica un blocco intero in (ts, {canale: valori}) come array NumPy."""
+    punti, inizio, flussi = _apri_blocco(dati)
+    ts = np.fromiter(_decodifica_tempi(flussi[None], inizio, punti), dtype=np.int64, count=punti) / 1000
+    colonne = {}
+    for nome in canali:
+        if nome in flussi:
+            bit = np.fromiter(_decodifica_valori(flussi[nome], punti), dtype=np.uint64, count=punti)
+            colonne[nome] = bit.view(np.float64)
+        else:
+            colonne[nome] = np.full(punti, np.nan)
+    return ts, colonne
+
+
+def _decodifica_con_derivati(dati, canali):
+    """Come decodifica_blocco, ma `canali` può contenere canali derivati."""
+    misurati = [c for c in canali if c not in DERIVATI]
+    ts, colonne = decodifica_blocco(dati, list(dict.fromkeys(misurati + dipendenze(canali))))
+    colonne.update(calcola(canali, colonne, len(ts)))
+    return ts, {nome: colonne[nome] for nome in canali}
+
+
+class CacheBlocchi:
+    """Blocchi sigillati già decodificati, con i canali derivati già calcolati.
+
+    Un blocco sigillato non cambia più: le sue colonne, misurate e derivate,
+    restano valide finché restano in cache. Le voci sono per blocco e per
+    canale, e si aggiungono man mano che vengono chieste; oltre
+    `massimo_byte` si scartano i blocchi usati meno di recente.
+    """
+
+    def __init__(self, massimo_byte):
+        self.massimo_byte = massimo_byte
+        self.lock = threading.Lock()
+        self.byte = 0
+        self.trovati = 0
+        self.mancati = 0
+        self._blocchi = OrderedDict()
+
+    def colonne(self, chiave, canali, leggi):
+        """(ts, {canale: valori}) del blocco `chiave`; leggi() restituisce i suoi byte se serve decodificarlo."""
+        with self.lock:
+            voce = self._blocchi.get(chiave)
+            if voce is not None:
+                self._blocchi.move_to_end(chiave)
+                ts, colonne = voce
+                if all(nome in colonne for nome in canali):
+                    self.trovati += 1
+                    return ts, {nome: colonne[nome] for nome in canali}
+            self.mancati += 1
+        presenti = voce[1] if voce is not None else {}
+        mancanti = [nome for nome in canali if nome not in presenti]
+        if voce is not None and all(nome in DERIVATI for nome in mancanti) \
+                and all(d in presenti for d in dipendenze(mancanti)):
+            # Servono solo derivati di colonne già decodificate
+            ts, nuove = voce[0], calcola(mancanti, presenti, len(voce[0]))
+        else:
+            ts, nuove = _decodifica_con_derivati(leggi(), mancanti)
+        with self.lock:
+            voce = self._blocchi.get(chiave)
+            if voce is None:
+                voce = self._blocchi[chiave] = (ts, {})
+                self.byte += ts.nbytes
+            for nome, valori in nuove.items():
+                if nome not in voce[1]:
+                    voce[1][nome] = valori
+                    self.byte += valori.nbytes
+            self._blocchi.move_to_end(chiave)
+            while self.byte > self.massimo_byte and len(self._blocchi) > 1:
+                _, (vecchi_ts, vecchie) = self._blocchi.popitem(last=False)
+                self.byte -= vecchi_ts.nbytes + sum(v.nbytes for v in vecchie.values())
+            return voce[0], {nome: voce[1][nome] for nome in canali}
+
+
+class ArchivioBlocchi:
+    """File di blocchi compressi sigillati più il loro indice.
+
+    I blocchi vengono solo aggiunti in fondo a `path`; l'indice `path`.idx ha
+    una voce di dimensione fissa per blocco (intervallo di tempo, posizione e
+    numero di punti). In memoria l'indice è ordinato per inizio, quindi una
+    lettura per intervallo trova con una bisezione i soli blocchi coinvolti e
+    decodifica solo quelli. Un blocco può sovrapporsi ad altri (letture
+    arrivate dopo la sigillatura del giorno).
+    """
+
+    def __init__(self, path, cache=None):
+        self.path = path
+        self.path_indice = path + '.idx'
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.voci = []
+        self._inizi = []
+        self._carica_indice()
+
+    def _carica_indice(self):
+        dimensione_dati = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        voci = []
+        if os.path.exists(self.path_indice):
+            with open(self.path_indice, 'rb') as f:
+                contenuto = f.read()
+            for i in range(len(contenuto) // VOCE_INDICE.size):
+                voce = VOCE_INDICE.unpack_from(contenuto, i * VOCE_INDICE.size)
+                if voce[2] + voce[3] > dimensione_dati:
+                    break  # blocco non scritto per intero (interruzione durante la scrittura)
+                voci.append(voce)
+        # Si scarta quello che segue l'ultimo blocco indicizzato
+        fine = max((v[2] + v[3] for v in voci), default=0)
+        if dimensione_dati > fine:
+            with open(self.path, 'r+b') as f:
+                f.truncate(fine)
+        if os.path.exists(self.path_indice) and os.path.getsize(self.path_indice) != len(voci) * VOCE_INDICE.size:
+            with open(self.path_indice, 'r+b') as f:
+                f.truncate(len(voci) * VOCE_INDICE.size)
+        for voce in voci:
+            self._indicizza(voce)
+
+    def _indicizza(self, voce):
+        i = bisect.bisect_right(self._inizi, voce[0])
+        self._inizi.insert(i, voce[0])
+        self.voci.insert(i, voce)
+
+    def __len__(self):
+        return sum(v[4] for v in self.voci)
+
+    def dimensione(self):
+        return sum(v[3] for v in self.voci)
+
+    def scrivi_blocco(self, dati, da, a, punti):
+        """Aggiunge un blocco già codificato e lo rende durevole prima di indicizzarlo."""
+        with self.lock:
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(dati)
+                f.flush()
+                os.fsync(f.fileno())
+            voce = (da, a, offset, len(dati), punti)
+            with open(self.path_indice, 'ab') as f:
+                f.write(VOCE_INDICE.pack(*voce))
+                f.flush()
+                os.fsync(f.fileno())
+            self._indicizza(voce)
+
+    def sovrapposti(self, da=None, a=None):
+        """Voci dell'indice dei blocchi che si sovrappongono a [da, a], per inizio."""
+        with self.lock:
+            lo = 0 if da is None else bisect.bisect_left(self._inizi, da - DURATA_BLOCCO)
+            hi = len(self.voci) if a is None else bisect.bisect_right(self._inizi, a)
+            return [v for v in self.voci[lo:hi] if da is None or v[1] >= da]
+
+    def _leggi(self, voce):
+        with open(self.path, 'rb') as f:
+            f.seek(voce[2])
+            return f.read(voce[3])
+
+    def punti(self, canali, da=None, a=None):
+        """Generatore pigro di (ts, valori...) in ordine di tempo: ogni blocco viene
+        letto e decodificato solo quando il consumatore ci arriva."""
+        def dal_blocco(voce):
+            for riga in itera_blocco(self._leggi(voce), canali):
+                if (da is None or riga[0] >= da) and (a is None or riga[0] <= a):
+                    yield riga
+
+        # I blocchi che non si sovrappongono si leggono uno dopo l'altro; solo i
+        # gruppi che si sovrappongono (letture tardive) vengono fusi per tempo
+        gruppo, fine_gruppo = [], None
+        for voce in self.sovrapposti(da, a):
+            if gruppo and voce[0] > fine_gruppo:
+                yield from heapq.merge(*(dal_blocco(v) for v in gruppo), key=lambda riga: riga[0])
+                gruppo = []
+            fine_gruppo = voce[1] if not gruppo else max(fine_gruppo, voce[1])
+            gruppo.append(voce)
+        yield from heapq.merge(*(dal_blocco(v) for v in gruppo), key=lambda riga: riga[0])
+
+    def blocchi(self, canali, da=None, a=None, usa_cache=True):
+        """Genera (ts, {canale: valori}) come array, un blocco alla volta, già
+        ristretti a [da, a]. I blocchi escono in ordine di inizio.
+
+        `canali` può contenere canali derivati. Con una cache (e `usa_cache`)
+        i blocchi decodificati restano in memoria per le richieste successive;
+        le letture una tantum (export completo) la lasciano com'è.
+        """
+        for voce in self.sovrapposti(da, a):
+            if self.cache is not None and usa_cache:
+                ts, colonne = self.cache.colonne((self.path, voce[2]), canali, lambda: self._leggi(voce))
+            else:
+                ts, colonne = _decodifica_con_derivati(self._leggi(voce), canali)
+            dentro = np.ones(len(ts), dtype=bool)
+            if da is not None:
+                dentro &= ts >= da
+            if a is not None:
+                dentro &= ts <= a
+            yield ts[dentro], {nome: valori[dentro] for nome, valori in colonne.items()}
+
+    def intervallo(self, canali, da=None, a=None):
+        """Letture tra da e a come array NumPy (ts, {canale: valori}), ordinate per tempo."""
+        parti = list(self.blocchi(canali, da, a))
+        if not parti:
+            return np.empty(0), {nome: np.empty(0) for nome in canali}
+        ts = np.concatenate([p[0] for p in parti])
+        ordine = np.argsort(ts, kind='stable')
+        return ts[ordine], {nome: np.concatenate([p[1][nome] for p in parti])[ordine] for nome in canali}
@@ -0,0 +1,319 @@
+from array import array
+import heapq
+import os
+import threading
+
+import numpy as np
+
+# Righe della coda del buffer che un'unione di letture fuori ordine può
+# riscrivere: le letture che andrebbero più indietro vengono rifiutate
+RIORDINO_MASSIMO = int(os.environ.get('CENTRALE_RIORDINO', 1000))
+
+
+class RingBuffer:
+    """Buffer circolare a colonne per le letture della centrale.
+
+    I timestamp (epoch in secondi) e ogni canale sono memorizzati in array('d'):
+    le colonne crescono con le letture fino alla capacità, poi il buffer gira
+    sovrascrivendo le più vecchie. L'inserimento è O(1).
+
+    Ogni lettura ha il numero di sequenza del suo arrivo (colonna `sequenze`,
+    1 per la prima): resta lo stesso anche quando un'unione fuori ordine la
+    sposta, così gli id degli eventi SSE che ne derivano non cambiano.
+    """
+
+    def __init__(self, capacita, canali=('temperature', 'humidity')):
+        if capacita <= 0:
+            raise ValueError("La capacità deve essere positiva")
+        self.capacita = capacita
+        self.canali = tuple(canali)
+        self.timestamps = array('d')
+        self.sequenze = array('q')
+        self.colonne = {nome: array('d') for nome in self.canali}
+        self.lock = threading.RLock()
+        self._inizio = 0
+        self._count = 0
+        # Numero di sequenza dell'ultima lettura inserita (cresce sempre)
+        self.totale = 0
+
+    def __len__(self):
+        return self._count
+
+    def _fisico(self, i):
+        return (self._inizio + i) % self.capacita
+
+    def append(self, ts, *valori):
+        """Aggiunge una lettura, sovrascrivendo la più vecchia se il buffer è pieno."""
+        if len(valori) != len(self.canali):
+            raise ValueError("Numero di valori diverso dal numero di canali")
+        with self.lock:
+            if self._count < self.capacita:
+                pos = self._fisico(self._count)
+                self._count += 1
+            else:
+                pos = self._inizio
+                self._inizio = (self._inizio + 1) % self.capacita
+            self.totale += 1
+            if pos == len(self.timestamps):
+                # Il buffer non ha ancora raggiunto la capacità: le colonne crescono
+                self.timestamps.append(ts)
+                self.sequenze.append(self.totale)
+                for nome, valore in zip(self.canali, valori):
+                    self.colonne[nome].append(valore)
+            else:
+                self.timestamps[pos] = ts
+                self.sequenze[pos] = self.totale
+                for nome, valore in zip(self.canali, valori):
+                    self.colonne[nome][pos] = valore
+
+    def aggiungi_canale(self, nome):
+        """Aggiunge una colonna; le letture già presenti valgono NaN."""
+        with self.lock:
+            if nome in self.colonne:
+                return
+            self.colonne[nome] = array('d', [float('nan')]) * len(self.timestamps)
+            self.canali += (nome,)
+
+    def estendi(self, ts, colonne, sequenze=None):
+        """Aggiunge in blocco letture già ordinate (es. al riavvio dal log).
+
+        Senza `sequenze` le letture ricevono i numeri successivi a `totale`.
+        """
+        with self.lock:
+            if sequenze is None:
+                sequenze = range(self.totale + 1, self.totale + len(ts) + 1)
+                self.totale += len(ts)
+            self._estendi(ts, colonne, sequenze)
+
+    def _estendi(self, ts, colonne, sequenze):
+        n = len(ts)
+        if n > self.capacita:
+            ts = ts[n - self.capacita:]
+            sequenze = sequenze[n - self.capacita:]
+            colonne = {nome: valori[n - self.capacita:] for nome, valori in colonne.items()}
+            n = self.capacita
+        if n == 0:
+            return
+        sorgenti = [(self.timestamps, array('d', ts)), (self.sequenze, array('q', sequenze))]
+        sorgenti += [(self.colonne[nome], array('d', colonne[nome])) for nome in self.canali]
+        crescita = min(n, self.capacita - len(self.timestamps))
+        if crescita > 0:
+            # Prima si riempie lo spazio ancora da allocare (buffer lineare)
+            for destinazione, valori in sorgenti:
+                destinazione.extend(valori[:crescita])
+            self._count += crescita
+            n -= crescita
+            sorgenti = [(destinazione, valori[crescita:]) for destinazione, valori in sorgenti]
+            if n == 0:
+                return
+        pos = self._fisico(self._count) if self._count < self.capacita else self._inizio
+        k = min(n, self.capacita - pos)
+        for destinazione, valori in sorgenti:
+            destinazione[pos:pos + k] = valori[:k]
+            destinazione[0:n - k] = valori[k:]
+        if self._count + n > self.capacita:
+            self._inizio = (pos + n) % self.capacita
+        self._count = min(self.capacita, self._count + n)
+
+    def unisci(self, ts, colonne):
+        """Inserisce letture ordinate che possono precedere l'ultima presente.
+
+        Solo la coda del buffer successiva al primo timestamp nuovo viene
+        riscritta, al massimo RIORDINO_MASSIMO righe: le letture che
+        andrebbero più indietro restano fuori dal buffer, ma ricevono comunque
+        il loro numero di sequenza (vanno nel log come le altre). Restituisce
+        quante letture (le prime) sono rimaste fuori.
+        """
+        if len(ts) == 0:
+            return 0
+        with self.lock:
+            scartate = 0
+            if self._count > RIORDINO_MASSIMO:
+                limite = self.timestamps[self._fisico(self._count - RIORDINO_MASSIMO - 1)]
+                if ts[0] < limite:
+                    scartate = int(np.searchsorted(np.asarray(ts, dtype=np.float64), limite))
+                    self.totale += scartate
+                    ts = ts[scartate:]
+                    colonne = {nome: valori[scartate:] for nome, valori in colonne.items()}
+                    if len(ts) == 0:
+                        return scartate
+            start = self.bisect(ts[0], destra=True)
+            if start == self._count:
+                self.estendi(ts, colonne)
+                return scartate
+            coda_ts, coda = self.finestra(start)
+            coda_sequenze = self._copia(self.sequenze, start, self._count)
+            self._count = start
+            if len(self.timestamps) < self.capacita:
+                # Buffer ancora lineare: si accorciano le colonne
+                del self.timestamps[start:]
+                del self.sequenze[start:]
+                for colonna in self.colonne.values():
+                    del colonna[start:]
+            # Le letture già presenti tengono il loro numero, quelle nuove seguono `totale`
+            righe = heapq.merge(
+                zip(coda_ts, coda_sequenze, *(coda[n] for n in self.canali)),
+                zip(ts, range(self.totale + 1, self.totale + len(ts) + 1), *(colonne[n] for n in self.canali)),
+                key=lambda riga: riga[0],
+            )
+            self.totale += len(ts)
+            unite = list(zip(*righe))
+            self._estendi(unite[0], dict(zip(self.canali, unite[2:])), unite[1])
+            return scartate
+
+    def clear(self):
+        with self.lock:
+            self._inizio = 0
+            self._count = 0
+
+    def ultimo(self):
+        """Restituisce (ts, valori) dell'ultima lettura, oppure None se vuoto."""
+        with self.lock:
+            if self._count == 0:
+                return None
+            pos = self._fisico(self._count - 1)
+            return self.timestamps[pos], tuple(self.colonne[n][pos] for n in self.canali)
+
+    def primo(self):
+        """Timestamp della lettura più vecchia, oppure None se vuoto."""
+        with self.lock:
+            if self._count == 0:
+                return None
+            return self.timestamps[self._fisico(0)]
+
+    def bisect(self, ts, destra=False):
+        """Ricerca binaria sull'indice logico (i timestamp sono ordinati).
+
+        Con destra=False restituisce il primo indice con timestamp >= ts,
+        con destra=True il primo indice con timestamp > ts.
+        """
+        with self.lock:
+            lo, hi = 0, self._count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                valore = self.timestamps[self._fisico(mid)]
+                if valore < ts or (destra and valore == ts):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+    def intervallo(self, da=None, a=None):
+        """Indici logici [start, stop) delle letture con da <= ts <= a, in O(log n)."""
+        with self.lock:
+            start = 0 if da is None else self.bisect(da)
+            stop = self._count if a is None else self.bisect(a, destra=True)
+            return start, max(start, stop)
+
+    def finestra_tra(self, da=None, a=None):
+        """(primo timestamp, ts, colonne) delle letture con da <= ts <= a, letti insieme."""
+        with self.lock:
+            return (self.primo(), *self.finestra(*self.intervallo(da, a)))
+
+    def dopo(self, seq, massimo=None, fino=None):
+        """Letture arrivate dopo il numero di sequenza `seq` (e fino a `fino`)
+        ancora presenti nel buffer, in ordine di tempo.
+
+        Restituisce (id_eventi, righe): id_eventi[i] è l'id da dare all'evento
+        della riga i, il numero fino a cui tutte le letture sono state
+        consegnate (vedi id_consegna); con `massimo` si tengono solo le più
+        recenti.
+        """
+        with self.lock:
+            # Una lettura arrivata dopo `seq` sta al massimo RIORDINO_MASSIMO righe
+            # prima di quelle arrivate prima di lei
+            start = max(0, self._count - RIORDINO_MASSIMO - max(0, self.totale - seq) - 1)
+            sequenze = np.frombuffer(self._copia(self.sequenze, start, self._count), dtype=np.int64)
+            ts, colonne = self.finestra(start)
+        return selezione_dopo(sequenze, ts, [colonne[n] for n in self.canali], seq, massimo, fino)
+
+    def _segmenti(self, start, stop):
+        """Intervalli fisici (lo, hi) corrispondenti agli indici logici [start, stop)."""
+        if start >= stop:
+            return []
+        lo = self._fisico(start)
+        n = stop - start
+        if lo + n <= self.capacita:
+            return [(lo, lo + n)]
+        return [(lo, self.capacita), (0, lo + n - self.capacita)]
+
+    def _copia(self, colonna, start, stop):
+        risultato = array(colonna.typecode)
+        for lo, hi in self._segmenti(start, stop):
+            risultato.extend(colonna[lo:hi])
+        return risultato
+
+    def finestra(self, start=0, stop=None):
+        """Copia in ordine cronologico delle righe logiche [start, stop).
+
+        Restituisce (timestamps, {canale: valori}) come array('d').
+        """
+        with self.lock:
+            stop = self._count if stop is None else min(stop, self._count)
+            start = max(0, start)
+            ts = self._copia(self.timestamps, start, stop)
+            colonne = {n: self._copia(self.colonne[n], start, stop) for n in self.canali}
+        return ts, colonne
+
+    def blocchi(self, da=None, a=None, dimensione=5000):
+        """Genera le letture con da <= ts <= a a blocchi di `dimensione` righe.
+
+        Ogni blocco è (timestamps, {canale: valori}). La posizione è ritrovata
+        per timestamp a ogni blocco, quindi la scansione resta corretta anche
+        se nel frattempo arrivano nuove letture.
+        """
+        ultimo = None
+        ripetuti = 0
+        while True:
+            with self.lock:
+                if ultimo is not None:
+                    # Si riparte dopo le righe già inviate con lo stesso timestamp dell'ultima
+                    start = self.bisect(ultimo) + ripetuti
+                else:
+                    start = 0 if da is None else self.bisect(da)
+                stop = self._count if a is None else self.bisect(a, destra=True)
+                ts, colonne = self.finestra(start, min(stop, start + dimensione))
+            if not ts:
+                return
+            yield ts, colonne
+            coda = 0
+            while coda < len(ts) and ts[-1 - coda] == ts[-1]:
+                coda += 1
+            ripetuti = ripetuti + coda if ts[-1] == ultimo else coda
+            ultimo = ts[-1]
+
+    def righe(self, start=0, stop=None):
+        """Itera le righe (ts, valore1, valore2, ...) in ordine cronologico."""
+        ts, colonne = self.finestra(start, stop)
+        return zip(ts, *(colonne[n] for n in self.canali))
+
+
+def id_consegna(sequenze):
+    """Id degli eventi per righe con questi numeri di sequenza, in ordine di tempo.
+
+    Dopo una lettura fuori ordine i numeri non crescono con il tempo: l'id
+    dell'evento i è il numero fino a cui tutte le letture sono già state
+    consegnate, così chi si ricollega con Last-Event-ID non ne perde nessuna
+    (al più ne riceve di nuovo qualcuna).
+    """
+    minimi = np.minimum.accumulate(sequenze[::-1])[::-1]
+    return np.append(minimi[1:] - 1, sequenze.max()).tolist()
+
+
+def selezione_dopo(sequenze, ts, colonne, seq, massimo=None, fino=None):
+    """Parte comune di dopo(): righe con seq < numero <= fino, con i loro id."""
+    scelte = sequenze > seq
+    if fino is not None:
+        scelte &= sequenze <= fino
+    indici = np.flatnonzero(scelte)
+    if not len(indici):
+        return [], iter(())
+    ultimo = int(sequenze[indici].max())
+    if massimo is not None:
+        # Le righe più vecchie lasciate fuori contano come consegnate
+        indici = indici[-massimo:]
+    id_eventi = id_consegna(sequenze[indici])
+    id_eventi[-1] = ultimo
+    ts = np.asarray(ts, dtype=np.float64)[indici].tolist()
+    colonne = [np.asarray(valori, dtype=np.float64)[indici].tolist() for valori in colonne]
+    return id_eventi, zip(ts, *colonne)
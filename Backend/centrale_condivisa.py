@@ -0,0 +1,620 @@
+"""Buffer delle stazioni in memoria condivisa, per servire centrale da più processi.
+
+Ogni stazione ha un segmento `multiprocessing.shared_memory` con la finestra
+circolare delle letture (la stessa di RingBuffer, ordinata per tempo) e una
+coda delle letture nell'ordine di arrivo, da cui ogni processo ricava cosa è
+arrivato dagli altri. Ogni segmento ha un file di lock: chi scrive prende
+un flock esclusivo, chi legge uno condiviso, così più letture procedono
+insieme e nessuna vede una scrittura a metà. Le chiamate di sistema del lock
+fanno da barriera di memoria, quindi la garanzia non dipende dall'ordine in
+cui la CPU rende visibili le scritture (vale anche su ARM, es. Raspberry Pi).
+I campi dell'header letti da soli (count, totali) sono interi da 8 byte
+allineati e si leggono senza lock.
+
+Non è il seqlock con letture senza chiamate di sistema previsto all'inizio:
+ogni lettura della finestra costa un flock (una chiamata di sistema, niente
+round-trip tra processi). Un seqlock in Python non ha barriere di memoria
+esplicite e su ARM un lettore potrebbe vedere il contatore aggiornato prima
+dei dati; il flock costa qualche microsecondo ma è corretto ovunque.
+
+Uso da riga di comando, per eliminare i segmenti a server fermo:
+    python centrale_condivisa.py --remove centrale
+"""
+import argparse
+import fcntl
+import os
+import tempfile
+import threading
+import weakref
+from array import array
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from centrale_buffer import RIORDINO_MASSIMO, selezione_dopo
+
+MAGIC = 0x43454E5452414C45  # 'CENTRALE'
+LUNGHEZZA_ID = 32
+# Header del buffer: campi fissi, poi (da H_ORDINE) l'ordine di aggiunta dei canali
+(H_MAGIC, H_TOTALE, H_COUNT, H_INIZIO, H_CAPACITA, H_COLONNE, H_PRESENTI,
+ H_CODA_TOTALE, H_CODA_CAPACITA, H_PERSISTITE, H_ORDINE) = range(11)
+# Tipi delle letture nella coda degli arrivi: unite al buffer, più vecchie
+# della finestra di riordino (solo archivio, rollup compresi), correzioni di
+# letture già presenti (solo storico)
+NEL_BUFFER, FUORI_FINESTRA, CORREZIONE = range(3)
+# Header dell'indice delle stazioni: numero di id, poi un campo non usato
+I_PRESENTI = 0
+
+
+def _apri_segmento(nome, dimensione):
+    """Crea o apre il segmento `nome`; restituisce (segmento, creato)."""
+    try:
+        segmento, creato = shared_memory.SharedMemory(nome, create=True, size=dimensione), True
+    except FileExistsError:
+        segmento, creato = shared_memory.SharedMemory(nome), False
+    # Il segmento deve sopravvivere al processo che lo ha aperto: senza questo
+    # il resource tracker lo eliminerebbe all'uscita di quel processo
+    resource_tracker.unregister(segmento._name, 'shared_memory')
+    return segmento, creato
+
+
+def _elimina_segmento(nome):
+    try:
+        segmento = shared_memory.SharedMemory(nome)
+    except FileNotFoundError:
+        return False
+    segmento.close()
+    # unlink() toglie anche la registrazione fatta all'apertura dal resource tracker
+    segmento.unlink()
+    path = _path_lock(nome)
+    if os.path.exists(path):
+        os.remove(path)
+    return True
+
+
+def _path_lock(nome):
+    return os.path.join(tempfile.gettempdir(), f"{nome}.lock")
+
+
+def _decodifica_id(riga):
+    return bytes(riga).rstrip(b'\0').decode('ascii')
+
+
+def _array(valori):
+    risultato = array('d')
+    risultato.frombytes(np.ascontiguousarray(valori, dtype=np.float64).tobytes())
+    return risultato
+
+
+class _Descrittore:
+    """File di lock aperto da un solo thread; si chiude quando il thread termina."""
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def __del__(self):
+        os.close(self.fd)
+
+
+class LockFile:
+    """Lock tra thread e tra processi (flock su un file).
+
+    Usato con `with` è esclusivo e rientrante (chi scrive); condiviso() dà il
+    lock condiviso (chi legge). flock vale per file aperto, non per processo:
+    ogni thread apre il suo file per le letture e un processo figlio di un
+    fork riapre il file invece di condividere i lock del padre.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._azzera()
+        _lock_aperti.add(self)
+
+    def _azzera(self):
+        self._thread = threading.RLock()
+        self._profondita = 0
+        self._proprietario = None
+        self._locale = threading.local()
+
+    def _dopo_fork(self):
+        # Il file ereditato condivide i lock con il padre: chiuderlo qui non li
+        # rilascia. Anche l'RLock copiato risulterebbe preso dal thread del fork.
+        os.close(self._fd)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._azzera()
+
+    def __enter__(self):
+        self._thread.acquire()
+        if self._profondita == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            self._proprietario = threading.get_ident()
+        self._profondita += 1
+        return self
+
+    def __exit__(self, *_):
+        self._profondita -= 1
+        if self._profondita == 0:
+            self._proprietario = None
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread.release()
+
+    @contextmanager
+    def condiviso(self):
+        if self._proprietario == threading.get_ident():
+            # Lettura dentro una scrittura dello stesso thread
+            yield
+            return
+        locale = self._locale
+        if not hasattr(locale, 'descrittore'):
+            locale.descrittore = _Descrittore(self.path)
+            locale.profondita = 0
+        if locale.profondita == 0:
+            fcntl.flock(locale.descrittore.fd, fcntl.LOCK_SH)
+        locale.profondita += 1
+        try:
+            yield
+        finally:
+            locale.profondita -= 1
+            if locale.profondita == 0:
+                fcntl.flock(locale.descrittore.fd, fcntl.LOCK_UN)
+
+
+_lock_aperti = weakref.WeakSet()
+
+
+def _dopo_fork():
+    for lock in list(_lock_aperti):
+        lock._dopo_fork()
+
+
+os.register_at_fork(after_in_child=_dopo_fork)
+
+
+class _Segmento:
+    """Parte comune: scritture sotto il lock esclusivo, letture sotto quello condiviso."""
+
+    def _imposta_lock(self, nome):
+        self.lock_file = LockFile(_path_lock(nome))
+
+    def _scrittura(self):
+        return self.lock_file
+
+    def _leggi(self, funzione):
+        """Esegue `funzione` (che copia i dati) senza scritture in corso."""
+        with self.lock_file.condiviso():
+            return funzione()
+
+
+class RingBufferCondiviso(_Segmento):
+    """Stessa interfaccia di RingBuffer, con i dati in un segmento condiviso.
+
+    Il segmento ha una colonna per ognuno di `tutti_canali` (NaN finché il
+    canale non viene aggiunto), così aggiungere un canale non richiede di
+    riallocarlo; `canali` restituisce quelli attivi nell'ordine di aggiunta.
+    """
+
+    def __init__(self, nome, capacita, canali, tutti_canali, capacita_coda=65536):
+        if capacita <= 0 or capacita_coda <= 0:
+            raise ValueError("La capacità deve essere positiva")
+        self.nome = nome
+        self.tutti = tuple(tutti_canali)
+        self._indice = {canale: i for i, canale in enumerate(self.tutti)}
+        nc = len(self.tutti)
+        dimensione = 8 * (H_ORDINE + nc + capacita * (2 + nc) + capacita_coda * (1 + nc)) + capacita_coda
+        # Lock solo tra i thread di questo processo, per chi usa `with buffer.lock`
+        self.lock = threading.RLock()
+        self._imposta_lock(nome)
+        with self.lock_file:
+            self.segmento, creato = _apri_segmento(nome, dimensione)
+            self._h = np.ndarray(H_ORDINE + nc, dtype=np.uint64, buffer=self.segmento.buf)
+            if creato:
+                self._h[:] = 0
+                self._h[H_MAGIC] = MAGIC
+                self._h[H_CAPACITA] = capacita
+                self._h[H_COLONNE] = nc
+                self._h[H_CODA_CAPACITA] = capacita_coda
+            elif (self.segmento.size < dimensione or self._h[H_MAGIC] != MAGIC or self._h[H_CAPACITA] != capacita
+                    or self._h[H_COLONNE] != nc or self._h[H_CODA_CAPACITA] != capacita_coda):
+                self._h = None
+                self.segmento.close()
+                raise ValueError(f"Il segmento {nome} esiste con un formato diverso")
+            self._mappa(capacita, capacita_coda, nc)
+            if creato:
+                self._valori[:] = np.nan
+                self._coda_valori[:] = np.nan
+        self._canali = ()
+        for canale in canali:
+            self.aggiungi_canale(canale)
+
+    def _mappa(self, capacita, capacita_coda, nc):
+        buf = self.segmento.buf
+        offset = self._h.nbytes
+        self._ts = np.ndarray(capacita, dtype=np.float64, buffer=buf, offset=offset)
+        offset += self._ts.nbytes
+        self._seq = np.ndarray(capacita, dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._seq.nbytes
+        self._valori = np.ndarray((capacita, nc), dtype=np.float64, buffer=buf, offset=offset)
+        offset += self._valori.nbytes
+        self._coda_ts = np.ndarray(capacita_coda, dtype=np.float64, buffer=buf, offset=offset)
+        offset += self._coda_ts.nbytes
+        self._coda_valori = np.ndarray((capacita_coda, nc), dtype=np.float64, buffer=buf, offset=offset)
+        offset += self._coda_valori.nbytes
+        self._coda_tipi = np.ndarray(capacita_coda, dtype=np.uint8, buffer=buf, offset=offset)
+        self.capacita = capacita
+
+    @property
+    def canali(self):
+        if int(self._h[H_PRESENTI]) != len(self._canali):
+            def leggi():
+                presenti = int(self._h[H_PRESENTI])
+                return tuple(self.tutti[int(i)] for i in self._h[H_ORDINE:H_ORDINE + presenti])
+            self._canali = self._leggi(leggi)
+        return self._canali
+
+    @property
+    def totale(self):
+        return int(self._h[H_TOTALE])
+
+    @totale.setter
+    def totale(self, valore):
+        with self._scrittura():
+            self._h[H_TOTALE] = valore
+
+    @property
+    def totale_coda(self):
+        return int(self._h[H_CODA_TOTALE])
+
+    @property
+    def persistite(self):
+        """Posizione della coda fino a cui le letture sono state passate all'archivio."""
+        return int(self._h[H_PERSISTITE])
+
+    @persistite.setter
+    def persistite(self, valore):
+        # Scritto solo dal processo che possiede l'archivio
+        self._h[H_PERSISTITE] = valore
+
+    def __len__(self):
+        return int(self._h[H_COUNT])
+
+    def _stato(self):
+        return int(self._h[H_COUNT]), int(self._h[H_INIZIO])
+
+    def _colonne_attive(self):
+        return [self._indice[canale] for canale in self.canali]
+
+    def aggiungi_canale(self, nome):
+        if nome not in self._indice:
+            raise ValueError(f"Canale sconosciuto: {nome}")
+        if nome in self.canali:
+            return
+        with self._scrittura():
+            presenti = int(self._h[H_PRESENTI])
+            if self._indice[nome] not in self._h[H_ORDINE:H_ORDINE + presenti]:
+                self._h[H_ORDINE + presenti] = self._indice[nome]
+                self._h[H_PRESENTI] = presenti + 1
+
+    def _matrice(self, n, colonne):
+        matrice = np.full((n, len(self.tutti)), np.nan)
+        for nome, valori in colonne.items():
+            matrice[:, self._indice[nome]] = valori
+        return matrice
+
+    def _scrivi_anello(self, ts, sequenze, valori, pos):
+        """Scrive le righe a partire dalla posizione fisica `pos`, girando in testa."""
+        n = len(ts)
+        k = min(n, self.capacita - pos)
+        for destinazione, sorgente in ((self._ts, ts), (self._seq, sequenze), (self._valori, valori)):
+            destinazione[pos:pos + k] = sorgente[:k]
+            destinazione[:n - k] = sorgente[k:]
+
+    def _nuove_sequenze(self, n):
+        """Numeri di sequenza per `n` letture appena arrivate."""
+        totale = int(self._h[H_TOTALE])
+        self._h[H_TOTALE] = totale + n
+        return np.arange(totale + 1, totale + n + 1, dtype=np.int64)
+
+    def _estendi(self, ts, sequenze, valori):
+        n = len(ts)
+        if n > self.capacita:
+            ts, sequenze, valori = ts[n - self.capacita:], sequenze[n - self.capacita:], valori[n - self.capacita:]
+            n = self.capacita
+        if n == 0:
+            return
+        count, inizio = self._stato()
+        pos = (inizio + count) % self.capacita
+        self._scrivi_anello(ts, sequenze, valori, pos)
+        if count + n > self.capacita:
+            self._h[H_INIZIO] = (pos + n) % self.capacita
+            self._h[H_COUNT] = self.capacita
+        else:
+            self._h[H_COUNT] = count + n
+
+    def _accoda(self, ts, valori, tipi):
+        """Aggiunge le letture alla coda degli arrivi, ognuna con il suo tipo (NEL_BUFFER, ...)."""
+        capacita = len(self._coda_ts)
+        totale = int(self._h[H_CODA_TOTALE])
+        n = len(ts)
+        tipi = np.broadcast_to(np.asarray(tipi, dtype=np.uint8), (n,))
+        if n > capacita:
+            ts, valori, tipi = ts[n - capacita:], valori[n - capacita:], tipi[n - capacita:]
+        pos = (totale + n - len(ts)) % capacita
+        k = min(len(ts), capacita - pos)
+        for destinazione, sorgente in ((self._coda_ts, ts), (self._coda_valori, valori), (self._coda_tipi, tipi)):
+            destinazione[pos:pos + k] = sorgente[:k]
+            destinazione[:len(ts) - k] = sorgente[k:]
+        self._h[H_CODA_TOTALE] = totale + n
+
+    def _unisci(self, ts, valori):
+        """Come RingBuffer.unisci: restituisce quante letture (le prime) sono rimaste fuori."""
+        count, _ = self._stato()
+        scartate = 0
+        if count > RIORDINO_MASSIMO:
+            limite = self._ts[self._fisico(count - RIORDINO_MASSIMO - 1)]
+            scartate = int(np.searchsorted(ts, limite))
+            self._nuove_sequenze(scartate)
+            ts, valori = ts[scartate:], valori[scartate:]
+            if len(ts) == 0:
+                return scartate
+        sequenze = self._nuove_sequenze(len(ts))
+        if count and ts[0] < self._ts[self._fisico(count - 1)]:
+            # Letture più vecchie dell'ultima: si riscrive la coda della finestra in ordine,
+            # ognuna con il suo numero di sequenza
+            start = self._bisect(ts[0], destra=True)
+            coda_ts, coda_sequenze, coda_valori = self._copia_righe(start, count, sequenze=True)
+            ts = np.concatenate((coda_ts, ts))
+            sequenze = np.concatenate((coda_sequenze, sequenze))
+            valori = np.concatenate((coda_valori, valori))
+            ordine = np.argsort(ts, kind='stable')
+            self._h[H_COUNT] = start
+            self._estendi(ts[ordine], sequenze[ordine], valori[ordine])
+        else:
+            self._estendi(ts, sequenze, valori)
+        return scartate
+
+    def append(self, ts, *valori):
+        if len(valori) != len(self.canali):
+            raise ValueError("Numero di valori diverso dal numero di canali")
+        riga = self._matrice(1, dict(zip(self.canali, valori)))
+        ts = np.array([ts], dtype=np.float64)
+        with self._scrittura():
+            # Più processi possono prendere il timestamp in un ordine e il lock in un altro
+            fuori = self._unisci(ts, riga)
+            self._accoda(ts, riga, FUORI_FINESTRA if fuori else NEL_BUFFER)
+
+    def estendi(self, ts, colonne, sequenze=None):
+        """Aggiunge letture ordinate senza passare dalla coda degli arrivi (es. al ripristino dal log)."""
+        ts = np.asarray(ts, dtype=np.float64)
+        with self._scrittura():
+            if sequenze is None:
+                sequenze = self._nuove_sequenze(len(ts))
+            self._estendi(ts, np.asarray(sequenze, dtype=np.int64), self._matrice(len(ts), colonne))
+
+    def unisci(self, ts, colonne):
+        ts = np.asarray(ts, dtype=np.float64)
+        if len(ts) == 0:
+            return 0
+        valori = self._matrice(len(ts), colonne)
+        with self._scrittura():
+            scartate = self._unisci(ts, valori)
+            tipi = np.full(len(ts), NEL_BUFFER, dtype=np.uint8)
+            tipi[:scartate] = FUORI_FINESTRA
+            self._accoda(ts, valori, tipi)
+        return scartate
+
+    def accoda_correzioni(self, ts, colonne):
+        """Passa all'archivio letture che correggono valori già nel buffer, senza toccarlo."""
+        ts = np.asarray(ts, dtype=np.float64)
+        if len(ts) == 0:
+            return
+        with self._scrittura():
+            self._accoda(ts, self._matrice(len(ts), colonne), CORREZIONE)
+
+    def clear(self):
+        with self._scrittura():
+            self._h[H_COUNT] = 0
+            self._h[H_INIZIO] = 0
+
+    def _fisico(self, i):
+        return (int(self._h[H_INIZIO]) + i) % self.capacita
+
+    def _segmenti(self, start, stop):
+        if start >= stop:
+            return []
+        lo = self._fisico(start)
+        n = stop - start
+        if lo + n <= self.capacita:
+            return [(lo, lo + n)]
+        return [(lo, self.capacita), (0, lo + n - self.capacita)]
+
+    def _copia_righe(self, start, stop, sequenze=False):
+        segmenti = self._segmenti(start, stop) or [(0, 0)]
+        ts = np.concatenate([self._ts[lo:hi] for lo, hi in segmenti])
+        valori = np.concatenate([self._valori[lo:hi] for lo, hi in segmenti])
+        if sequenze:
+            return ts, np.concatenate([self._seq[lo:hi] for lo, hi in segmenti]), valori
+        return ts, valori
+
+    def _bisect(self, ts, destra=False):
+        count, inizio = self._stato()
+        lato = 'right' if destra else 'left'
+        fine = min(self.capacita, inizio + count)
+        i = int(np.searchsorted(self._ts[inizio:fine], ts, lato))
+        if i < fine - inizio:
+            return i
+        return i + int(np.searchsorted(self._ts[:inizio + count - fine], ts, lato))
+
+    def _intervallo(self, da, a):
+        count, _ = self._stato()
+        start = 0 if da is None else self._bisect(da)
+        stop = count if a is None else self._bisect(a, destra=True)
+        return start, max(start, stop)
+
+    def _finestra(self, start, stop):
+        count, _ = self._stato()
+        stop = count if stop is None else min(stop, count)
+        ts, valori = self._copia_righe(max(0, start), stop)
+        return _array(ts), {nome: _array(valori[:, i]) for nome, i in zip(self.canali, self._colonne_attive())}
+
+    def ultimo(self):
+        def leggi():
+            count, _ = self._stato()
+            if count == 0:
+                return None
+            pos = self._fisico(count - 1)
+            riga = self._valori[pos]
+            return float(self._ts[pos]), tuple(float(riga[i]) for i in self._colonne_attive())
+        return self._leggi(leggi)
+
+    def primo(self):
+        return self._leggi(lambda: float(self._ts[self._fisico(0)]) if len(self) else None)
+
+    def bisect(self, ts, destra=False):
+        return self._leggi(lambda: self._bisect(ts, destra))
+
+    def intervallo(self, da=None, a=None):
+        return self._leggi(lambda: self._intervallo(da, a))
+
+    def finestra(self, start=0, stop=None):
+        return self._leggi(lambda: self._finestra(start, stop))
+
+    def finestra_tra(self, da=None, a=None):
+        """(primo timestamp, ts, colonne) delle letture con da <= ts <= a, in una sola lettura coerente."""
+        def leggi():
+            primo = float(self._ts[self._fisico(0)]) if len(self) else None
+            return (primo, *self._finestra(*self._intervallo(da, a)))
+        return self._leggi(leggi)
+
+    def dopo(self, seq, massimo=None, fino=None):
+        def leggi():
+            count, _ = self._stato()
+            start = max(0, count - RIORDINO_MASSIMO - max(0, int(self._h[H_TOTALE]) - seq) - 1)
+            ts, sequenze, valori = self._copia_righe(start, count, sequenze=True)
+            return ts, sequenze, [valori[:, i] for i in self._colonne_attive()]
+        ts, sequenze, colonne = self._leggi(leggi)
+        return selezione_dopo(sequenze, ts, colonne, seq, massimo, fino)
+
+    def righe(self, start=0, stop=None):
+        ts, colonne = self.finestra(start, stop)
+        return zip(ts, *colonne.values())
+
+    def blocchi(self, da=None, a=None, dimensione=5000):
+        ultimo = None
+        ripetuti = 0
+        while True:
+            def leggi():
+                if ultimo is not None:
+                    start = self._bisect(ultimo) + ripetuti
+                else:
+                    start = 0 if da is None else self._bisect(da)
+                stop = len(self) if a is None else self._bisect(a, destra=True)
+                return self._finestra(start, min(stop, start + dimensione))
+            ts, colonne = self._leggi(leggi)
+            if not ts:
+                return
+            yield ts, colonne
+            coda = 0
+            while coda < len(ts) and ts[-1 - coda] == ts[-1]:
+                coda += 1
+            ripetuti = ripetuti + coda if ts[-1] == ultimo else coda
+            ultimo = ts[-1]
+
+    def istantanea(self):
+        """(ts, {canale: valori}, totale della coda) della finestra intera, in una lettura coerente."""
+        def leggi():
+            ts, valori = self._copia_righe(0, len(self))
+            colonne = {nome: valori[:, i] for nome, i in zip(self.canali, self._colonne_attive())}
+            return ts, colonne, int(self._h[H_CODA_TOTALE])
+        return self._leggi(leggi)
+
+    def arrivi_dopo(self, seq):
+        """Letture arrivate (da qualsiasi processo) dopo la posizione `seq` della coda.
+
+        Restituisce (nuova posizione, ts, {canale: valori}, tipi, perse): `tipi`
+        dice per ogni lettura se è NEL_BUFFER, FUORI_FINESTRA o una CORREZIONE;
+        `perse` conta le letture già uscite dalla coda perché chi legge è
+        rimasto troppo indietro.
+        """
+        def leggi():
+            totale = int(self._h[H_CODA_TOTALE])
+            capacita = len(self._coda_ts)
+            perse = max(0, totale - capacita - seq)
+            da = seq + perse
+            n = totale - da
+            pos = da % capacita
+            k = min(n, capacita - pos)
+            ts = np.concatenate((self._coda_ts[pos:pos + k], self._coda_ts[:n - k]))
+            valori = np.concatenate((self._coda_valori[pos:pos + k], self._coda_valori[:n - k]))
+            tipi = np.concatenate((self._coda_tipi[pos:pos + k], self._coda_tipi[:n - k]))
+            colonne = {nome: valori[:, i] for nome, i in zip(self.canali, self._colonne_attive())}
+            return totale, ts, colonne, tipi, perse
+        if seq >= self.totale_coda:
+            return seq, np.empty(0), {}, np.empty(0, dtype=np.uint8), 0
+        return self._leggi(leggi)
+
+    def chiudi(self):
+        self._h = self._ts = self._seq = self._valori = self._coda_ts = self._coda_valori = self._coda_tipi = None
+        self.segmento.close()
+
+
+class IndiceStazioni(_Segmento):
+    """Elenco condiviso degli id delle stazioni, perché ogni processo ritrovi quelle create dagli altri."""
+
+    def __init__(self, prefisso, massimo):
+        nome = f"{prefisso}_stazioni"
+        self.massimo = massimo
+        self._imposta_lock(nome)
+        with self.lock_file:
+            self.segmento, creato = _apri_segmento(nome, 8 * 2 + massimo * LUNGHEZZA_ID)
+            self._h = np.ndarray(2, dtype=np.uint64, buffer=self.segmento.buf)
+            self._id = np.ndarray((massimo, LUNGHEZZA_ID), dtype=np.uint8, buffer=self.segmento.buf, offset=16)
+            if creato:
+                self._h[:] = 0
+
+    def __len__(self):
+        return int(self._h[I_PRESENTI])
+
+    def _elenco(self):
+        return [_decodifica_id(self._id[i]) for i in range(int(self._h[I_PRESENTI]))]
+
+    def elenco(self):
+        return self._leggi(self._elenco)
+
+    def aggiungi(self, id):
+        """Registra l'id; solleva ValueError se l'elenco è pieno."""
+        with self._scrittura():
+            presenti = self._elenco()
+            if id in presenti:
+                return
+            if len(presenti) >= self.massimo:
+                raise ValueError("Numero massimo di stazioni raggiunto")
+            codificato = id.encode('ascii')[:LUNGHEZZA_ID]
+            self._id[len(presenti)] = 0
+            self._id[len(presenti), :len(codificato)] = np.frombuffer(codificato, dtype=np.uint8)
+            self._h[I_PRESENTI] = len(presenti) + 1
+
+
+def elimina(prefisso):
+    """Elimina i segmenti delle stazioni con questo prefisso e l'indice. Restituisce quanti."""
+    nome = f"{prefisso}_stazioni"
+    try:
+        segmento = shared_memory.SharedMemory(nome)
+    except FileNotFoundError:
+        return 0
+    presenti = int(np.ndarray(2, dtype=np.uint64, buffer=segmento.buf)[I_PRESENTI])
+    righe = np.ndarray((presenti, LUNGHEZZA_ID), dtype=np.uint8, buffer=segmento.buf, offset=16)
+    ids = [_decodifica_id(riga) for riga in righe]
+    # Le viste NumPy vanno rilasciate prima di chiudere il segmento
+    del righe
+    segmento.close()
+    eliminati = sum(_elimina_segmento(f"{prefisso}_{id}") for id in ids)
+    return eliminati + _elimina_segmento(nome)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gestione dei segmenti condivisi di centrale")
+    parser.add_argument('--remove', metavar='PREFISSO', required=True)
+    args = parser.parse_args()
+    print(f"Eliminati {elimina(args.remove)} segmenti")
@@ -0,0 +1,87 @@
+"""Canali derivati: grandezze calcolate dai canali misurati (punto di rugiada, ...).
+
+Ogni canale derivato è una funzione NumPy di colonne intere, quindi un
+intervallo di /history o un gruppo di eventi di /stream viene calcolato con
+poche operazioni vettoriali qualunque sia il numero di letture. Per
+aggiungerne uno basta registrarlo:
+
+    registra_derivato('vapor_pressure', ('temperature', 'humidity'), 'hPa',
+                      lambda t, rh: 6.112 * np.exp(17.62 * t / (243.12 + t)) * rh / 100)
+
+Dove manca un canale da cui dipende il valore è NaN.
+"""
+import numpy as np
+
+
+class Derivato:
+    __slots__ = ('nome', 'dipendenze', 'unita', 'funzione')
+
+    def __init__(self, nome, dipendenze, unita, funzione):
+        self.nome = nome
+        self.dipendenze = tuple(dipendenze)
+        self.unita = unita
+        self.funzione = funzione
+
+
+DERIVATI = {}
+
+
+def registra_derivato(nome, dipendenze, unita, funzione):
+    """Aggiunge un canale derivato: `funzione` riceve gli array delle `dipendenze`, nell'ordine."""
+    DERIVATI[nome] = Derivato(nome, dipendenze, unita, funzione)
+
+
+def dipendenze(nomi):
+    """Canali misurati da leggere per calcolare i derivati in `nomi` (gli altri nomi sono ignorati)."""
+    return list(dict.fromkeys(d for nome in nomi if nome in DERIVATI for d in DERIVATI[nome].dipendenze))
+
+
+def calcola(nomi, colonne, n):
+    """{nome: valori} dei derivati in `nomi` a partire dalle `colonne` misurate, lunghe `n`."""
+    risultato = {}
+    for nome in nomi:
+        derivato = DERIVATI.get(nome)
+        if derivato is None:
+            continue
+        if all(d in colonne for d in derivato.dipendenze):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                valori = derivato.funzione(*(np.asarray(colonne[d], dtype=np.float64) for d in derivato.dipendenze))
+            risultato[nome] = np.asarray(valori, dtype=np.float64)
+        else:
+            risultato[nome] = np.full(n, np.nan)
+    return risultato
+
+
+def punto_rugiada(t, rh):
+    """Formula di Magnus (coefficienti di Alduchov ed Eskridge), °C."""
+    gamma = np.log(np.where(rh > 0, rh, np.nan) / 100) + 17.625 * t / (243.04 + t)
+    return 243.04 * gamma / (17.625 - gamma)
+
+
+def indice_calore(t, rh):
+    """Heat index del National Weather Service (regressione di Rothfusz con le correzioni), °C.
+
+    Sotto i 26,7 °C (80 °F) circa vale la formula semplice di Steadman, che
+    resta vicina alla temperatura dell'aria.
+    """
+    f = t * 9 / 5 + 32
+    semplice = 0.5 * (f + 61 + (f - 68) * 1.2 + rh * 0.094)
+    completo = (-42.379 + 2.04901523 * f + 10.14333127 * rh - 0.22475541 * f * rh
+                - 6.83783e-3 * f * f - 5.481717e-2 * rh * rh + 1.22874e-3 * f * f * rh
+                + 8.5282e-4 * f * rh * rh - 1.99e-6 * f * f * rh * rh)
+    secco = (rh < 13) & (f >= 80) & (f <= 112)
+    completo = completo - np.where(secco, (13 - rh) / 4 * np.sqrt(np.clip(17 - np.abs(f - 95), 0, None) / 17), 0)
+    umido = (rh > 85) & (f >= 80) & (f <= 87)
+    completo = completo + np.where(umido, (rh - 85) / 10 * (87 - f) / 5, 0)
+    indice = np.where((semplice + f) / 2 >= 80, completo, semplice)
+    return (indice - 32) * 5 / 9
+
+
+def umidita_assoluta(t, rh):
+    """Grammi di vapore per metro cubo d'aria."""
+    return 6.112 * np.exp(17.67 * t / (t + 243.5)) * rh * 2.1674 / (273.15 + t)
+
+
+registra_derivato('dew_point', ('temperature', 'humidity'), '°C', punto_rugiada)
+registra_derivato('heat_index', ('temperature', 'humidity'), '°C', indice_calore)
+registra_derivato('absolute_humidity', ('temperature', 'humidity'), 'g/m³', umidita_assoluta)
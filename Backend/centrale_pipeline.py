@@ -0,0 +1,274 @@
+"""Pipeline di ingest della centrale: coda limitata e un thread che applica le fasi in ordine.
+
+Chi riceve le letture (/update, /update/batch, seriale, protocollo a righe)
+le valida e le accoda soltanto; il thread della pipeline le raccoglie a
+gruppi, le riunisce per stazione in blocchi ordinati per tempo e le passa
+alle fasi nell'ordine dato (buffer, rollup, persistenza, broadcast). Ogni
+fase riceve un lotto alla volta e restituisce se passarlo alla successiva;
+un'eccezione in una fase scarta solo quel lotto, non il resto del gruppo.
+Dopo ogni gruppo viene chiamata `dopo` (es. per svegliare gli stream).
+
+Quando la coda è piena decide la politica di sovraccarico:
+
+- 'block': chi accoda aspetta che si liberi spazio, al massimo `attesa`
+  secondi (None: senza limite), poi la lettura viene rifiutata;
+- 'drop-oldest': si scartano le letture più vecchie ancora in coda;
+- 'reject': la lettura viene rifiutata subito.
+
+Le letture rifiutate sollevano Sovraccarico (per HTTP diventa un 503).
+
+Finché il thread non è avviato (script, test, processi figli di un fork)
+accoda() applica le fasi subito, nel thread del chiamante.
+"""
+from collections import deque
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class Sovraccarico(ValueError):
+    """Coda di ingest piena: la lettura non è stata accettata."""
+
+
+class Lotto:
+    """Letture di una stazione ordinate per tempo, come passano da una fase all'altra.
+
+    `colonne` sono i canali ricevuti; la fase del buffer imposta `stazione`,
+    `tutte`, le colonne di tutti i canali della stazione (NaN dove mancano),
+    `fuori`, quante letture (le prime) non sono entrate nel buffer perché
+    troppo vecchie, e `correzioni`, le letture da passare solo allo storico.
+    """
+
+    __slots__ = ('id_stazione', 'ts', 'colonne', 'stazione', 'tutte', 'fuori', 'correzioni')
+
+    def __init__(self, id_stazione, ts, colonne):
+        self.id_stazione = id_stazione
+        self.ts = ts
+        self.colonne = colonne
+        self.stazione = None
+        self.tutte = None
+        self.fuori = 0
+        self.correzioni = None
+
+    @classmethod
+    def da_letture(cls, id_stazione, letture):
+        """Lotto da una lista di (ts, {canale: valore}) in qualsiasi ordine."""
+        canali = list(dict.fromkeys(nome for _, valori in letture for nome in valori))
+        ts = np.array([t for t, _ in letture], dtype=np.float64)
+        ordine = np.argsort(ts, kind='stable')
+        colonne = {
+            nome: np.array([valori.get(nome, np.nan) for _, valori in letture], dtype=np.float64)[ordine]
+            for nome in canali
+        }
+        return cls(id_stazione, ts[ordine], colonne)
+
+
+class _Fase:
+    __slots__ = ('nome', 'funzione', 'chiamate', 'letture', 'tempo', 'massimo')
+
+    def __init__(self, nome, funzione):
+        self.nome = nome
+        self.funzione = funzione
+        self.chiamate = 0
+        self.letture = 0
+        self.tempo = 0.0
+        self.massimo = 0.0
+
+
+class PipelineIngest:
+    """Coda limitata (in letture) tra la ricezione e le fasi di ingest.
+
+    `fasi` è una lista di (nome, funzione(lotto) -> bool); `capacita` il
+    numero massimo di letture in coda. Una richiesta più grande della capacità passa comunque
+    quando la coda è vuota.
+    """
+
+    POLITICHE = ('block', 'drop-oldest', 'reject')
+
+    def __init__(self, fasi, capacita=10000, politica='block', attesa=1.0, massimo_gruppo=10000, dopo=None):
+        if politica not in self.POLITICHE:
+            raise ValueError(f"Politica di sovraccarico non valida: {politica}")
+        if capacita <= 0:
+            raise ValueError("La capacità deve essere positiva")
+        self.fasi = [_Fase(nome, funzione) for nome, funzione in fasi]
+        self.capacita = capacita
+        self.politica = politica
+        self.attesa = attesa
+        self.massimo_gruppo = massimo_gruppo
+        self.dopo = dopo
+        self.coda = deque()
+        self.condizione = threading.Condition()
+        # Letture in coda e letture prese dal thread ma non ancora applicate
+        self.in_coda = 0
+        self.in_corso = 0
+        self.massimo_in_coda = 0
+        self.accettate = 0
+        self.applicate = 0
+        # Letture di lotti interrotti da un errore in una fase
+        self.fallite = 0
+        self.scartate = 0
+        self.rifiutate = 0
+        self.bloccate = 0
+        self._thread = None
+        self._pid = None
+        self._fermo = False
+        self._lock_fasi = threading.Lock()
+
+    @property
+    def attiva(self):
+        # I thread non sopravvivono al fork: in un processo figlio si torna sincroni
+        return self._thread is not None and self._pid == os.getpid()
+
+    def avvia(self):
+        self._fermo = False
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._ciclo, name='ingest-centrale', daemon=True)
+        self._thread.start()
+
+    def ferma(self):
+        """Applica tutto ciò che è in coda e termina il thread."""
+        if not self.attiva:
+            return
+        with self.condizione:
+            self._fermo = True
+            self.condizione.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def attendi(self, timeout=None):
+        """Blocca finché tutte le letture accodate sono passate per le fasi."""
+        if not self.attiva:
+            return True
+        with self.condizione:
+            return self.condizione.wait_for(lambda: not self.in_coda and not self.in_corso, timeout)
+
+    def accoda(self, id_stazione, letture):
+        """Accoda una lista di (ts, {canale: valore}) di una stazione.
+
+        Solleva Sovraccarico se la politica rifiuta le letture.
+        """
+        n = len(letture)
+        if not n:
+            return
+        if not self.attiva:
+            with self.condizione:
+                self.accettate += n
+            self._applica([(id_stazione, letture)])
+            return
+        with self.condizione:
+            if self.in_coda and self.in_coda + n > self.capacita:
+                self._fai_spazio(n)
+            self.coda.append((id_stazione, letture))
+            self.in_coda += n
+            self.accettate += n
+            self.massimo_in_coda = max(self.massimo_in_coda, self.in_coda)
+            self.condizione.notify_all()
+
+    def _fai_spazio(self, n):
+        # Chiamata con la condizione acquisita
+        if self.politica == 'reject':
+            self.rifiutate += n
+            raise Sovraccarico("Coda di ingest piena")
+        if self.politica == 'drop-oldest':
+            while self.coda and self.in_coda + n > self.capacita:
+                _, vecchie = self.coda.popleft()
+                self.in_coda -= len(vecchie)
+                self.scartate += len(vecchie)
+            return
+        self.bloccate += 1
+        if not self.condizione.wait_for(lambda: not self.in_coda or self.in_coda + n <= self.capacita, self.attesa):
+            self.rifiutate += n
+            raise Sovraccarico(f"Coda di ingest piena da {self.attesa:g} s")
+
+    def _ciclo(self):
+        while True:
+            with self.condizione:
+                self.condizione.wait_for(lambda: self.coda or self._fermo)
+                if not self.coda:
+                    return
+                gruppo = []
+                while self.coda and self.in_corso < self.massimo_gruppo:
+                    elemento = self.coda.popleft()
+                    gruppo.append(elemento)
+                    self.in_corso += len(elemento[1])
+                self.in_coda -= self.in_corso
+                # C'è di nuovo spazio: si svegliano i produttori in attesa
+                self.condizione.notify_all()
+            try:
+                self._applica(gruppo)
+            finally:
+                # Anche dopo un errore: chi aspetta spazio o attendi() non resta bloccato
+                with self.condizione:
+                    self.in_corso = 0
+                    self.condizione.notify_all()
+
+    def _applica(self, gruppo):
+        """Riunisce il gruppo in un lotto per stazione e passa ogni lotto per le fasi."""
+        n = sum(len(letture) for _, letture in gruppo)
+        try:
+            per_stazione = {}
+            for id_stazione, letture in gruppo:
+                per_stazione.setdefault(id_stazione, []).extend(letture)
+            # Con il thread le fasi girano solo lì; da sincroni i chiamanti si mettono in fila
+            with self._lock_fasi:
+                for id_stazione, letture in per_stazione.items():
+                    self._applica_lotto(id_stazione, letture)
+                if self.dopo is not None:
+                    self.dopo()
+        except Exception:
+            logging.exception("Errore nella pipeline di ingest")
+        finally:
+            with self.condizione:
+                self.applicate += n
+
+    def _applica_lotto(self, id_stazione, letture):
+        try:
+            lotto = Lotto.da_letture(id_stazione, letture)
+        except Exception:
+            logging.exception("Letture della stazione %s non valide", id_stazione)
+            self.fallite += len(letture)
+            return
+        for fase in self.fasi:
+            inizio = time.perf_counter()
+            try:
+                continua = fase.funzione(lotto)
+            except Exception:
+                logging.exception("Errore nella fase %s dell'ingest (stazione %s)", fase.nome, id_stazione)
+                self.fallite += len(letture)
+                continua = False
+            durata = time.perf_counter() - inizio
+            fase.chiamate += 1
+            fase.letture += len(lotto.ts)
+            fase.tempo += durata
+            fase.massimo = max(fase.massimo, durata)
+            if not continua:
+                return
+
+    def statistiche(self):
+        return {
+            "policy": self.politica,
+            "capacity": self.capacita,
+            "threaded": self.attiva,
+            "queued": self.in_coda,
+            "max_queued": self.massimo_in_coda,
+            "accepted": self.accettate,
+            "applied": self.applicate,
+            "failed": self.fallite,
+            "dropped": self.scartate,
+            "rejected": self.rifiutate,
+            "blocked": self.bloccate,
+            "stages": [
+                {
+                    "name": fase.nome,
+                    "calls": fase.chiamate,
+                    "readings": fase.letture,
+                    "total_ms": round(fase.tempo * 1000, 3),
+                    "mean_ms": round(fase.tempo * 1000 / fase.chiamate, 3) if fase.chiamate else None,
+                    "max_ms": round(fase.massimo * 1000, 3),
+                }
+                for fase in self.fasi
+            ],
+        }
@@ -0,0 +1,140 @@
+import logging
+import math
+import socket
+import socketserver
+import threading
+import time
+
+from centrale_stazioni import ALIAS_CANALI, valida_lettura
+
+MAX_RIGA_TCP = 65536
+
+
+def parse_righe(testo, canali_posizionali=('temperature', 'humidity'), adesso=None):
+    """Interpreta un blocco di righe del protocollo compatto `station ts v1 v2 ...`.
+
+    I valori dopo il timestamp sono assegnati nell'ordine a `canali_posizionali`;
+    in alternativa si possono indicare come canale=valore. Un timestamp '-' o 0
+    vale `adesso` (l'istante di ricezione), un valore '-' o 'nan' indica un
+    canale non misurato. Le righe che non passano valida_lettura sono
+    scartate. Restituisce ({stazione: [(ts, {canale: valore})]}, scartate).
+    """
+    if adesso is None:
+        adesso = time.time()
+    letture = {}
+    scartate = 0
+    for riga in testo.splitlines():
+        campi = riga.split()
+        if not campi or campi[0].startswith('#'):
+            continue
+        try:
+            if len(campi) < 3:
+                raise ValueError("riga incompleta")
+            stazione, ts = campi[0], campi[1]
+            ts = adesso if ts in ('-', '0') else float(ts)
+            valori = {}
+            for i, campo in enumerate(campi[2:]):
+                if '=' in campo:
+                    nome, campo = campo.split('=', 1)
+                    nome = ALIAS_CANALI[nome]
+                elif i < len(canali_posizionali):
+                    nome = canali_posizionali[i]
+                else:
+                    raise ValueError("troppi valori")
+                if campo == '-':
+                    continue
+                valore = float(campo)
+                if not math.isnan(valore):
+                    valori[nome] = valore
+            if not valori:
+                raise ValueError("nessun valore")
+            valida_lettura(ts, valori, adesso)
+        except (ValueError, KeyError):
+            scartate += 1
+            continue
+        letture.setdefault(stazione, []).append((ts, valori))
+    return letture, scartate
+
+
+class ServerTCP(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class RicevitoreLinee:
+    """Ascolta il protocollo a righe su UDP e/o TCP e registra le letture a blocchi.
+
+    Ogni datagramma UDP, o ogni porzione ricevuta su una connessione TCP, può
+    contenere molte righe: vengono interpretate insieme e passate a
+    `registra_blocco(stazione, letture)` una volta per stazione, così il costo
+    per lettura è una frazione di quello di una richiesta HTTP.
+    """
+
+    def __init__(self, registra_blocco, host='0.0.0.0', porta_udp=0, porta_tcp=0,
+                 canali_posizionali=('temperature', 'humidity')):
+        self.registra_blocco = registra_blocco
+        self.host = host
+        self.porta_udp = porta_udp
+        self.porta_tcp = porta_tcp
+        self.canali_posizionali = canali_posizionali
+        self.letture = 0
+        self.scartate = 0
+        self.lock = threading.Lock()
+        self._server = []
+
+    def avvia(self):
+        ricevitore = self
+
+        class GestoreUDP(socketserver.BaseRequestHandler):
+            def handle(self):
+                ricevitore._elabora(self.request[0])
+
+        class GestoreTCP(socketserver.BaseRequestHandler):
+            def handle(self):
+                resto = b''
+                while True:
+                    dati = self.request.recv(65536)
+                    if not dati:
+                        break
+                    dati = resto + dati
+                    fine = dati.rfind(b'\n') + 1
+                    resto = dati[fine:]
+                    if len(resto) > MAX_RIGA_TCP:
+                        logging.warning("Riga troppo lunga da %s, connessione chiusa", self.client_address)
+                        return
+                    if fine:
+                        ricevitore._elabora(dati[:fine])
+                if resto:
+                    ricevitore._elabora(resto)
+
+        if self.porta_udp:
+            server = socketserver.UDPServer((self.host, self.porta_udp), GestoreUDP)
+            # Coda di ricezione ampia per assorbire raffiche di datagrammi
+            server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+            self.porta_udp = server.server_address[1]
+            self._server.append(server)
+        if self.porta_tcp:
+            server = ServerTCP((self.host, self.porta_tcp), GestoreTCP)
+            self.porta_tcp = server.server_address[1]
+            self._server.append(server)
+        for server in self._server:
+            threading.Thread(target=server.serve_forever, name='righe-centrale', daemon=True).start()
+
+    def ferma(self):
+        for server in self._server:
+            server.shutdown()
+            server.server_close()
+
+    def _elabora(self, dati):
+        letture, scartate = parse_righe(dati.decode('ascii', errors='replace'), self.canali_posizionali)
+        accettate = 0
+        for stazione, righe in letture.items():
+            try:
+                self.registra_blocco(stazione, righe)
+                accettate += len(righe)
+            except ValueError as e:
+                scartate += len(righe)
+                logging.warning("Letture di %s rifiutate: %s", stazione, e)
+        with self.lock:
+            self.letture += accettate
+            self.scartate += scartate
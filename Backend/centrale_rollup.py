@@ -0,0 +1,114 @@
+import math
+
+import numpy as np
+
+# Livelli della piramide in secondi: 1 minuto, 15 minuti, 1 ora, 1 giorno
+LIVELLI = (60, 900, 3600, 86400)
+
+
+def livello_per_risoluzione(risoluzione):
+    """Il livello più grossolano che non supera `risoluzione`, oppure None."""
+    adatti = [livello for livello in LIVELLI if livello <= risoluzione]
+    return max(adatti) if adatti else None
+
+
+class Rollup:
+    """Aggregati per bucket (conteggio e, per canale, n/somma/min/max) di tutti i livelli.
+
+    In memoria restano solo i contributi non ancora scritti: svuota() li
+    restituisce e riparte da zero, e lo storico li somma a quelli già salvati.
+    Così un bucket può essere scritto in più volte (aggiornamento a ogni
+    minuto, letture arrivate in ritardo) senza doverlo rileggere.
+    """
+
+    def __init__(self, canali):
+        self.canali = list(canali)
+        self.pendenti = {livello: {} for livello in LIVELLI}
+        self._minuto = None
+
+    def aggiungi_canale(self, nome):
+        if nome not in self.canali:
+            self.canali.append(nome)
+
+    def _accumulatore(self, livello, inizio):
+        bucket = self.pendenti[livello].get(inizio)
+        if bucket is None:
+            bucket = self.pendenti[livello][inizio] = [0, {}]
+        return bucket
+
+    def aggiungi(self, ts, valori):
+        """Aggiunge una lettura; a ogni cambio di minuto restituisce i contributi
+        da scrivere (altrimenti una lista vuota)."""
+        minuto = ts // 60
+        da_scrivere = []
+        if self._minuto is not None and minuto != self._minuto:
+            da_scrivere = self.svuota()
+        self._minuto = minuto
+        for livello in LIVELLI:
+            bucket = self._accumulatore(livello, ts // livello * livello)
+            bucket[0] += 1
+            for nome, x in valori.items():
+                if x != x:
+                    continue
+                parziale = bucket[1].get(nome)
+                if parziale is None:
+                    bucket[1][nome] = [1, x, x, x]
+                else:
+                    parziale[0] += 1
+                    parziale[1] += x
+                    if x < parziale[2]:
+                        parziale[2] = x
+                    if x > parziale[3]:
+                        parziale[3] = x
+        return da_scrivere
+
+    def aggiungi_blocco(self, ts, colonne):
+        """Aggiunge letture ordinate per tempo raggruppandole con NumPy e
+        restituisce subito i contributi da scrivere."""
+        ts = np.asarray(ts, dtype=np.float64)
+        if ts.size == 0:
+            return []
+        for livello in LIVELLI:
+            chiavi = np.floor(ts / livello) * livello
+            inizi = np.concatenate(([0], np.flatnonzero(np.diff(chiavi)) + 1))
+            conteggi = np.diff(np.append(inizi, ts.size))
+            parziali = {}
+            for nome, valori in colonne.items():
+                valori = np.asarray(valori, dtype=np.float64)
+                validi = ~np.isnan(valori)
+                parziali[nome] = (
+                    np.add.reduceat(validi.astype(np.int64), inizi),
+                    np.add.reduceat(np.where(validi, valori, 0.0), inizi),
+                    np.fmin.reduceat(valori, inizi),
+                    np.fmax.reduceat(valori, inizi),
+                )
+            for i, inizio in enumerate(chiavi[inizi].tolist()):
+                bucket = self._accumulatore(livello, inizio)
+                bucket[0] += int(conteggi[i])
+                for nome, (n, somma, minimo, massimo) in parziali.items():
+                    if n[i] == 0:
+                        continue
+                    parziale = bucket[1].setdefault(nome, [0, 0.0, math.inf, -math.inf])
+                    parziale[0] += int(n[i])
+                    parziale[1] += float(somma[i])
+                    parziale[2] = min(parziale[2], float(minimo[i]))
+                    parziale[3] = max(parziale[3], float(massimo[i]))
+        return self.svuota()
+
+    def svuota(self):
+        """Restituisce [(livello, inizio, conteggio, {canale: (n, somma, min, max)})] e azzera."""
+        righe = [
+            (livello, inizio, conteggio, {nome: tuple(p) for nome, p in parziali.items()})
+            for livello, bucket in self.pendenti.items()
+            for inizio, (conteggio, parziali) in bucket.items()
+        ]
+        self.pendenti = {livello: {} for livello in LIVELLI}
+        return righe
+
+    def non_scritti(self, livello, da=None, a=None):
+        """Contributi in memoria di un livello, nello stesso formato di svuota()."""
+        return [
+            (livello, inizio, conteggio, {nome: tuple(p) for nome, p in parziali.items()})
+            for inizio, (conteggio, parziali) in self.pendenti[livello].items()
+            if (da is None or inizio + livello > da) and (a is None or inizio <= a)
+        ]
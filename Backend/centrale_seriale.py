@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+
+import serial
+
+from centrale_stazioni import ALIAS_CANALI, canali_da_parametri, valida_lettura
+
+
+def parse_riga(riga, canali_posizionali=('temperature', 'humidity')):
+    """Interpreta una riga del protocollo della stazione.
+
+    Sono accettati due formati:
+      - chiave=valore separati da spazi, virgole, punto e virgola o &
+        (es. "temp=21.5 hum=55 press=1013.2"), con station= e ts= opzionali;
+      - soli numeri separati da virgole o spazi, assegnati nell'ordine a
+        `canali_posizionali` (es. "21.5,55").
+    Restituisce (stazione, ts, {canale: valore}); stazione e ts possono essere
+    None. Le righe vuote o di commento (#) danno None. Solleva ValueError se la
+    riga non è valida o la lettura non passa valida_lettura.
+    """
+    riga = riga.strip()
+    if not riga or riga.startswith('#'):
+        return None
+    campi = riga.replace(',', ' ').replace(';', ' ').replace('&', ' ').split()
+    if '=' in riga:
+        coppie = dict(campo.split('=', 1) for campo in campi if '=' in campo)
+        stazione = coppie.pop('station', None)
+        ts = coppie.pop('ts', None)
+        sconosciuti = [k for k in coppie if k not in ALIAS_CANALI]
+        if sconosciuti:
+            raise ValueError(f"canali sconosciuti: {', '.join(sconosciuti)}")
+        valori = canali_da_parametri(coppie)
+    else:
+        if len(campi) > len(canali_posizionali):
+            raise ValueError("troppi valori nella riga")
+        stazione = ts = None
+        valori = {nome: float(campo) for nome, campo in zip(canali_posizionali, campi)}
+    if not valori:
+        raise ValueError("nessun canale nella riga")
+    ts = float(ts) if ts is not None else None
+    valida_lettura(time.time() if ts is None else ts, valori)
+    return stazione, ts, valori
+
+
+class LettoreSeriale:
+    """Thread che legge le righe della stazione dalla porta seriale.
+
+    Ogni riga valida viene passata a `registra(stazione, ts, valori)`, la
+    stessa funzione usata da /update. Se il dispositivo sparisce (cavo
+    staccato, adattatore USB reinizializzato) la porta viene chiusa e
+    riaperta con un'attesa crescente fino a `attesa_massima` secondi.
+    """
+
+    def __init__(self, porta, registra, baudrate=9600, canali_posizionali=('temperature', 'humidity'),
+                 attesa_massima=30):
+        self.porta = porta
+        self.registra = registra
+        self.baudrate = baudrate
+        self.canali_posizionali = canali_posizionali
+        self.attesa_massima = attesa_massima
+        self.letture = 0
+        self.scartate = 0
+        self.connesso = False
+        self._fermo = threading.Event()
+        self._thread = None
+
+    def avvia(self):
+        self._thread = threading.Thread(target=self._ciclo, name='seriale-centrale', daemon=True)
+        self._thread.start()
+
+    def ferma(self):
+        self._fermo.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _ciclo(self):
+        attesa = 1
+        while not self._fermo.is_set():
+            try:
+                with serial.Serial(self.porta, self.baudrate, timeout=1) as dispositivo:
+                    logging.info("Porta seriale %s aperta", self.porta)
+                    self.connesso = True
+                    attesa = 1
+                    self._leggi(dispositivo)
+            except (serial.SerialException, OSError) as e:
+                logging.warning("Porta seriale %s non disponibile: %s", self.porta, e)
+            finally:
+                self.connesso = False
+            if self._fermo.wait(attesa):
+                break
+            attesa = min(attesa * 2, self.attesa_massima)
+
+    def _leggi(self, dispositivo):
+        while not self._fermo.is_set():
+            riga = dispositivo.readline()
+            if not riga:
+                continue  # timeout: si ricontrolla se bisogna fermarsi
+            try:
+                lettura = parse_riga(riga.decode('ascii', errors='replace'), self.canali_posizionali)
+            except ValueError as e:
+                self.scartate += 1
+                logging.warning("Riga seriale scartata (%s): %r", e, riga)
+                continue
+            if lettura is None:
+                continue
+            stazione, ts, valori = lettura
+            try:
+                self.registra(stazione, ts if ts is not None else time.time(), valori)
+            except ValueError as e:
+                self.scartate += 1
+                logging.warning("Lettura seriale rifiutata: %s", e)
+                continue
+            self.letture += 1
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+from centrale_stazioni import canali_richiesti
+
+
+class ServerSSE:
+    """Server asyncio per /stream: tutte le connessioni SSE su un solo event loop.
+
+    Le letture arrivano dallo stesso percorso di ingest di /update: chi
+    registra una lettura chiama notifica() e il server, nel suo thread,
+    formatta i nuovi eventi una volta sola e mette lo stesso blocco nella coda
+    limitata di ogni client della stazione. Un client che lascia riempire la coda viene
+    disconnesso invece di rallentare gli altri; al riavvio il browser si
+    ricollega con Last-Event-ID e recupera quello che ha perso.
+
+    I client di una stazione sono raggruppati per canali richiesti (param
+    channels): gli eventi vengono formattati una volta per gruppo.
+    """
+
+    def __init__(self, stazioni, formatta_eventi, host='0.0.0.0', porta=8889,
+                 dimensione_coda=256, heartbeat=15, replay_massimo=1000, max_client=5000,
+                 allarmi=None, formatta_allarme=None):
+        self.stazioni = stazioni
+        self.formatta_eventi = formatta_eventi
+        self.host = host
+        self.porta = porta
+        self.dimensione_coda = dimensione_coda
+        self.heartbeat = heartbeat
+        self.replay_massimo = replay_massimo
+        self.max_client = max_client
+        self.allarmi = allarmi
+        self.formatta_allarme = formatta_allarme
+        self.loop = None
+        self._client = {}
+        self._pubblicati = {}
+        self._allarmi_pubblicati = {}
+        self._pronto = threading.Event()
+        self.scartati = 0
+
+    def avvia(self):
+        """Avvia l'event loop in un thread daemon e attende che sia in ascolto."""
+        threading.Thread(target=self._esegui, name='sse-centrale', daemon=True).start()
+        self._pronto.wait()
+
+    def _esegui(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(
+            asyncio.start_server(self._gestisci, self.host, self.porta, backlog=1024)
+        )
+        self.porta = server.sockets[0].getsockname()[1]
+        self._pronto.set()
+        self.loop.run_forever()
+
+    @property
+    def connessi(self):
+        return sum(len(client) for gruppi in self._client.values() for client in gruppi.values())
+
+    def notifica(self):
+        """Chiamabile da qualsiasi thread dopo aver registrato nuove letture."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._pubblica)
+
+    def _pubblica(self):
+        for id, gruppi in list(self._client.items()):
+            stazione = self.stazioni.get(id)
+            if stazione is None or not any(gruppi.values()):
+                # Senza client non si tiene il segno: chi arriva riparte da buffer.totale
+                self._client.pop(id, None)
+                self._pubblicati.pop(id, None)
+                self._allarmi_pubblicati.pop(id, None)
+                continue
+            buffer = stazione.buffer
+            with buffer.lock:
+                canali = buffer.canali
+                id_eventi, righe = buffer.dopo(self._pubblicati[id], self.replay_massimo)
+            righe = list(righe)
+            if righe:
+                self._pubblicati[id] = id_eventi[-1]
+            allarmi = ''
+            if self.allarmi is not None:
+                self._allarmi_pubblicati[id], nuovi = self.allarmi.dopo(self._allarmi_pubblicati[id], id)
+                allarmi = ''.join(self.formatta_allarme(evento) for evento in nuovi)
+            if not righe and not allarmi:
+                continue
+            for selezione, client in list(gruppi.items()):
+                if not client:
+                    gruppi.pop(selezione)
+                    continue
+                # Un solo oggetto bytes condiviso da tutte le code del gruppo
+                blocco = (''.join(self.formatta_eventi(stazione, id_eventi, canali, righe, selezione)) + allarmi).encode()
+                for coda in list(client):
+                    try:
+                        coda.put_nowait(blocco)
+                    except asyncio.QueueFull:
+                        # Client troppo lento: si butta il suo arretrato e lo si scollega
+                        client.discard(coda)
+                        while not coda.empty():
+                            coda.get_nowait()
+                        coda.put_nowait(None)
+                        self.scartati += 1
+
+    async def _leggi_richiesta(self, reader):
+        riga = await reader.readline()
+        metodo, destinazione, _ = riga.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            riga = await reader.readline()
+            if riga in (b'\r\n', b'\n', b''):
+                break
+            nome, _, valore = riga.decode('latin-1').partition(':')
+            headers[nome.strip().lower()] = valore.strip()
+        return metodo, urlsplit(destinazione), headers
+
+    async def _rispondi(self, writer, stato, corpo):
+        writer.write(
+            f"HTTP/1.1 {stato}\r\nContent-Type: text/plain; charset=utf-8\r\n"
+            f"Access-Control-Allow-Origin: *\r\nContent-Length: {len(corpo.encode())}\r\n"
+            f"Connection: close\r\n\r\n{corpo}".encode()
+        )
+        await writer.drain()
+
+    async def _gestisci(self, reader, writer):
+        coda = None
+        id = None
+        selezione = None
+        try:
+            try:
+                metodo, url, headers = await asyncio.wait_for(self._leggi_richiesta(reader), 10)
+            except (ValueError, asyncio.TimeoutError, ConnectionError):
+                return
+            if metodo == 'OPTIONS':
+                # Preflight CORS: il browser può rimandare Last-Event-ID dopo il redirect di /stream
+                writer.write(
+                    b"HTTP/1.1 204 No Content\r\nAccess-Control-Allow-Origin: *\r\n"
+                    b"Access-Control-Allow-Methods: GET\r\n"
+                    b"Access-Control-Allow-Headers: Last-Event-ID, Cache-Control\r\n"
+                    b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+                await writer.drain()
+                return
+            if metodo != 'GET' or url.path != '/stream':
+                await self._rispondi(writer, "404 Not Found", "Endpoint non trovato")
+                return
+            parametri = parse_qs(url.query)
+            stazione = self.stazioni.get(parametri.get('station', [None])[0])
+            if stazione is None:
+                await self._rispondi(writer, "404 Not Found", "Stazione sconosciuta")
+                return
+            try:
+                selezione = canali_richiesti(parametri.get('channels', [None])[0])
+            except ValueError as e:
+                await self._rispondi(writer, "400 Bad Request", str(e))
+                return
+            if self.connessi >= self.max_client:
+                await self._rispondi(writer, "503 Service Unavailable", "Troppi client connessi")
+                return
+
+            id = stazione.id
+            buffer = stazione.buffer
+            pubblicato = self._pubblicati.setdefault(id, buffer.totale)
+            if self.allarmi is not None:
+                self._allarmi_pubblicati.setdefault(id, self.allarmi.seq)
+            ultimo_id = headers.get('last-event-id') or parametri.get('lastEventId', [None])[0]
+            try:
+                ultimo_id = int(ultimo_id) if ultimo_id else None
+            except ValueError:
+                ultimo_id = None
+            if ultimo_id is None or ultimo_id > pubblicato:
+                # Nuovo client: parte dall'ultima lettura già pubblicata
+                ultimo_id = max(0, pubblicato - 1)
+
+            # Replay e iscrizione avvengono senza await in mezzo: nessun evento va perso
+            with buffer.lock:
+                canali = buffer.canali
+                id_eventi, righe = buffer.dopo(ultimo_id, self.replay_massimo, fino=pubblicato)
+            replay = [evento.encode() for evento in self.formatta_eventi(stazione, id_eventi, canali, righe, selezione)]
+            coda = asyncio.Queue(self.dimensione_coda)
+            self._client.setdefault(id, {}).setdefault(selezione, set()).add(coda)
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                b"Connection: keep-alive\r\nAccess-Control-Allow-Origin: *\r\n\r\n"
+            )
+            writer.write(b''.join(replay))
+            await writer.drain()
+
+            while True:
+                try:
+                    evento = await asyncio.wait_for(coda.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    evento = b": keepalive\n\n"
+                if evento is None:
+                    return
+                writer.write(evento)
+                await asyncio.wait_for(writer.drain(), self.heartbeat)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        except Exception:
+            logging.exception("Errore nel server SSE")
+        finally:
+            if coda is not None:
+                self._client.get(id, {}).get(selezione, set()).discard(coda)
+            writer.close()
@@ -0,0 +1,222 @@
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Finestre di /stats: nome -> (ampiezza del bucket in secondi, numero di bucket)
+FINESTRE = {
+    '1h': (60, 60),
+    '24h': (900, 96),
+    '7d': (3600, 168),
+}
+
+
+class Welford:
+    """Conteggio, media e varianza in un passaggio (Welford), più minimo e massimo."""
+
+    __slots__ = ('n', 'media', 'm2', 'minimo', 'massimo')
+
+    def __init__(self):
+        self.azzera()
+
+    def azzera(self):
+        self.n = 0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.minimo = math.inf
+        self.massimo = -math.inf
+
+    def aggiungi(self, x):
+        if x != x:  # NaN: canale non misurato
+            return
+        self.n += 1
+        delta = x - self.media
+        self.media += delta / self.n
+        self.m2 += delta * (x - self.media)
+        if x < self.minimo:
+            self.minimo = x
+        if x > self.massimo:
+            self.massimo = x
+
+    def unisci(self, altro):
+        """Combina due stati (formula di Chan et al.)."""
+        if altro.n == 0:
+            return
+        if self.n == 0:
+            self.n, self.media, self.m2 = altro.n, altro.media, altro.m2
+            self.minimo, self.massimo = altro.minimo, altro.massimo
+            return
+        n = self.n + altro.n
+        delta = altro.media - self.media
+        self.media += delta * altro.n / n
+        self.m2 += altro.m2 + delta * delta * self.n * altro.n / n
+        self.n = n
+        self.minimo = min(self.minimo, altro.minimo)
+        self.massimo = max(self.massimo, altro.massimo)
+
+    def risultato(self):
+        if self.n == 0:
+            return {"count": 0, "mean": None, "variance": None, "std": None, "min": None, "max": None}
+        varianza = self.m2 / (self.n - 1) if self.n > 1 else 0.0
+        return {
+            "count": self.n,
+            "mean": round(self.media, 3),
+            "variance": round(varianza, 3),
+            "std": round(math.sqrt(varianza), 3),
+            "min": self.minimo,
+            "max": self.massimo,
+        }
+
+
+class Anello:
+    """Bucket a tempo fisso riutilizzati in circolo: ogni slot ricorda la sua chiave
+    e viene azzerato quando il tempo lo riporta in uso."""
+
+    def __init__(self, ampiezza, numero):
+        self.ampiezza = ampiezza
+        self.numero = numero
+        self.chiavi = [None] * numero
+        self.slot = [Welford() for _ in range(numero)]
+
+    def _slot(self, chiave):
+        i = chiave % self.numero
+        if self.chiavi[i] != chiave:
+            if self.chiavi[i] is not None and self.chiavi[i] > chiave:
+                return None  # lettura più vecchia della finestra
+            self.chiavi[i] = chiave
+            self.slot[i].azzera()
+        return self.slot[i]
+
+    def aggiungi(self, ts, x):
+        slot = self._slot(int(ts // self.ampiezza))
+        if slot is not None:
+            slot.aggiungi(x)
+
+    def unisci(self, chiave, stato):
+        slot = self._slot(chiave)
+        if slot is not None:
+            slot.unisci(stato)
+
+    def totale(self, adesso):
+        """Stato combinato degli slot che cadono negli ultimi `numero` bucket."""
+        ultima = int(adesso // self.ampiezza)
+        totale = Welford()
+        for chiave, stato in zip(self.chiavi, self.slot):
+            if chiave is not None and ultima - self.numero < chiave <= ultima:
+                totale.unisci(stato)
+        return totale
+
+
+class StatisticheStazione:
+    """Aggregati correnti per canale, aggiornati in O(1) a ogni lettura.
+
+    Per ogni finestra di FINESTRE c'è un anello di bucket; una richiesta
+    combina al massimo 168 stati indipendentemente da quante letture ci sono.
+    Il giorno corrente (ora locale) ha un accumulatore a parte che riparte a
+    mezzanotte, mentre quello del giorno prima resta disponibile come 'yesterday'.
+    """
+
+    def __init__(self, canali):
+        self.anelli = {}
+        self.oggi = {}
+        self.ieri = {}
+        self._inizio_giorno = self._fine_giorno = None
+        for nome in canali:
+            self.aggiungi_canale(nome)
+
+    def aggiungi_canale(self, nome):
+        if nome in self.anelli:
+            return
+        self.anelli[nome] = {f: Anello(*FINESTRE[f]) for f in FINESTRE}
+        self.oggi[nome] = Welford()
+        self.ieri[nome] = Welford()
+
+    def _giorno(self, ts):
+        """True se `ts` cade nel giorno corrente, dopo un eventuale cambio di data."""
+        if self._fine_giorno is not None and self._inizio_giorno <= ts < self._fine_giorno:
+            return True
+        if self._inizio_giorno is not None and ts < self._inizio_giorno:
+            return False
+        inizio = datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0)
+        giorno_prima = self._inizio_giorno
+        self._inizio_giorno = inizio.timestamp()
+        self._fine_giorno = (inizio + timedelta(days=1)).timestamp()
+        for nome in self.oggi:
+            # Il giorno appena chiuso diventa "ieri" solo se è davvero quello precedente
+            if giorno_prima is not None and self._inizio_giorno - giorno_prima <= 25 * 3600:
+                self.ieri[nome], self.oggi[nome] = self.oggi[nome], self.ieri[nome]
+            else:
+                self.ieri[nome].azzera()
+            self.oggi[nome].azzera()
+        return True
+
+    def aggiungi(self, ts, valori):
+        """Aggiunge una lettura {canale: valore}."""
+        oggi = self._giorno(ts)
+        for nome, x in valori.items():
+            anelli = self.anelli.get(nome)
+            if anelli is None:
+                continue
+            for anello in anelli.values():
+                anello.aggiungi(ts, x)
+            if oggi:
+                self.oggi[nome].aggiungi(x)
+
+    def aggiungi_blocco(self, ts, colonne):
+        """Aggiunge letture ordinate per tempo (batch, finestra ripristinata all'avvio)
+        raggruppandole per bucket con NumPy invece che riga per riga."""
+        ts = np.asarray(ts, dtype=np.float64)
+        if ts.size == 0:
+            return
+        self._giorno(ts[-1])
+        for nome, valori in colonne.items():
+            if nome not in self.anelli:
+                continue
+            valori = np.asarray(valori, dtype=np.float64)
+            for anello in self.anelli[nome].values():
+                chiavi = np.floor(ts / anello.ampiezza).astype(np.int64)
+                dentro = chiavi > chiavi[-1] - anello.numero
+                for chiave, stato in _stati_per_chiave(chiavi[dentro], valori[dentro]):
+                    anello.unisci(chiave, stato)
+            ieri = (datetime.fromtimestamp(self._inizio_giorno) - timedelta(days=1)).timestamp()
+            for accumulatore, dentro in (
+                (self.oggi[nome], ts >= self._inizio_giorno),
+                (self.ieri[nome], (ts >= ieri) & (ts < self._inizio_giorno)),
+            ):
+                for _, stato in _stati_per_chiave(np.zeros(int(dentro.sum()), np.int64), valori[dentro]):
+                    accumulatore.unisci(stato)
+
+    def finestra(self, nome, adesso):
+        """{canale: statistiche} per una finestra di FINESTRE oppure 'today'/'yesterday'."""
+        if nome in ('today', 'yesterday'):
+            # Se da mezzanotte non è arrivato nulla il rollover non è ancora avvenuto
+            giorni = {}
+            if self._fine_giorno is not None and self._inizio_giorno <= adesso:
+                if adesso < self._fine_giorno:
+                    giorni = {'today': self.oggi, 'yesterday': self.ieri}
+                elif adesso < self._fine_giorno + 24 * 3600:
+                    giorni = {'yesterday': self.oggi}
+            stati = giorni.get(nome, {})
+            return {c: (stati[c] if c in stati else Welford()).risultato() for c in self.oggi}
+        return {c: anelli[nome].totale(adesso).risultato() for c, anelli in self.anelli.items()}
+
+
+def _stati_per_chiave(chiavi, valori):
+    """Stati Welford di ogni gruppo di chiavi consecutive uguali, ignorando i NaN."""
+    validi = ~np.isnan(valori)
+    chiavi, valori = chiavi[validi], valori[validi]
+    if chiavi.size == 0:
+        return []
+    inizi = np.concatenate(([0], np.flatnonzero(np.diff(chiavi)) + 1))
+    conteggi = np.diff(np.append(inizi, chiavi.size))
+    medie = np.add.reduceat(valori, inizi) / conteggi
+    scarti = np.add.reduceat((valori - np.repeat(medie, conteggi)) ** 2, inizi)
+    minimi = np.minimum.reduceat(valori, inizi)
+    massimi = np.maximum.reduceat(valori, inizi)
+    stati = []
+    for i in range(inizi.size):
+        stato = Welford()
+        stato.n, stato.media, stato.m2 = int(conteggi[i]), float(medie[i]), float(scarti[i])
+        stato.minimo, stato.massimo = float(minimi[i]), float(massimi[i])
+        stati.append((int(chiavi[inizi[i]]), stato))
+    return stati
@@ -0,0 +1,530 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from centrale_buffer import RingBuffer
+from centrale_archivio import LogBinario
+from centrale_blocchi import ArchivioBlocchi
+from centrale_condivisa import CORREZIONE, NEL_BUFFER, IndiceStazioni, RingBufferCondiviso
+from centrale_derivati import DERIVATI
+from centrale_percentili import Percentili, TDigest
+from centrale_rollup import Rollup
+from centrale_statistiche import StatisticheStazione
+
+# Canali riconosciuti: nome canonico -> alias accettati nelle richieste e unità di misura
+CANALI = {
+    'temperature': {'alias': ('temp',), 'unita': '°C'},
+    'humidity': {'alias': ('hum',), 'unita': '%'},
+    'pressure': {'alias': ('press',), 'unita': 'hPa'},
+    'wind_speed': {'alias': ('wind',), 'unita': 'm/s'},
+    'wind_direction': {'alias': ('wind_dir',), 'unita': '°'},
+    'rain': {'alias': (), 'unita': 'mm'},
+}
+ALIAS_CANALI = {alias: nome for nome, info in CANALI.items() for alias in (nome,) + info['alias']}
+
+ID_VALIDO = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+MAX_STAZIONI = 64
+# Timestamp accettati: dal 2000 (un epoch in millisecondi cade ben oltre) a pochi minuti nel futuro
+TS_MINIMO = 946684800.0
+FUTURO_MASSIMO = 300
+
+
+def canali_da_parametri(parametri):
+    """Estrae {canale: valore} dai parametri di una richiesta (nomi o alias).
+
+    Solleva ValueError se un valore non è numerico.
+    """
+    valori = {}
+    for chiave, valore in parametri.items():
+        nome = ALIAS_CANALI.get(chiave)
+        if nome is not None and valore is not None:
+            valori[nome] = float(valore)
+    return valori
+
+
+def valida_lettura(ts, valori, adesso=None):
+    """Controlla una lettura prima di accoglierla, da qualunque ingresso arrivi.
+
+    Solleva ValueError se il timestamp non è plausibile o un valore non è finito.
+    """
+    if adesso is None:
+        adesso = time.time()
+    if not math.isfinite(ts):
+        raise ValueError("timestamp non numerico")
+    if ts < TS_MINIMO:
+        raise ValueError("timestamp precedente al 2000")
+    if ts > adesso + FUTURO_MASSIMO:
+        raise ValueError("timestamp nel futuro (millisecondi invece di secondi?)")
+    if not all(math.isfinite(v) for v in valori.values()):
+        raise ValueError("valori non numerici")
+
+
+def canali_richiesti(valore):
+    """Nomi canonici dei canali (misurati o derivati) di un parametro come
+    'temp,dew_point'; None se il parametro manca.
+
+    Solleva ValueError per un canale sconosciuto.
+    """
+    if not valore:
+        return None
+    canali = []
+    for nome in valore.split(','):
+        nome = ALIAS_CANALI.get(nome.strip(), nome.strip())
+        if nome not in CANALI and nome not in DERIVATI:
+            raise ValueError(f"Canale sconosciuto: {nome}")
+        if nome not in canali:
+            canali.append(nome)
+    return tuple(canali)
+
+
+def valore_json(valore):
+    """I NaN (canale non misurato) diventano null nelle risposte JSON."""
+    return None if math.isnan(valore) else valore
+
+
+def path_file_stazione(directory, id, predefinita, estensione):
+    """Percorso di un file della stazione (log .bin, blocchi .gor)."""
+    # La stazione predefinita mantiene il nome storico dei file
+    nome = f'centrale{estensione}' if id == predefinita else f'centrale_{id}{estensione}'
+    return os.path.join(directory, nome)
+
+
+def _ordinate(ts, colonne):
+    ordine = np.argsort(ts, kind='stable')
+    return ts[ordine], {nome: valori[ordine] for nome, valori in colonne.items()}
+
+
+class Stazione:
+    """Una stazione meteo: buffer a colonne dei suoi canali più il log su disco.
+
+    Con `condivisa` (prefisso dei segmenti) il buffer sta in memoria condivisa
+    tra i processi; statistiche, rollup e archivio restano di ogni processo e
+    vengono aggiornati da segui() con le letture arrivate nel buffer.
+    """
+
+    def __init__(self, id, canali, capacita, condivisa=None, capacita_coda=65536):
+        self.id = id
+        self.condivisa = condivisa is not None
+        if self.condivisa:
+            self.buffer = RingBufferCondiviso(f"{condivisa}_{id}", capacita, canali, CANALI, capacita_coda)
+        else:
+            self.buffer = RingBuffer(capacita, canali)
+        self.statistiche = StatisticheStazione(self.canali)
+        # Rollup e percentili vengono alimentati solo quando c'è uno storico in cui scriverli
+        self.rollup = Rollup(self.canali)
+        self.percentili = Percentili(self.canali)
+        # Contributi di rollup e percentili calcolati da aggrega() e non ancora accodati
+        self._da_scrivere = []
+        self.archivio = None
+        self.storico = None
+        self.blocchi = None
+        # Posizione nella coda degli arrivi del buffer condiviso già applicata
+        self._arrivi = 0
+        self._seminate = 0
+        self._allineati = self.canali
+        if self.condivisa:
+            ts, colonne, self._arrivi = self.buffer.istantanea()
+            self._seminate = self._arrivi
+            self.statistiche.aggiungi_blocco(ts, colonne)
+
+    @property
+    def canali(self):
+        return self.buffer.canali
+
+    def apri_archivio(self, path, scrittore=None):
+        """Apre il log binario e ricostruisce la finestra in memoria dalla sua coda."""
+        self.archivio = LogBinario(path, self.canali, scrittore)
+        if self.condivisa and self.buffer.totale:
+            # Il buffer condiviso è già pieno (altri processi, o un archivio precedente):
+            # si riprende a salvare dalle letture che nessuno ha ancora passato all'archivio
+            self._arrivi = self.buffer.persistite
+            return 0
+        coda = self.archivio.coda(self.buffer.capacita)
+        # I backfill possono aver scritto record fuori ordine: ogni riga tiene
+        # come numero di sequenza la sua posizione nel log
+        ordine = np.argsort(coda['ts'], kind='stable')
+        coda = coda[ordine]
+        sequenze = ordine + (len(self.archivio) - len(ordine) + 1)
+        if len(coda):
+            self.buffer.estendi(coda['ts'], {n: coda[n] for n in self.canali}, sequenze)
+            self.statistiche.aggiungi_blocco(coda['ts'], {n: coda[n] for n in self.canali})
+        # Gli id degli eventi SSE coincidono con la posizione nel log e restano validi dopo un riavvio
+        self.buffer.totale = len(self.archivio)
+        return len(coda)
+
+    def _allinea_canali(self):
+        """Porta statistiche, rollup e log ai canali del buffer (anche quelli aggiunti da altri processi)."""
+        for nome in self.canali:
+            self.statistiche.aggiungi_canale(nome)
+            self.rollup.aggiungi_canale(nome)
+            self.percentili.aggiungi_canale(nome)
+        if self.archivio is not None and self.archivio.canali != self.canali:
+            self.archivio.migra(self.canali)
+        self._allineati = self.canali
+
+    def aggiungi_canali(self, canali):
+        nuovi = [c for c in canali if c not in self.canali]
+        if not nuovi:
+            return False
+        with self.buffer.lock:
+            for nome in nuovi:
+                self.buffer.aggiungi_canale(nome)
+            self._allinea_canali()
+        return True
+
+    # Le tre fasi dell'ingest, chiamate una per volta dalla pipeline
+
+    def nel_buffer(self, ts, colonne):
+        """Unisce le letture ordinate al buffer.
+
+        Restituisce (ts, colonne, fuori, correzioni): le letture nuove con
+        tutti i canali della stazione; quante di queste (le prime) sono più
+        vecchie della finestra di riordino del buffer e vanno solo
+        nell'archivio, rollup compresi; le correzioni (ts, colonne) da passare
+        solo allo storico.
+
+        Una lettura con timestamp e valori uguali a una già nel buffer (un
+        lotto rispedito) viene ignorata, così rollup e percentili non la
+        contano due volte. Con lo stesso timestamp ma valori diversi è una
+        correzione: buffer e rollup tengono la prima versione, lo storico la
+        sostituisce. Con più letture dello stesso istante nel lotto vale
+        l'ultima, come nello storico.
+        """
+        ts = np.asarray(ts, dtype=np.float64)
+        ricevuti = list(colonne)
+        colonne = {
+            nome: np.asarray(colonne[nome], dtype=np.float64) if nome in colonne else np.full(len(ts), math.nan)
+            for nome in self.canali
+        }
+        with self.buffer.lock:
+            nuove = np.ones(len(ts), dtype=bool)
+            nuove[:-1] = ts[1:] != ts[:-1]
+            correzioni = np.zeros(len(ts), dtype=bool)
+            if len(ts):
+                _, presenti, valori_presenti = self.buffer.finestra_tra(ts[0], ts[-1])
+                if len(presenti):
+                    presenti = np.asarray(presenti)
+                    indici = np.maximum(np.searchsorted(presenti, ts, side='right') - 1, 0)
+                    trovate = presenti[indici] == ts
+                    uguali = trovate.copy()
+                    for nome in ricevuti:
+                        valori, vecchi = colonne[nome], np.asarray(valori_presenti[nome])[indici]
+                        uguali &= (valori == vecchi) | (np.isnan(valori) & np.isnan(vecchi))
+                    correzioni = nuove & trovate & ~uguali
+                    nuove &= ~trovate
+            corrette = (ts[correzioni], {nome: valori[correzioni] for nome, valori in colonne.items()})
+            ts, colonne = ts[nuove], {nome: valori[nuove] for nome, valori in colonne.items()}
+            fuori = self.buffer.unisci(ts, colonne)
+            if self.condivisa:
+                self.buffer.accoda_correzioni(*corrette)
+        if fuori:
+            # Più vecchie di quanto un'unione può riordinare (CENTRALE_RIORDINO)
+            logging.debug("%s: %d letture fuori dalla finestra del buffer, solo nell'archivio", self.id, fuori)
+        return ts, colonne, fuori, corrette
+
+    def aggrega(self, ts, colonne):
+        """Aggiorna statistiche, rollup e percentili; i contributi li scrive persisti()."""
+        if self.condivisa or not len(ts):
+            # Il resto lo fa segui(), in ogni processo
+            return
+        with self.buffer.lock:
+            if len(ts) == 1:
+                # Lettura singola (es. /update): i contributi si accumulano in memoria
+                # e vanno nello storico al cambio di minuto
+                t = float(ts[0])
+                valori = {nome: float(valori[0]) for nome, valori in colonne.items()}
+                self.statistiche.aggiungi(t, valori)
+                if self.storico is not None:
+                    self._da_scrivere.append((self.rollup.aggiungi(t, valori), self.percentili.aggiungi(t, valori)))
+                return
+            self.statistiche.aggiungi_blocco(ts, colonne)
+            if self.storico is not None:
+                self._da_scrivere.append(
+                    (self.rollup.aggiungi_blocco(ts, colonne), self.percentili.aggiungi_blocco(ts, colonne)))
+
+    def persisti(self, ts, colonne, correzioni=None):
+        """Accoda le letture al log e allo storico, con i contributi di aggrega();
+        le `correzioni` (ts, colonne) vanno solo nello storico."""
+        if self.condivisa:
+            return
+        with self.buffer.lock:
+            if self.archivio is not None and len(ts):
+                self.archivio.append_blocco(ts, colonne)
+            # I contributi passano allo storico con il lock preso, così
+            # rollup_intervallo() li trova sempre in uno dei due posti
+            if self.storico is not None:
+                for rollup, percentili in self._da_scrivere:
+                    self.storico.accoda_rollup(self.id, rollup)
+                    self.storico.accoda_percentili(self.id, percentili)
+            self._da_scrivere = []
+        if self.storico is not None:
+            for blocco in ((ts, colonne), correzioni or ((), {})):
+                if len(blocco[0]):
+                    self.storico.accoda_blocco(self.id, *blocco)
+
+    def segui(self, persisti=False):
+        """Applica le letture arrivate nel buffer condiviso dopo l'ultima chiamata,
+        da qualsiasi processo: statistiche sempre, log, storico e rollup solo con
+        `persisti` (nel processo che possiede l'archivio).
+
+        Restituisce (ts, colonne) delle letture nuove entrate nel buffer,
+        ordinate per tempo.
+        """
+        with self.buffer.lock:
+            da = self._arrivi
+            self._arrivi, ts, colonne, tipi, perse = self.buffer.arrivi_dopo(da)
+            if perse:
+                logging.warning("%s: %d letture uscite dalla coda condivisa prima di essere applicate", self.id, perse)
+            if not len(ts):
+                return ts, colonne
+            if tuple(colonne) != self._allineati:
+                self._allinea_canali()
+            # Le correzioni vanno solo nello storico: statistiche, log e rollup tengono la prima versione
+            correzioni = tipi == CORREZIONE
+            corrette = (ts[correzioni], {n: v[correzioni] for n, v in colonne.items()})
+            # Le prime possono essere già nella finestra da cui sono partite le statistiche
+            contate = min(len(ts), max(0, self._seminate - (da + perse)))
+            da_contare = ~correzioni
+            da_contare[:contate] = False
+            self.statistiche.aggiungi_blocco(*_ordinate(ts[da_contare], {n: v[da_contare] for n, v in colonne.items()}))
+            ordine = np.argsort(ts[~correzioni], kind='stable')
+            ts, tipi = ts[~correzioni][ordine], tipi[~correzioni][ordine]
+            colonne = {n: v[~correzioni][ordine] for n, v in colonne.items()}
+            if persisti:
+                if self.archivio is not None and len(ts):
+                    self.archivio.append_blocco(ts, colonne)
+                if self.storico is not None and len(ts):
+                    self.storico.accoda_rollup(self.id, self.rollup.aggiungi_blocco(ts, colonne))
+                    self.storico.accoda_percentili(self.id, self.percentili.aggiungi_blocco(ts, colonne))
+        if persisti:
+            if self.storico is not None:
+                for blocco in ((ts, colonne), corrette):
+                    if len(blocco[0]):
+                        self.storico.accoda_blocco(self.id, *blocco)
+            self.buffer.persistite = self._arrivi
+        nel_buffer = tipi == NEL_BUFFER
+        return ts[nel_buffer], {n: v[nel_buffer] for n, v in colonne.items()}
+
+    def svuota_rollup(self):
+        """Scrive subito i contributi a rollup e percentili ancora in memoria (es. alla chiusura)."""
+        if self.storico is None:
+            return
+        with self.buffer.lock:
+            self.storico.accoda_rollup(self.id, self.rollup.svuota())
+            self.storico.accoda_percentili(self.id, self.percentili.svuota())
+
+    def rollup_intervallo(self, livello, da, a):
+        """Bucket di un livello tra da e a, compresi quelli non ancora scritti.
+
+        Restituisce (inizi, conteggi, {canale: (n, somma, min, max)}); lo stesso
+        inizio può comparire più volte (parte salvata, accodata allo scrittore
+        e ancora in memoria).
+        """
+        with self.buffer.lock:
+            # Lo storico si legge con il lock preso: i contributi lasciano la
+            # memoria solo con il lock, quindi nessuno è contato due volte o perso
+            canali = self.canali
+            pendenti = self.rollup.non_scritti(livello, da, a) + [
+                riga
+                for rollup, _ in self._da_scrivere
+                for riga in rollup
+                if riga[0] == livello and (da is None or riga[1] + livello > da) and (a is None or riga[1] <= a)
+            ]
+            inizi, conteggi, parziali = self.storico.rollup(self.id, livello, canali, da, a)
+        if pendenti:
+            inizi = np.concatenate((inizi, [p[1] for p in pendenti]))
+            conteggi = np.concatenate((conteggi, [p[2] for p in pendenti]))
+            vuoto = (0, 0.0, math.nan, math.nan)
+            parziali = {
+                nome: tuple(
+                    np.concatenate((parziali[nome][j], [p[3].get(nome, vuoto)[j] for p in pendenti]))
+                    for j in range(4)
+                )
+                for nome in parziali
+            }
+        return inizi, conteggi, parziali
+
+    def percentili_intervallo(self, canali, da, a):
+        """Digest dei giorni tra `da` e `a` ('AAAA-MM-GG'), compresi quelli non ancora scritti.
+
+        Restituisce [(giorno, canale, TDigest)]; lo stesso giorno può comparire
+        più volte (parte salvata, accodata allo scrittore e ancora in memoria).
+        """
+        with self.buffer.lock:
+            # Come in rollup_intervallo(), lo storico si legge con il lock preso
+            non_scritti = self.percentili.non_scritti(da, a) + [
+                riga
+                for _, percentili in self._da_scrivere
+                for riga in percentili
+                if (da is None or riga[0] >= da) and (a is None or riga[0] <= a)
+            ]
+            pendenti = [
+                (giorno, nome, TDigest.da_bytes(digest.in_bytes()))
+                for giorno, nome, digest in non_scritti
+                if nome in canali
+            ]
+            return self.storico.percentili(self.id, canali, da, a) + pendenti
+
+    def statistiche_finestra(self, finestra, adesso):
+        with self.buffer.lock:
+            return self.statistiche.finestra(finestra, adesso)
+
+    def ultima_lettura(self):
+        """Restituisce (ts, {canale: valore}) oppure None."""
+        ultimo = self.buffer.ultimo()
+        if ultimo is None:
+            return None
+        ts, valori = ultimo
+        return ts, dict(zip(self.canali, valori))
+
+
+class RegistroStazioni:
+    """Elenco delle stazioni, indicizzato per id.
+
+    Finché non viene chiamato apri() le stazioni vivono solo in memoria; dopo,
+    ogni stazione ha in `directory` il suo log binario e il file dei giorni
+    sigillati in blocchi compressi, e l'elenco è salvato in centrale_stazioni.json.
+    Con `condivisa` i buffer stanno in memoria condivisa e un indice condiviso
+    fa ritrovare a ogni processo le stazioni create dagli altri. Con
+    `cache_blocchi` (CacheBlocchi) le stazioni condividono una cache dei
+    blocchi sigillati decodificati.
+    """
+
+    def __init__(self, capacita, predefinita, canali_predefiniti=('temperature', 'humidity'),
+                 condivisa=None, capacita_coda=65536, cache_blocchi=None):
+        self.capacita = capacita
+        self.cache_blocchi = cache_blocchi
+        self.predefinita = predefinita
+        self.condivisa = condivisa
+        self.capacita_coda = capacita_coda
+        self.directory = None
+        self.scrittore = None
+        self.storico = None
+        self.stazioni = {}
+        self.lock = threading.Lock()
+        self.indice = IndiceStazioni(condivisa, MAX_STAZIONI) if condivisa else None
+        self._crea(predefinita, canali_predefiniti)
+
+    def get(self, id=None):
+        id = id or self.predefinita
+        stazione = self.stazioni.get(id)
+        if stazione is None and self.indice is not None:
+            self._sincronizza()
+            stazione = self.stazioni.get(id)
+        return stazione
+
+    def __iter__(self):
+        if self.indice is not None:
+            self._sincronizza()
+        return iter(list(self.stazioni.values()))
+
+    def _sincronizza(self):
+        """Aggiunge le stazioni create da altri processi nel buffer condiviso."""
+        if len(self.indice) == len(self.stazioni):
+            return
+        with self.lock:
+            nuove = [id for id in self.indice.elenco() if id not in self.stazioni]
+            for id in nuove:
+                self._crea(id, ())
+            if nuove:
+                self._salva()
+
+    def _path_log(self, id):
+        return path_file_stazione(self.directory, id, self.predefinita, '.bin')
+
+    def _path_blocchi(self, id):
+        return path_file_stazione(self.directory, id, self.predefinita, '.gor')
+
+    def _path_registro(self):
+        return os.path.join(self.directory, 'centrale_stazioni.json')
+
+    def _salva(self):
+        if self.directory is None:
+            return
+        dati = {s.id: {"canali": list(s.canali)} for s in self.stazioni.values()}
+        temporaneo = self._path_registro() + '.tmp'
+        with open(temporaneo, 'w', encoding='utf-8') as f:
+            json.dump(dati, f, indent=2)
+        os.replace(temporaneo, self._path_registro())
+
+    def _crea(self, id, canali):
+        """Crea la stazione (e il suo archivio, se aperto); restituisce le letture ripristinate."""
+        if self.indice is not None:
+            self.indice.aggiungi(id)
+        stazione = self.stazioni[id] = Stazione(id, canali, self.capacita, self.condivisa, self.capacita_coda)
+        stazione.storico = self.storico
+        if self.directory is None:
+            return 0
+        stazione.blocchi = ArchivioBlocchi(self._path_blocchi(id), self.cache_blocchi)
+        return stazione.apri_archivio(self._path_log(id), self.scrittore)
+
+    def apri(self, directory, scrittore=None, storico=None):
+        """Carica le stazioni registrate e i loro log. Restituisce le letture ripristinate.
+
+        Con uno `scrittore` le scritture dei log avvengono nel suo thread; con
+        uno `storico` ogni lettura viene copiata anche nell'archivio SQLite.
+        """
+        self.directory = directory
+        self.scrittore = scrittore
+        self.storico = storico
+        os.makedirs(directory, exist_ok=True)
+        registrate = {}
+        if os.path.exists(self._path_registro()):
+            with open(self._path_registro(), encoding='utf-8') as f:
+                registrate = json.load(f)
+        ripristinate = 0
+        with self.lock:
+            for id, info in registrate.items():
+                if id not in self.stazioni:
+                    self.stazioni[id] = Stazione(id, info['canali'], self.capacita, self.condivisa, self.capacita_coda)
+                    if self.indice is not None:
+                        self.indice.aggiungi(id)
+                else:
+                    self.stazioni[id].aggiungi_canali(info['canali'])
+            for stazione in self.stazioni.values():
+                ripristinate += stazione.apri_archivio(self._path_log(stazione.id), scrittore)
+                stazione.blocchi = ArchivioBlocchi(self._path_blocchi(stazione.id), self.cache_blocchi)
+                stazione.storico = storico
+            self._salva()
+        return ripristinate
+
+    def verifica_id(self, id):
+        """Id della stazione a cui vanno le letture, senza crearla né toccare il disco.
+
+        Solleva ValueError se l'id non è valido o se la stazione non esiste e
+        non c'è più posto per crearla.
+        """
+        id = id or self.predefinita
+        if id in self.stazioni:
+            return id
+        if not ID_VALIDO.match(id):
+            raise ValueError("Id stazione non valido")
+        if len(self.stazioni) >= MAX_STAZIONI:
+            raise ValueError("Numero massimo di stazioni raggiunto")
+        return id
+
+    def ottieni_o_crea(self, id, canali):
+        """Restituisce la stazione `id`, creandola o aggiungendo i canali mancanti."""
+        id = id or self.predefinita
+        stazione = self.stazioni.get(id)
+        if stazione is not None and all(c in stazione.canali for c in canali):
+            return stazione
+        if not ID_VALIDO.match(id):
+            raise ValueError("Id stazione non valido")
+        with self.lock:
+            stazione = self.stazioni.get(id)
+            if stazione is None:
+                if len(self.stazioni) >= MAX_STAZIONI:
+                    raise ValueError("Numero massimo di stazioni raggiunto")
+                self._crea(id, canali)
+                stazione = self.stazioni[id]
+                self._salva()
+            elif stazione.aggiungi_canali(canali):
+                self._salva()
+        return stazione
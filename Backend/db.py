@@ -0,0 +1,254 @@
+"""Connessioni SQLite condivise dai servizi del backend.
+
+Aprire una connessione per richiesta costa l'apertura del file, la lettura
+dello schema e una cache delle pagine vuota a ogni chiamata. Un
+PoolConnessioni tiene invece le connessioni inattive di un database e le
+ridà alla richiesta successiva, già configurate:
+
+    utenti = pool_per(db_path)
+    with utenti.connessione() as conn:
+        ...                         # all'uscita torna nel pool, non chiude il file
+
+connessione() passa a rilascia() l'eccezione che interrompe il blocco, così
+una connessione danneggiata viene chiusa invece che riusata. Chi usa
+prendi() rimette la connessione nel pool con conn.close() o con
+pool.rilascia(conn, errore).
+
+Ogni connessione nuova viene impostata con journal_mode=WAL (le letture non
+aspettano le scritture), synchronous=NORMAL, busy_timeout, cache_size e
+mmap_size. Le connessioni rimesse nel pool perdono la transazione non
+confermata (come con close()) e vengono chiuse quando il pool ha già
+`massimo` connessioni libere, quando hanno più di `durata_massima` secondi
+o quando, dopo `controllo` secondi di inattività, non rispondono più o il
+file del database è stato sostituito.
+
+Il server di sviluppo di Werkzeug usa un thread nuovo per ogni richiesta,
+quindi le connessioni libere non sono legate a un thread: ognuna è usata da
+un thread alla volta (per questo sono aperte con check_same_thread=False).
+Dopo un fork il processo figlio riparte con un pool vuoto.
+"""
+from contextlib import contextmanager
+from collections import deque
+import os
+import sqlite3
+import threading
+import time
+
+# Connessioni libere tenute per ogni database
+POOL_MASSIMO = int(os.environ.get('DB_POOL_MASSIMO', 8))
+# Attesa massima su un database bloccato da un'altra scrittura
+BUSY_MS = int(os.environ.get('DB_BUSY_MS', 5000))
+# Cache delle pagine per connessione e dimensione della mappatura in memoria del file
+CACHE_KB = int(os.environ.get('DB_CACHE_KB', 8192))
+MMAP_MB = int(os.environ.get('DB_MMAP_MB', 64))
+# Età massima di una connessione e inattività dopo cui viene ricontrollata
+DURATA_MASSIMA = float(os.environ.get('DB_DURATA_MASSIMA', 600))
+CONTROLLO = float(os.environ.get('DB_CONTROLLO_SECONDI', 30))
+
+
+# Errori dopo cui la connessione resta utilizzabile
+ERRORI_RIUSABILI = (sqlite3.IntegrityError, sqlite3.OperationalError, sqlite3.ProgrammingError)
+
+
+class ConnessionePool(sqlite3.Connection):
+    """Connessione di un PoolConnessioni: close() la rimette nel pool."""
+
+    def close(self):
+        pool = getattr(self, '_pool', None)
+        if pool is None:
+            super().close()
+        else:
+            pool.rilascia(self)
+
+    def chiudi(self):
+        """Chiude davvero la connessione."""
+        self._pool = None
+        super().close()
+
+
+def configura(conn, busy_ms=BUSY_MS, cache_kb=CACHE_KB, mmap_mb=MMAP_MB):
+    """Imposta le PRAGMA comuni su una connessione appena aperta."""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(busy_ms)}")
+    conn.execute(f"PRAGMA cache_size={-int(cache_kb)}")
+    conn.execute(f"PRAGMA mmap_size={int(mmap_mb) * 2**20}")
+    return conn
+
+
+class PoolConnessioni:
+    """Connessioni libere (al massimo `massimo`) verso un database SQLite.
+
+    `riga` è la row_factory delle connessioni (es. sqlite3.Row),
+    `detect_types` viene passato a sqlite3.connect.
+    """
+
+    def __init__(self, path, massimo=POOL_MASSIMO, riga=None, detect_types=0,
+                 busy_ms=BUSY_MS, cache_kb=CACHE_KB, mmap_mb=MMAP_MB,
+                 durata_massima=DURATA_MASSIMA, controllo=CONTROLLO):
+        self.path = path
+        self.massimo = massimo
+        self.riga = riga
+        self.detect_types = detect_types
+        self.busy_ms = busy_ms
+        self.cache_kb = cache_kb
+        self.mmap_mb = mmap_mb
+        self.durata_massima = durata_massima
+        self.controllo = controllo
+        self.lock = threading.Lock()
+        self._libere = deque()
+        self._pid = os.getpid()
+        self.aperte = 0
+        self.prese = 0
+        self.trovate = 0
+        self.mancate = 0
+        self.riciclate = 0
+        self.scartate = 0
+
+    def apri(self):
+        """Connessione nuova e configurata, fuori dal pool (es. per un thread di scrittura)."""
+        conn = sqlite3.connect(self.path, timeout=self.busy_ms / 1000, detect_types=self.detect_types,
+                               check_same_thread=False, factory=ConnessionePool)
+        try:
+            configura(conn, self.busy_ms, self.cache_kb, self.mmap_mb)
+        except sqlite3.Error:
+            conn.chiudi()
+            raise
+        conn.row_factory = self.riga
+        conn._file = self._file()
+        conn._aperta = conn._usata = time.monotonic()
+        conn._pid = os.getpid()
+        return conn
+
+    def _file(self):
+        try:
+            stato = os.stat(self.path)
+        except OSError:
+            return None
+        return stato.st_dev, stato.st_ino
+
+    def prendi(self):
+        """Connessione dal pool, o nuova se non ce ne sono di valide."""
+        adesso = time.monotonic()
+        with self.lock:
+            if self._pid != os.getpid():
+                # Le connessioni aperte prima del fork restano al processo padre
+                self._libere.clear()
+                self.aperte = 0
+                self._pid = os.getpid()
+            self.prese += 1
+            conn = self._libere.pop() if self._libere else None
+        while conn is not None:
+            if adesso - conn._aperta > self.durata_massima:
+                self._scarta(conn, 'riciclate')
+            elif adesso - conn._usata > self.controllo and not self._valida(conn):
+                self._scarta(conn, 'scartate')
+            else:
+                with self.lock:
+                    self.trovate += 1
+                break
+            with self.lock:
+                conn = self._libere.pop() if self._libere else None
+        if conn is None:
+            conn = self.apri()
+            with self.lock:
+                self.mancate += 1
+                self.aperte += 1
+        conn._pool = self
+        return conn
+
+    def _valida(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        # Database cancellato o sostituito: la connessione vede ancora il file vecchio
+        return conn._file == self._file()
+
+    def _scarta(self, conn, contatore=None):
+        try:
+            conn.chiudi()
+        except sqlite3.Error:
+            pass
+        with self.lock:
+            self.aperte -= 1
+            if contatore is not None:
+                setattr(self, contatore, getattr(self, contatore) + 1)
+
+    def rilascia(self, conn, errore=None):
+        """Rimette `conn` nel pool annullando la transazione in corso.
+
+        Se `errore` (l'eccezione che ha interrotto l'uso) indica un database o
+        una connessione danneggiati, e non un vincolo violato, una query
+        sbagliata o un database occupato, la connessione viene chiusa invece
+        che riusata.
+        """
+        conn._pool = None
+        if conn._pid != os.getpid():
+            # Presa prima del fork: appartiene al processo padre
+            return
+        riusabile = not isinstance(errore, sqlite3.Error) or isinstance(errore, ERRORI_RIUSABILI)
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            riusabile = False
+        conn._usata = time.monotonic()
+        with self.lock:
+            if riusabile and len(self._libere) < self.massimo:
+                self._libere.append(conn)
+                return
+        # Pool già pieno di connessioni libere, oppure connessione da non riusare
+        self._scarta(conn, None if riusabile else 'scartate')
+
+    @contextmanager
+    def connessione(self):
+        """Connessione del pool per la durata del blocco with."""
+        conn = self.prendi()
+        try:
+            yield conn
+        except BaseException as e:
+            self.rilascia(conn, e)
+            raise
+        self.rilascia(conn)
+
+    def chiudi(self):
+        """Chiude le connessioni libere (quelle in uso ci tornano al rilascio)."""
+        with self.lock:
+            libere, self._libere = list(self._libere), deque()
+        for conn in libere:
+            self._scarta(conn)
+
+    def statistiche(self):
+        with self.lock:
+            return {
+                "database": os.path.basename(self.path),
+                "open": self.aperte,
+                "idle": len(self._libere),
+                "checkouts": self.prese,
+                "hits": self.trovate,
+                "misses": self.mancate,
+                "recycled": self.riciclate,
+                "discarded": self.scartate,
+            }
+
+
+_pool = {}
+_lock_pool = threading.Lock()
+
+
+def pool_per(path, riga=None, detect_types=0):
+    """Pool condiviso del processo per il database `path` (uno per row_factory e tipi)."""
+    chiave = (path, riga, detect_types)
+    with _lock_pool:
+        pool = _pool.get(chiave)
+        if pool is None:
+            pool = _pool[chiave] = PoolConnessioni(path, riga=riga, detect_types=detect_types)
+        return pool
+
+
+def statistiche():
+    """Contatori di tutti i pool creati con pool_per()."""
+    with _lock_pool:
+        pool = list(_pool.values())
+    return [p.statistiche() for p in pool]
@@ -8,6 +8,7 @@ from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import jwt  # PyJWT
 from functools import wraps
+from db import pool_per
 
 # SECURITY: logging config 
 logging.basicConfig(level=logging.INFO)
@@ -81,22 +82,24 @@ def init_db():
     except Exception as e:
         logging.exception(f"Errore nell'inizializzazione del database: {e}")
 
+def _pool_documenti():
+    db_path = os.path.abspath(os.path.join(BASE_DIR, app.config['DATABASE']))
+    # se il path era già assoluto nella config, os.path.abspath lo lascia intatto
+    return pool_per(db_path, riga=sqlite3.Row, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+
 def get_db():
     """Ottiene la connessione al database"""
     if 'db' not in g:
-        db_path = os.path.abspath(os.path.join(BASE_DIR, app.config['DATABASE']))
-        # se il path era già assoluto nella config, os.path.abspath lo lascia intatto
-        # SECURITY: sqlite connections per-request; don't reuse connections across threads
-        g.db = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES, check_same_thread=False)
-        g.db.row_factory = sqlite3.Row
+        # SECURITY: una connessione del pool per app context, usata da un solo thread alla volta
+        g.db = _pool_documenti().prendi()
     return g.db
 
 @app.teardown_appcontext
 def close_db(error):
-    """Chiude la connessione al database"""
+    """Rimette la connessione nel pool (chiusa, se l'errore della richiesta l'ha danneggiata)"""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        _pool_documenti().rilascia(db, error)
 
 def decode_jwt(token: str):
     try:
@@ -645,6 +648,16 @@ def api_review_draft(article_id):
         logging.exception('Unexpected error in api_review_draft')
         return jsonify({'success': False, 'message': 'Internal server error'}), 500
 
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """Stato del database e contatori del pool di connessioni"""
+    try:
+        count = get_db().execute('SELECT COUNT(*) FROM articles').fetchone()[0]
+    except sqlite3.Error as e:
+        logging.error(f"Health check failed: {e}")
+        return jsonify({'status': 'unhealthy', 'message': str(e)}), 500
+    return jsonify({'status': 'healthy', 'total_articles': count, 'db_pool': _pool_documenti().statistiche()})
+
 # wrapper di compatibilità per delete chiamate dal frontend
 @app.route('/api/delete/<int:article_id>', methods=['DELETE'])
 def api_delete_article(article_id):
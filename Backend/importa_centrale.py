@@ -0,0 +1,204 @@
+"""Importa vecchi file centrale.dat nello storico SQLite della centrale.
+
+Formati riconosciuti, una lettura per riga:
+    2024-05-01 12:05:00 21.5 55.0        (append_to_centrale_file)
+    2024-05-01T12:05:00.123456 21.5 55.0 (aggiorna_file, un valore per canale)
+Valori vuoti, 'nan' o 'None' sono canali non misurati.
+
+I file grandi vengono divisi in intervalli di byte allineati agli a capo e
+interpretati in parallelo da un pool di processi. Le letture con lo stesso
+timestamp vengono tenute una volta sola (vince l'ultima nell'ordine dei
+file), così come quelle già presenti nello storico o nei giorni sigillati.
+Il caricamento avviene in transazioni grandi e aggiorna anche rollup e percentili.
+
+Uso:
+    python importa_centrale.py centrale.dat vecchio/*.dat [--station centrale]
+        [--channels temperature,humidity] [--workers 4] [--database ../../database]
+
+Con la centrale in esecuzione le stazioni nuove compaiono dopo un riavvio.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+
+from centrale_archivio import Storico
+from centrale_blocchi import ArchivioBlocchi
+from centrale_percentili import Percentili
+from centrale_rollup import Rollup
+from centrale_stazioni import ALIAS_CANALI, CANALI, ID_VALIDO, path_file_stazione
+
+DATABASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'database')
+VALORI_MANCANTI = ('', 'nan', 'none', 'null', '-')
+DIMENSIONE_INTERVALLO = 8 << 20
+DIMENSIONE_TRANSAZIONE = 200000
+
+
+def _valore(campo):
+    return math.nan if campo.lower() in VALORI_MANCANTI else float(campo)
+
+
+def parse_riga(riga, n_canali):
+    """Restituisce (ts, [valori]) oppure solleva ValueError."""
+    campi = riga.split()
+    if len(campi) >= 2 and ':' in campi[1] and 'T' not in campi[0]:
+        # "data ora valori..." del salvataggio ogni 5 minuti
+        campi = [campi[0] + 'T' + campi[1]] + campi[2:]
+    if len(campi) < 2 or len(campi) > n_canali + 1:
+        raise ValueError("numero di campi errato")
+    ts = datetime.fromisoformat(campi[0]).timestamp()
+    valori = [_valore(c) for c in campi[1:]]
+    if all(math.isnan(v) for v in valori):
+        raise ValueError("nessun valore")
+    return ts, valori + [math.nan] * (n_canali - len(valori))
+
+
+def parse_intervallo(compito):
+    """Interpreta le righe di un file tra due offset (eseguito nei processi del pool).
+
+    Restituisce (ts, valori [n x canali], scartate, esempi di righe scartate).
+    """
+    path, inizio, fine, n_canali = compito
+    with open(path, 'rb') as f:
+        f.seek(inizio)
+        dati = f.read(fine - inizio)
+    ts, valori, scartate, esempi = [], [], 0, []
+    for riga in dati.decode('utf-8', errors='replace').splitlines():
+        if not riga.strip() or riga.lstrip().startswith('#'):
+            continue
+        try:
+            t, v = parse_riga(riga, n_canali)
+        except ValueError as e:
+            scartate += 1
+            if len(esempi) < 5:
+                esempi.append(f"{os.path.basename(path)}: {riga.strip()[:80]!r} ({e})")
+            continue
+        ts.append(t)
+        valori.append(v)
+    return (
+        np.array(ts, dtype=np.float64),
+        np.array(valori, dtype=np.float64).reshape(len(ts), n_canali),
+        scartate,
+        esempi,
+    )
+
+
+def intervalli_file(path, dimensione=DIMENSIONE_INTERVALLO):
+    """Divide il file in intervalli di circa `dimensione` byte che iniziano a inizio riga."""
+    totale = os.path.getsize(path)
+    confini = [0]
+    with open(path, 'rb') as f:
+        while confini[-1] + dimensione < totale:
+            f.seek(confini[-1] + dimensione)
+            f.readline()
+            if f.tell() >= totale:
+                break
+            confini.append(f.tell())
+    confini.append(totale)
+    return [(path, inizio, fine) for inizio, fine in zip(confini, confini[1:]) if fine > inizio]
+
+
+def _registra_stazione(directory, id, canali):
+    """Aggiunge la stazione (o i canali mancanti) a centrale_stazioni.json."""
+    path = os.path.join(directory, 'centrale_stazioni.json')
+    registrate = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            registrate = json.load(f)
+    presenti = registrate.setdefault(id, {"canali": []})["canali"]
+    presenti.extend(c for c in canali if c not in presenti)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(registrate, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _gia_presenti(storico, blocchi, stazione, ts):
+    """Maschera delle letture il cui timestamp (al ms) è già nello storico o nei blocchi."""
+    esistenti = [storico.intervallo(stazione, [], ts[0], ts[-1])[0]]
+    if blocchi is not None:
+        esistenti += [t for t, _ in blocchi.blocchi([], ts[0], ts[-1])]
+    esistenti = np.round(np.concatenate(esistenti) * 1000)
+    return np.isin(np.round(ts * 1000), esistenti)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--station', default=os.environ.get('CENTRALE_STAZIONE', 'centrale'))
+    parser.add_argument('--channels', default='temperature,humidity')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--database', default=DATABASE_DIR, help="cartella con centrale_storico.db")
+    args = parser.parse_args()
+
+    if not ID_VALIDO.match(args.station):
+        parser.error("id stazione non valido")
+    try:
+        canali = [ALIAS_CANALI[c.strip()] for c in args.channels.split(',') if c.strip()]
+    except KeyError as e:
+        parser.error(f"canale sconosciuto: {e.args[0]}")
+
+    inizio = time.perf_counter()
+    compiti = [
+        (path, da, a, len(canali))
+        for nome in args.files
+        for path, da, a in intervalli_file(nome)
+    ]
+    byte_totali = sum(a - da for _, da, a, _ in compiti)
+    print(f"{len(args.files)} file, {byte_totali / 1e6:.1f} MB in {len(compiti)} intervalli, {args.workers} processi")
+
+    with Pool(args.workers) as pool:
+        # map mantiene l'ordine dei compiti: serve a far vincere l'ultima lettura duplicata
+        risultati = pool.map(parse_intervallo, compiti)
+    righe = sum(len(r[0]) for r in risultati)
+    scartate = sum(r[2] for r in risultati)
+    esempi = [e for r in risultati for e in r[3]][:10]
+    lettura = time.perf_counter() - inizio
+    print(f"Interpretate {righe} righe ({scartate} scartate) in {lettura:.2f} s: {righe / max(lettura, 1e-9):.0f} righe/s")
+    for esempio in esempi:
+        print(f"  scartata: {esempio}")
+    if not righe:
+        return 1 if scartate else 0
+
+    ts = np.concatenate([r[0] for r in risultati])
+    valori = np.concatenate([r[1] for r in risultati])
+    # Duplicati: si tiene l'ultima occorrenza di ogni timestamp (al millisecondo)
+    chiavi = np.round(ts * 1000).astype(np.int64)
+    _, ultime = np.unique(chiavi[::-1], return_index=True)
+    tenute = len(ts) - 1 - ultime
+    ts, valori = ts[tenute], valori[tenute]
+    duplicate = righe - len(ts)
+
+    storico = Storico(os.path.join(args.database, 'centrale_storico.db'), CANALI)
+    blocchi_path = path_file_stazione(
+        args.database, args.station, os.environ.get('CENTRALE_STAZIONE', 'centrale'), '.gor')
+    blocchi = ArchivioBlocchi(blocchi_path) if os.path.exists(blocchi_path) else None
+    nuove = ~_gia_presenti(storico, blocchi, args.station, ts)
+    ts, valori = ts[nuove], valori[nuove]
+    print(f"Duplicate tra i file: {duplicate}, già presenti nello storico: {int((~nuove).sum())}")
+
+    inizio_caricamento = time.perf_counter()
+    rollup = Rollup(canali)
+    percentili = Percentili(canali)
+    for da in range(0, len(ts), DIMENSIONE_TRANSAZIONE):
+        blocco_ts = ts[da:da + DIMENSIONE_TRANSAZIONE]
+        colonne = {nome: valori[da:da + DIMENSIONE_TRANSAZIONE, i] for i, nome in enumerate(canali)}
+        storico.accoda_blocco(args.station, blocco_ts, colonne)
+        storico.accoda_rollup(args.station, rollup.aggiungi_blocco(blocco_ts, colonne))
+        storico.accoda_percentili(args.station, percentili.aggiungi_blocco(blocco_ts, colonne))
+    _registra_stazione(args.database, args.station, canali)
+    caricamento = time.perf_counter() - inizio_caricamento
+    totale = time.perf_counter() - inizio
+
+    print(f"Caricate {len(ts)} letture in {caricamento:.2f} s: {len(ts) / max(caricamento, 1e-9):.0f} righe/s")
+    print(f"Totale {totale:.2f} s, {righe / max(totale, 1e-9):.0f} righe/s; righe scartate: {scartate}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
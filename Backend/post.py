@@ -1,11 +1,11 @@
 from flask import Flask, request, jsonify 
 from flask_cors import CORS
 import os
-import sqlite3
 import logging
 import jwt
 from functools import wraps
 from datetime import datetime
+from db import pool_per
 
 app = Flask(__name__)
 cors_origins = os.environ.get('CORS_ORIGINS', '*')
@@ -21,27 +21,28 @@ if JWT_SECRET is None:
 
 # Percorso database
 db_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../database/post.db'))
+# Connessioni riusate tra le richieste (close() le rimette nel pool)
+pool_post = pool_per(db_path)
 
 def init_db():
     """Inizializza il database per gli eventi"""
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            titolo TEXT NOT NULL,
-            contenuto TEXT NOT NULL,
-            immagine TEXT,
-            data TEXT,
-            orario TEXT,
-            durata TEXT,
-            luogo TEXT,
-            indirizzo TEXT,
-            creato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    conn.commit()
-    conn.close()
+    with pool_post.connessione() as conn:
+        c = conn.cursor()
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                titolo TEXT NOT NULL,
+                contenuto TEXT NOT NULL,
+                immagine TEXT,
+                data TEXT,
+                orario TEXT,
+                durata TEXT,
+                luogo TEXT,
+                indirizzo TEXT,
+                creato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
 
 init_db()
 
@@ -137,16 +138,15 @@ def crea_post():
         if durata and isinstance(durata, (int, float)):
             durata = str(durata)
         
-        conn = sqlite3.connect(db_path, check_same_thread=False)
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO posts (titolo, contenuto, immagine, data, orario, durata, luogo, indirizzo)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (titolo, contenuto, immagine, data_evento, orario, durata, luogo, indirizzo))
-        
-        post_id = c.lastrowid
-        conn.commit()
-        conn.close()
+        with pool_post.connessione() as conn:
+            c = conn.cursor()
+            c.execute("""
+                INSERT INTO posts (titolo, contenuto, immagine, data, orario, durata, luogo, indirizzo)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (titolo, contenuto, immagine, data_evento, orario, durata, luogo, indirizzo))
+
+            post_id = c.lastrowid
+            conn.commit()
         
         logging.info(f"✅ Post creato con ID: {post_id}")
         return jsonify({
@@ -166,30 +166,28 @@ def crea_post():
 def leggi_post():
     """Legge tutti gli eventi"""
     try:
-        conn = sqlite3.connect(db_path, check_same_thread=False)
-        c = conn.cursor()
-        c.execute("""
-            SELECT id, titolo, contenuto, immagine, data, orario, durata, luogo, indirizzo 
-            FROM posts 
-            ORDER BY data DESC, id DESC
-        """)
-        
-        posts = [
-            {
-                'id': row[0],
-                'titolo': row[1],
-                'contenuto': row[2],
-                'immagine': row[3],
-                'data': row[4],
-                'orario': row[5],
-                'durata': row[6],
-                'luogo': row[7],
-                'indirizzo': row[8]
-            }
-            for row in c.fetchall()
-        ]
-        
-        conn.close()
+        with pool_post.connessione() as conn:
+            c = conn.cursor()
+            c.execute("""
+                SELECT id, titolo, contenuto, immagine, data, orario, durata, luogo, indirizzo 
+                FROM posts 
+                ORDER BY data DESC, id DESC
+            """)
+
+            posts = [
+                {
+                    'id': row[0],
+                    'titolo': row[1],
+                    'contenuto': row[2],
+                    'immagine': row[3],
+                    'data': row[4],
+                    'orario': row[5],
+                    'durata': row[6],
+                    'luogo': row[7],
+                    'indirizzo': row[8]
+                }
+                for row in c.fetchall()
+            ]
         
         logging.info(f"📊 Recuperati {len(posts)} eventi")
         return jsonify(posts)
@@ -205,16 +203,15 @@ def leggi_post():
 def get_post(post_id):
     """Recupera un evento specifico"""
     try:
-        conn = sqlite3.connect(db_path, check_same_thread=False)
-        c = conn.cursor()
-        c.execute("""
-            SELECT id, titolo, contenuto, immagine, data, orario, durata, luogo, indirizzo 
-            FROM posts 
-            WHERE id = ?
-        """, (post_id,))
-        
-        row = c.fetchone()
-        conn.close()
+        with pool_post.connessione() as conn:
+            c = conn.cursor()
+            c.execute("""
+                SELECT id, titolo, contenuto, immagine, data, orario, durata, luogo, indirizzo 
+                FROM posts 
+                WHERE id = ?
+            """, (post_id,))
+
+            row = c.fetchone()
         
         if row:
             post = {
@@ -262,24 +259,22 @@ def elimina_post(post_id):
                 'message': 'Solo gli amministratori possono eliminare eventi'
             }), 403
         
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        
-        # Prima verifica che l'evento esista
-        c.execute("SELECT id, titolo FROM posts WHERE id = ?", (post_id,))
-        post = c.fetchone()
-        
-        if not post:
-            conn.close()
-            return jsonify({
-                'success': False, 
-                'message': 'Evento non trovato'
-            }), 404
-        
-        # Elimina l'evento
-        c.execute("DELETE FROM posts WHERE id = ?", (post_id,))
-        conn.commit()
-        conn.close()
+        with pool_post.connessione() as conn:
+            c = conn.cursor()
+
+            # Prima verifica che l'evento esista
+            c.execute("SELECT id, titolo FROM posts WHERE id = ?", (post_id,))
+            post = c.fetchone()
+
+            if not post:
+                return jsonify({
+                    'success': False, 
+                    'message': 'Evento non trovato'
+                }), 404
+
+            # Elimina l'evento
+            c.execute("DELETE FROM posts WHERE id = ?", (post_id,))
+            conn.commit()
         
         logging.info(f"🗑️ Evento eliminato: ID={post_id}, Titolo={post[1]}")
         return jsonify({
@@ -347,27 +342,25 @@ def modifica_post(post_id):
         if len(contenuto) > 10000:
             return jsonify({'success': False, 'message': 'Contenuto troppo lungo (max 10000 caratteri)'}), 400
         
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        
-        # Verifica che l'evento esista
-        c.execute("SELECT id FROM posts WHERE id = ?", (post_id,))
-        if not c.fetchone():
-            conn.close()
-            return jsonify({
-                'success': False, 
-                'message': 'Evento non trovato'
-            }), 404
-        
-        # Aggiorna l'evento
-        c.execute("""
-            UPDATE posts 
-            SET titolo=?, contenuto=?, immagine=?, data=?, orario=?, durata=?, luogo=?, indirizzo=?
-            WHERE id=?
-        """, (titolo, contenuto, immagine, data_evento, orario, durata, luogo, indirizzo, post_id))
-        
-        conn.commit()
-        conn.close()
+        with pool_post.connessione() as conn:
+            c = conn.cursor()
+
+            # Verifica che l'evento esista
+            c.execute("SELECT id FROM posts WHERE id = ?", (post_id,))
+            if not c.fetchone():
+                return jsonify({
+                    'success': False, 
+                    'message': 'Evento non trovato'
+                }), 404
+
+            # Aggiorna l'evento
+            c.execute("""
+                UPDATE posts 
+                SET titolo=?, contenuto=?, immagine=?, data=?, orario=?, durata=?, luogo=?, indirizzo=?
+                WHERE id=?
+            """, (titolo, contenuto, immagine, data_evento, orario, durata, luogo, indirizzo, post_id))
+
+            conn.commit()
         
         logging.info(f"✏️ Evento modificato: ID={post_id}")
         return jsonify({
@@ -386,15 +379,13 @@ def modifica_post(post_id):
 def health_check():
     """Endpoint per health check"""
     try:
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='posts'")
-        tables = c.fetchall()
-        
-        c.execute("SELECT COUNT(*) FROM posts")
-        count = c.fetchone()[0]
-        
-        conn.close()
+        with pool_post.connessione() as conn:
+            c = conn.cursor()
+            c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='posts'")
+            tables = c.fetchall()
+
+            c.execute("SELECT COUNT(*) FROM posts")
+            count = c.fetchone()[0]
         
         if tables:
             return jsonify({
@@ -403,6 +394,7 @@ def health_check():
                 'database': 'connected',
                 'tables': len(tables),
                 'total_events': count,
+                'db_pool': pool_post.statistiche(),
                 'timestamp': datetime.now().isoformat()
             })
         else:
@@ -454,9 +446,8 @@ if __name__ == '__main__':
     # Controlla i permessi del database
     if os.path.exists(db_path):
         try:
-            conn = sqlite3.connect(db_path)
-            conn.close()
-            logging.info("✅ Connessione al database verificata")
+            with pool_post.connessione():
+                logging.info("✅ Connessione al database verificata")
         except Exception as e:
             logging.error(f"❌ Errore connessione database: {e}")
     
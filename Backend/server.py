@@ -8,6 +8,7 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 from requests_oauthlib import OAuth2Session
 from dotenv import load_dotenv
+from db import pool_per
 
 load_dotenv()
 
@@ -26,6 +27,8 @@ app.secret_key = os.environ.get('FLASK_SECRET_KEY', os.environ.get('SECRET_KEY',
 logging.basicConfig(level=logging.INFO)
 
 db_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../database/utenti.db'))
+# Connessioni riusate tra le richieste (close() le rimette nel pool)
+pool_utenti = pool_per(db_path)
 
 # Inizializzazione JWT
 if JWT_SECRET is None:
@@ -52,35 +55,34 @@ if GOOGLE_CLIENT_SECRET is None:
 
 def init_db():
     """Inizializza il database degli utenti"""
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome TEXT NOT NULL,
-            cognome TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            ruolo TEXT NOT NULL,
-            motivazione TEXT,
-            password TEXT NOT NULL,
-            anno INTEGER,
-            sezione TEXT,
-            creato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Crea un admin di default se non esiste
-    c.execute("SELECT COUNT(*) FROM users WHERE email = 'admin@dazeforfuture.it'")
-    if c.fetchone()[0] == 0 and ADMIN_PASSWORD:
-        hashed_pw = generate_password_hash(ADMIN_PASSWORD)
+    with pool_utenti.connessione() as conn:
+        c = conn.cursor()
         c.execute('''
-            INSERT INTO users (nome, cognome, email, ruolo, motivazione, password)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', ('Admin', 'System', 'admin@dazeforfuture.it', 'admin', 'Amministratore di sistema', hashed_pw))
-        logging.info("👑 Creato admin di default")
-    
-    conn.commit()
-    conn.close()
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nome TEXT NOT NULL,
+                cognome TEXT NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                ruolo TEXT NOT NULL,
+                motivazione TEXT,
+                password TEXT NOT NULL,
+                anno INTEGER,
+                sezione TEXT,
+                creato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Crea un admin di default se non esiste
+        c.execute("SELECT COUNT(*) FROM users WHERE email = 'admin@dazeforfuture.it'")
+        if c.fetchone()[0] == 0 and ADMIN_PASSWORD:
+            hashed_pw = generate_password_hash(ADMIN_PASSWORD)
+            c.execute('''
+                INSERT INTO users (nome, cognome, email, ruolo, motivazione, password)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', ('Admin', 'System', 'admin@dazeforfuture.it', 'admin', 'Amministratore di sistema', hashed_pw))
+            logging.info("👑 Creato admin di default")
+
+        conn.commit()
 
 # --- Gestione errori ---
 @app.errorhandler(403)
@@ -130,32 +132,30 @@ def register():
         
         hashed_pw = generate_password_hash(password)
         
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        
-        try:
-            c.execute('''
-                INSERT INTO users (nome, cognome, email, ruolo, motivazione, password, anno, sezione)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (nome, cognome, email, ruolo, motivazione, hashed_pw, anno, sezione))
-            conn.commit()
-            
-            logging.info(f"✅ Nuovo utente registrato: {email} ({ruolo})")
-            
-            return jsonify({
-                'success': True, 
-                'message': 'Registrazione avvenuta con successo',
-                'email': email,
-                'ruolo': ruolo
-            })
-            
-        except sqlite3.IntegrityError:
-            return jsonify({
-                'success': False, 
-                'message': 'Email già registrata'
-            }), 409
-        finally:
-            conn.close()
+        with pool_utenti.connessione() as conn:
+            c = conn.cursor()
+
+            try:
+                c.execute('''
+                    INSERT INTO users (nome, cognome, email, ruolo, motivazione, password, anno, sezione)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (nome, cognome, email, ruolo, motivazione, hashed_pw, anno, sezione))
+                conn.commit()
+
+                logging.info(f"✅ Nuovo utente registrato: {email} ({ruolo})")
+
+                return jsonify({
+                    'success': True, 
+                    'message': 'Registrazione avvenuta con successo',
+                    'email': email,
+                    'ruolo': ruolo
+                })
+
+            except sqlite3.IntegrityError:
+                return jsonify({
+                    'success': False, 
+                    'message': 'Email già registrata'
+                }), 409
             
     except Exception as e:
         logging.error(f"❌ Errore nella registrazione: {e}")
@@ -179,11 +179,10 @@ def login():
                 'message': 'Email e password sono obbligatori'
             }), 400
         
-        conn = sqlite3.connect(db_path, check_same_thread=False)
-        c = conn.cursor()
-        c.execute('SELECT password, ruolo, nome, cognome FROM users WHERE email = ?', (email,))
-        row = c.fetchone()
-        conn.close()
+        with pool_utenti.connessione() as conn:
+            c = conn.cursor()
+            c.execute('SELECT password, ruolo, nome, cognome FROM users WHERE email = ?', (email,))
+            row = c.fetchone()
         
         if row and check_password_hash(row[0], password):
             # Genera token JWT
@@ -331,21 +330,21 @@ def google_callback():
             nome = nome_completo
             cognome = 'GoogleUser'
         
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        c.execute('SELECT id, ruolo, motivazione FROM users WHERE email = ?', (email,))
-        row = c.fetchone()
+        with pool_utenti.connessione() as conn:
+            c = conn.cursor()
+            c.execute('SELECT id, ruolo, motivazione FROM users WHERE email = ?', (email,))
+            row = c.fetchone()
+
+            if not row:
+                # Nuovo utente
+                c.execute('''
+                    INSERT INTO users (nome, cognome, email, ruolo, motivazione, password)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (nome, cognome, email, 'user', 'REGISTRAZIONE_DA_COMPLETARE',
+                      generate_password_hash(os.urandom(16).hex())))
+                conn.commit()
         
         if not row:
-            # Nuovo utente
-            c.execute('''
-                INSERT INTO users (nome, cognome, email, ruolo, motivazione, password)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (nome, cognome, email, 'user', 'REGISTRAZIONE_DA_COMPLETARE',
-                  generate_password_hash(os.urandom(16).hex())))
-            conn.commit()
-            conn.close()
-            
             session['google_pending_email'] = email
             session['google_pending_nome'] = nome
             session['google_pending_cognome'] = cognome
@@ -353,7 +352,6 @@ def google_callback():
             return redirect(f'/completa_registrazione.html?email={email}&nome={nome}+{cognome}')
         else:
             user_id, ruolo, motivazione = row
-            conn.close()
             
             if motivazione == 'REGISTRAZIONE_DA_COMPLETARE':
                 session['google_pending_email'] = email
@@ -433,50 +431,46 @@ def complete_google_registration():
         anno = data.get('anno')
         sezione = data.get('sezione')
         
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        c.execute('SELECT id, motivazione FROM users WHERE email = ?', (email,))
-        user = c.fetchone()
-        
-        if not user:
-            conn.close()
-            return jsonify({
-                'success': False, 
-                'message': 'Utente non trovato'
-            }), 404
-        
-        user_id, current_motivazione = user
-        
-        if current_motivazione != 'REGISTRAZIONE_DA_COMPLETARE':
-            conn.close()
-            return jsonify({
-                'success': False, 
-                'message': 'Registrazione già completata'
-            }), 400
-        
-        if is_admin:
-            if admin_password != ADMIN_PASSWORD:
-                conn.close()
+        with pool_utenti.connessione() as conn:
+            c = conn.cursor()
+            c.execute('SELECT id, motivazione FROM users WHERE email = ?', (email,))
+            user = c.fetchone()
+
+            if not user:
                 return jsonify({
                     'success': False, 
-                    'message': 'Password amministratore errata'
-                }), 403
-            ruolo_finale = 'admin'
-        else:
-            ruolo_finale = ruolo
-        
-        if not motivazione or motivazione.strip() == '':
-            motivazione_finale = f"Registrato via Google - {ruolo_finale}"
-        else:
-            motivazione_finale = motivazione
-        
-        c.execute('''
-            UPDATE users 
-            SET nome = ?, cognome = ?, ruolo = ?, motivazione = ?, anno = ?, sezione = ?
-            WHERE email = ?
-        ''', (nome, cognome, ruolo_finale, motivazione_finale, anno, sezione, email))
-        conn.commit()
-        conn.close()
+                    'message': 'Utente non trovato'
+                }), 404
+
+            user_id, current_motivazione = user
+
+            if current_motivazione != 'REGISTRAZIONE_DA_COMPLETARE':
+                return jsonify({
+                    'success': False, 
+                    'message': 'Registrazione già completata'
+                }), 400
+
+            if is_admin:
+                if admin_password != ADMIN_PASSWORD:
+                    return jsonify({
+                        'success': False, 
+                        'message': 'Password amministratore errata'
+                    }), 403
+                ruolo_finale = 'admin'
+            else:
+                ruolo_finale = ruolo
+
+            if not motivazione or motivazione.strip() == '':
+                motivazione_finale = f"Registrato via Google - {ruolo_finale}"
+            else:
+                motivazione_finale = motivazione
+
+            c.execute('''
+                UPDATE users 
+                SET nome = ?, cognome = ?, ruolo = ?, motivazione = ?, anno = ?, sezione = ?
+                WHERE email = ?
+            ''', (nome, cognome, ruolo_finale, motivazione_finale, anno, sezione, email))
+            conn.commit()
         
         # Genera token JWT
         payload = {
@@ -530,30 +524,28 @@ def get_users():
                 'message': 'Token non valido'
             }), 401
         
-        conn = sqlite3.connect(db_path, check_same_thread=False)
-        c = conn.cursor()
-        c.execute('''
-            SELECT id, nome, cognome, email, ruolo, motivazione, anno, sezione, creato_il
-            FROM users 
-            ORDER BY creato_il DESC
-        ''')
-        
-        users = [
-            {
-                'id': row[0],
-                'nome': row[1],
-                'cognome': row[2],
-                'email': row[3],
-                'ruolo': row[4],
-                'motivazione': row[5],
-                'anno': row[6],
-                'sezione': row[7],
-                'creato_il': row[8]
-            }
-            for row in c.fetchall()
-        ]
-        
-        conn.close()
+        with pool_utenti.connessione() as conn:
+            c = conn.cursor()
+            c.execute('''
+                SELECT id, nome, cognome, email, ruolo, motivazione, anno, sezione, creato_il
+                FROM users 
+                ORDER BY creato_il DESC
+            ''')
+
+            users = [
+                {
+                    'id': row[0],
+                    'nome': row[1],
+                    'cognome': row[2],
+                    'email': row[3],
+                    'ruolo': row[4],
+                    'motivazione': row[5],
+                    'anno': row[6],
+                    'sezione': row[7],
+                    'creato_il': row[8]
+                }
+                for row in c.fetchall()
+            ]
         return jsonify({
             'success': True, 
             'users': users, 
@@ -572,21 +564,20 @@ def get_users():
 def health_check():
     """Endpoint per health check"""
     try:
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        tables = c.fetchall()
-        
-        c.execute("SELECT COUNT(*) FROM users")
-        count = c.fetchone()[0]
-        
-        conn.close()
+        with pool_utenti.connessione() as conn:
+            c = conn.cursor()
+            c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
+            tables = c.fetchall()
+
+            c.execute("SELECT COUNT(*) FROM users")
+            count = c.fetchone()[0]
         
         return jsonify({
             'status': 'healthy', 
             'service': 'main_server',
             'database': 'connected',
             'total_users': count,
+            'db_pool': pool_utenti.statistiche(),
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e: